@@ -0,0 +1,125 @@
+# admission_control.py
+# Proteção contra picos: chamadas idênticas em voo viram uma só (single-flight) e cada
+# recurso (requisições da API, LLM, embeddings) tem vagas e fila limitadas
+#
+# Num incidente, dezenas de usuários mandam a mesma pergunta em segundos. Em vez de cada
+# um fazer a própria triagem, busca e geração (e estourar o limite do Gemini), a primeira
+# chamada de cada etapa vai ao modelo e as demais esperam o mesmo resultado. Quando mesmo
+# assim a demanda passa da capacidade, a fila tem tamanho máximo: quem chega com ela cheia
+# (ou espera demais) recebe na hora um 503/429 com Retry-After, em vez de um timeout.
+import math
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from metrics import ADMISSAO_EM_USO, ADMISSAO_FILA, ADMISSAO_REJEICOES, SINGLE_FLIGHT, registrar_span
+
+
+class Sobrecarga(Exception):
+    """Sem vaga no limite `limite`; a API responde `status_http` com o header Retry-After."""
+
+    def __init__(self, limite: str, status_http: int, retry_after: int, motivo: str):
+        super().__init__(f"Capacidade esgotada em '{limite}' ({motivo}); tente de novo em {retry_after}s.")
+        self.limite = limite
+        self.status_http = status_http
+        self.retry_after = retry_after
+        self.motivo = motivo
+
+
+class LimiteConcorrencia:
+    """Semáforo com fila limitada: `async with limite: ...`
+
+    Até `concorrencia` chamadas ao mesmo tempo; até `fila_max` esperando, cada uma por no
+    máximo `espera_max` segundos. O Retry-After é estimado pelo intervalo médio entre
+    liberações de vaga vezes a posição na fila. A espera na fila vira o span ("fila", nome),
+    separado da duração da chamada em si.
+    """
+
+    def __init__(self, nome: str, concorrencia: int, fila_max: int, espera_max: float, status_http: int = 503):
+        self.nome = nome
+        self.concorrencia = concorrencia
+        self.fila_max = fila_max
+        self.espera_max = espera_max
+        self.status_http = status_http
+        self._semaforo = asyncio.Semaphore(concorrencia)
+        self.em_uso = 0
+        self.na_fila = 0
+        self._intervalo_medio = 1.0 # s entre liberações (média móvel exponencial)
+        self._ultima_liberacao = None
+
+    def retry_after(self) -> int:
+        return max(1, min(60, math.ceil((self.na_fila + 1) * self._intervalo_medio)))
+
+    def lotado(self) -> bool:
+        return self._semaforo.locked() and self.na_fila >= self.fila_max
+
+    def verificar(self):
+        """Recusa já (Sobrecarga) se não houver lugar na fila; não reserva vaga."""
+        if self.lotado():
+            self._rejeitar("fila_cheia")
+
+    def _rejeitar(self, motivo: str):
+        ADMISSAO_REJEICOES.incrementar(1, self.nome, motivo)
+        raise Sobrecarga(self.nome, self.status_http, self.retry_after(), motivo)
+
+    def _publicar(self):
+        ADMISSAO_EM_USO.definir(self.em_uso, self.nome)
+        ADMISSAO_FILA.definir(self.na_fila, self.nome)
+
+    async def __aenter__(self):
+        self.verificar()
+        self.na_fila += 1
+        self._publicar()
+        inicio = time.perf_counter()
+        adquirida = False
+        try:
+            # asyncio.timeout cancela o próprio acquire(), que devolve a vaga se já a tinha recebido
+            # (com wait_for, no 3.11, uma vaga obtida junto com o timeout podia se perder)
+            async with asyncio.timeout(self.espera_max):
+                await self._semaforo.acquire()
+                adquirida = True
+        except TimeoutError:
+            if adquirida:
+                self._semaforo.release()
+            self._rejeitar("espera_longa")
+        finally:
+            self.na_fila -= 1
+            registrar_span("fila", self.nome, time.perf_counter() - inicio)
+        self.em_uso += 1
+        self._publicar()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.em_uso -= 1
+        self._semaforo.release()
+        agora = time.monotonic()
+        if self._ultima_liberacao is not None:
+            intervalo = min(agora - self._ultima_liberacao, self.espera_max)
+            self._intervalo_medio = 0.8 * self._intervalo_medio + 0.2 * intervalo
+        self._ultima_liberacao = agora
+        self._publicar()
+        return False
+
+
+class SingleFlight:
+    """Junta chamadas idênticas em voo: a primeira executa, as outras aguardam o mesmo resultado.
+
+    A chamada roda numa tarefa própria, então o cancelamento de quem a iniciou (cliente que
+    desconectou) não derruba os que estão esperando. Nada fica guardado depois que ela termina:
+    isso é papel dos caches.
+    """
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+        self._em_voo: Dict[Hashable, asyncio.Task] = {}
+
+    async def executar(self, chave: Hashable, fabrica: Callable[[], Awaitable[Any]]) -> Any:
+        tarefa = self._em_voo.get(chave)
+        if tarefa is None:
+            SINGLE_FLIGHT.incrementar(1, self.etapa, "lider")
+            tarefa = asyncio.create_task(fabrica())
+            self._em_voo[chave] = tarefa
+            tarefa.add_done_callback(lambda _: self._em_voo.pop(chave, None))
+        else:
+            SINGLE_FLIGHT.incrementar(1, self.etapa, "seguidor")
+        return await asyncio.shield(tarefa)
@@ -0,0 +1,130 @@
+# answer_cache.py
+# Cache de respostas do /chat: texto normalizado (exato) + vizinho mais próximo do embedding (semântico)
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import registrar_cache
+
+# Versões anteriores do índice lembradas (requisições que começaram antes de uma troca a quente);
+# uma requisição presa a uma versão ainda mais antiga que isso é rara e só limparia o cache
+VERSOES_ANTIGAS_MAX = 16
+
+
+def normalizar_pergunta(texto: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação: 'Como importo a NF-e?' == 'como importo a nf e'."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"\W+", " ", texto.lower()).strip()
+
+
+class AnswerCache:
+    """Cache LRU com TTL e dois níveis de busca, invalidado quando a versão do índice muda.
+
+    - exato: texto normalizado da pergunta;
+    - semântico: similaridade de cosseno entre embeddings >= similarity_threshold.
+
+    Uma consulta pode passar pelos dois níveis; quem consulta informa o resultado final
+    uma única vez com contar(), para a taxa de acerto não contar a mesma pergunta duas vezes.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray, Any]]" = OrderedDict()
+        self._versao: Optional[str] = None
+        self._versoes_antigas: "deque[str]" = deque(maxlen=VERSOES_ANTIGAS_MAX)
+        # Matriz de embeddings (uma linha por entrada), refeita só quando o cache muda
+        self._matriz: Optional[np.ndarray] = None
+        self._chaves: List[str] = []
+        self.hits_exatos = self.hits_semanticos = self.misses = 0
+
+    def _checar_versao(self, versao: str) -> bool:
+        """Limpa o cache quando chega uma versão nova do índice.
+
+        Durante uma troca a quente, requisições iniciadas antes dela ainda usam a versão
+        anterior; elas não leem nem gravam no cache (retorna False), em vez de apagá-lo.
+        """
+        if versao == self._versao:
+            return True
+        if versao in self._versoes_antigas:
+            return False
+        if self._versao is not None:
+            self._versoes_antigas.append(self._versao)
+        self._entries.clear()
+        self._matriz = None
+        self._versao = versao
+        return True
+
+    def _expirar(self):
+        limite = time.monotonic() - self.ttl
+        expiradas = [k for k, (criado, _, _) in self._entries.items() if criado < limite]
+        for k in expiradas:
+            del self._entries[k]
+        if expiradas:
+            self._matriz = None
+
+    def get_exato(self, pergunta: str, versao: str) -> Optional[Any]:
+        chave = normalizar_pergunta(pergunta)
+        with self._lock:
+            if not self._checar_versao(versao):
+                return None
+            entrada = self._entries.get(chave)
+            if entrada is None or entrada[0] < time.monotonic() - self.ttl:
+                return None
+            self._entries.move_to_end(chave)
+            return entrada[2]
+
+    def get_semantico(self, embedding: List[float], versao: str) -> Optional[Any]:
+        vetor = self._unitario(embedding)
+        with self._lock:
+            if not self._checar_versao(versao):
+                return None
+            self._expirar()
+            if not self._entries:
+                return None
+            if self._matriz is None:
+                self._chaves = list(self._entries.keys())
+                self._matriz = np.stack([self._entries[k][1] for k in self._chaves])
+            similaridades = self._matriz @ vetor
+            melhor = int(np.argmax(similaridades))
+            if similaridades[melhor] < self.similarity_threshold:
+                return None
+            chave = self._chaves[melhor]
+            self._entries.move_to_end(chave)
+            return self._entries[chave][2]
+
+    def contar(self, resultado: str):
+        """Resultado final de uma consulta (HIT_EXATO, HIT_SEMANTICO ou MISS), aqui e no /metrics."""
+        with self._lock:
+            if resultado == "HIT_EXATO":
+                self.hits_exatos += 1
+            elif resultado == "HIT_SEMANTICO":
+                self.hits_semanticos += 1
+            else:
+                self.misses += 1
+        registrar_cache(resultado)
+
+    def put(self, pergunta: str, embedding: List[float], versao: str, valor: Any):
+        chave = normalizar_pergunta(pergunta)
+        with self._lock:
+            if not self._checar_versao(versao):
+                return
+            self._entries[chave] = (time.monotonic(), self._unitario(embedding), valor)
+            self._entries.move_to_end(chave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matriz = None
+
+    @staticmethod
+    def _unitario(embedding: List[float]) -> np.ndarray:
+        vetor = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vetor)
+        return vetor / norma if norma > 0 else vetor
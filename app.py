@@ -3,7 +3,12 @@ import streamlit as st
 import requests
 import json
 import os
+import io
+import itertools
+import threading
 import time  
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -116,10 +121,123 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- ENDPOINTS DA API ---
-API_BASE_URL = "http://127.0.0.1:8000"
-CHAT_ENDPOINT = f"{API_BASE_URL}/chat"
+API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
+CHAT_STREAM_ENDPOINT = f"{API_BASE_URL}/chat/stream"
 ANALYZE_ENDPOINT = f"{API_BASE_URL}/analyze_image"
 
+# Timeouts (s) de conexão e de leitura (entre dois pedaços da resposta, no streaming)
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 5))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", 120))
+TIMEOUT = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+# Cache das imagens da documentação, em bytes (os nomes são o hash do conteúdo: nunca mudam)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("APP_IMAGE_CACHE_MAX_BYTES", 64 * 2**20))
+# Mensagens do histórico desenhadas a cada rerun; as anteriores ficam atrás de um botão
+HISTORICO_PAGINA = int(os.getenv("APP_HISTORICO_PAGINA", 20))
+PREVIEW_MAX_SIDE = 400 # Lado maior da prévia das imagens enviadas, guardada no histórico
+
+@st.cache_resource
+def obter_sessao() -> requests.Session:
+    """Uma Session (pool de conexões keep-alive) para todo o processo do Streamlit."""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    return sessao
+
+class CacheImagens:
+    """LRU de bytes por URL, limitado pelo total de bytes guardados."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._itens: "OrderedDict[str, bytes]" = OrderedDict()
+        self._total = 0
+
+    def get(self, url: str):
+        with self._lock:
+            dados = self._itens.get(url)
+            if dados is not None:
+                self._itens.move_to_end(url)
+            return dados
+
+    def put(self, url: str, dados: bytes):
+        if len(dados) > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._itens:
+                return
+            self._itens[url] = dados
+            self._total += len(dados)
+            while self._total > self.max_bytes:
+                _, antigo = self._itens.popitem(last=False)
+                self._total -= len(antigo)
+
+@st.cache_resource
+def obter_cache_imagens() -> CacheImagens:
+    return CacheImagens(IMAGE_CACHE_MAX_BYTES)
+
+def baixar_imagem(url: str):
+    """Bytes da imagem da documentação, baixada uma única vez por URL (None se falhar)."""
+    cache = obter_cache_imagens()
+    dados = cache.get(url)
+    if dados is None:
+        try:
+            response = obter_sessao().get(url, timeout=TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+        dados = response.content
+        cache.put(url, dados)
+    return dados
+
+def gerar_previa(image_bytes: bytes) -> bytes:
+    """Prévia JPEG pequena, gerada uma vez no envio; o histórico nunca redecodifica o original."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as imagem:
+            imagem.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+            saida = io.BytesIO()
+            imagem.convert("RGB").save(saida, format="JPEG", quality=80)
+            return saida.getvalue()
+    except Exception:
+        return image_bytes
+
+def exibir_imagens_documentacao(imagens, miniaturas=None):
+    """Mostra as miniaturas em até 3 colunas, com link para a imagem em resolução original."""
+    st.markdown("**Imagens relevantes da documentação:**")
+    # Mensagens antigas podem não ter miniaturas; nesse caso usa a imagem original
+    miniaturas = miniaturas or imagens
+    # Garante que o número de colunas seja ajustado dinamicamente e seguro
+    num_cols = min(len(imagens), 3)  # Limita a 3 colunas por linha
+    cols = st.columns(num_cols)
+    for i, (img_url, thumb_url) in enumerate(zip(imagens, miniaturas)):
+        if img_url:  # Verifica se a URL não está vazia
+            miniatura = baixar_imagem(thumb_url)
+            if miniatura is not None:
+                cols[i % num_cols].image(miniatura, use_container_width=True)
+            cols[i % num_cols].markdown(f"[🔍 Ver em tamanho original]({img_url})")
+        else:
+            st.warning("URL de imagem inválida ou ausente.")
+
+def exibir_citacoes(citacoes):
+    with st.expander("Ver referências de texto"):
+        for c in citacoes:
+            st.info(f"**📄 Documento:** `{c['documento']}` (Página: {c['pagina']})\n\n> _{c['trecho']}_")
+
+def mensagem_de_erro(detalhe: str, retry_after=None) -> str:
+    # API lotada (503/429): diz ao usuário quando tentar de novo
+    if retry_after:
+        return f"{detalhe} Tente de novo em {retry_after} s."
+    return detalhe
+
+def erro_da_resposta(response: requests.Response) -> str:
+    try:
+        detalhe = response.json().get("detail", response.text)
+    except ValueError:
+        detalhe = response.text
+    return mensagem_de_erro(str(detalhe), response.headers.get("Retry-After"))
+
 # --- SIDEBAR PARA UPLOADER E CONTROLES ---
 with st.sidebar:
     st.subheader("Analisar um Print de Tela")
@@ -134,12 +252,16 @@ with st.sidebar:
     )
     
     if uploaded_file:
-        image_bytes = uploaded_file.getvalue()
-        st.image(image_bytes, caption="Pré-visualização da imagem a ser analisada.")
+        # A prévia é gerada uma vez por arquivo enviado, não a cada rerun
+        chave_upload = (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get("previa_upload", (None,))[0] != chave_upload:
+            st.session_state.previa_upload = (chave_upload, gerar_previa(uploaded_file.getvalue()))
+        st.image(st.session_state.previa_upload[1], caption="Pré-visualização da imagem a ser analisada.")
     
     st.divider()
     if st.button("Limpar Conversa", key="clear_chat"):
         st.session_state.messages = []
+        st.session_state.historico_visivel = HISTORICO_PAGINA
         st.session_state.uploader_key += 1
         st.rerun()
 
@@ -153,9 +275,17 @@ chat_container = st.container(height=500)
 # Inicializa o histórico do chat na sessão
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "historico_visivel" not in st.session_state:
+    st.session_state.historico_visivel = HISTORICO_PAGINA
+
+# Só as últimas mensagens são desenhadas: o custo de cada rerun não cresce com a conversa
+ocultas = max(0, len(st.session_state.messages) - st.session_state.historico_visivel)
+if ocultas and chat_container.button(f"Carregar mensagens anteriores ({ocultas})", key="carregar_anteriores"):
+    st.session_state.historico_visivel += HISTORICO_PAGINA
+    st.rerun()
 
 # Exibe as mensagens do histórico
-for message in st.session_state.messages:
+for message in st.session_state.messages[ocultas:]:
     with chat_container.chat_message(message["role"], avatar="🧑‍💻" if message["role"] == "user" else "🤖"):
         # Exibe o prompt/imagem que o usuário enviou
         if "prompt" in message:
@@ -167,22 +297,11 @@ for message in st.session_state.messages:
         if "content" in message:
             st.markdown(message["content"])
         if "imagens_resposta" in message and message["imagens_resposta"]:
-            st.markdown("**Imagens relevantes da documentação:**")
-            # Garante que o número de colunas seja ajustado dinamicamente e seguro
-            num_images = len(message["imagens_resposta"])
-            num_cols = min(num_images, 3)  # Limita a 3 colunas por linha
-            cols = st.columns(num_cols)
-            for i, img_url in enumerate(message["imagens_resposta"]):
-                if img_url:  # Verifica se a URL não está vazia
-                    cols[i % num_cols].image(img_url, use_container_width=True, output_format="PNG")
-                else:
-                    st.warning("URL de imagem inválida ou ausente.")
+            exibir_imagens_documentacao(message["imagens_resposta"], message.get("miniaturas_resposta"))
         
         # Mostra as citações de texto
         if "citacoes" in message and message["citacoes"]:
-            with st.expander("Ver referências de texto"):
-                for c in message["citacoes"]:
-                    st.info(f"**📄 Documento:** `{c['documento']}` (Página: {c['pagina']})\n\n> _{c['trecho']}_")
+            exibir_citacoes(message["citacoes"])
 
 # Captura a entrada do usuário (caixa de texto no final da página)
 prompt = st.chat_input("Digite sua dúvida ou descreva a imagem...")
@@ -194,26 +313,31 @@ if prompt:
     
     # Se uma imagem foi enviada, o prompt é para análise de imagem
     if image_bytes:
-        # Adiciona a mensagem do usuário (com imagem) ao histórico
-        user_message = {"role": "user", "prompt": prompt, "image": image_bytes}
+        # O histórico guarda só a prévia pequena (já gerada na sidebar); o original vai para a API
+        previa = st.session_state.get("previa_upload", (None, None))[1] or gerar_previa(image_bytes)
+        user_message = {"role": "user", "prompt": prompt, "image": previa}
         st.session_state.messages.append(user_message)
         
         with chat_container.chat_message("user", avatar="🧑‍💻"):
             st.markdown(prompt)
-            st.image(image_bytes, caption="Você enviou:", use_container_width=False, width=400)
+            st.image(previa, caption="Você enviou:", use_container_width=False, width=400)
             
         with chat_container.chat_message("assistant", avatar="🤖"):
             with st.spinner("Analisando a imagem..."):
                 files = {'image_file': (uploaded_file.name, image_bytes, uploaded_file.type)}
-                response = requests.post(ANALYZE_ENDPOINT, data={'pergunta': prompt}, files=files)
-                
-                if response.status_code == 200:
+                try:
+                    response = obter_sessao().post(ANALYZE_ENDPOINT, data={'pergunta': prompt}, files=files, timeout=TIMEOUT)
+                except requests.RequestException as e:
+                    response = None
+                    st.error(f"Erro na análise: a API não respondeu ({e.__class__.__name__}).")
+
+                if response is not None and response.status_code == 200:
                     analise = response.json().get("analise", "Não foi possível analisar a imagem.")
                     st.markdown(analise)
                     assistant_message = {"role": "assistant", "content": analise}
                     st.session_state.messages.append(assistant_message)
-                else:
-                    st.error(f"Erro na análise: {response.text}")
+                elif response is not None:
+                    st.error(f"Erro na análise: {erro_da_resposta(response)}")
 
     # Se não houver imagem, é um chat normal (RAG)
     else:
@@ -224,35 +348,63 @@ if prompt:
             st.markdown(prompt)
 
         with chat_container.chat_message("assistant", avatar="🤖"):
+            # A resposta chega em NDJSON: triagem, tokens e, no fim, o estado completo
             with st.spinner("Analisando sua dúvida..."):
-                response = requests.post(CHAT_ENDPOINT, json={"pergunta": prompt})
+                try:
+                    response = obter_sessao().post(CHAT_STREAM_ENDPOINT, json={"pergunta": prompt},
+                                                   stream=True, timeout=TIMEOUT)
+                    response.encoding = "utf-8"
+                    eventos = response.iter_lines(decode_unicode=True)
+                    # Segura o spinner só até o primeiro evento (triagem) chegar
+                    primeiro_evento = next(eventos, None) if response.status_code == 200 else None
+                except requests.RequestException as e:
+                    response = None
+                    st.error(f"Erro no chat: a API não respondeu ({e.__class__.__name__}).")
+
+            if response is not None and response.status_code == 200:
+                placeholder = st.empty()
+                texto_parcial, data, erro = "", {}, None
+                try:
+                    for linha in itertools.chain([primeiro_evento], eventos):
+                        if not linha:
+                            continue
+                        evento = json.loads(linha)
+                        if evento["tipo"] == "token":
+                            texto_parcial += evento["texto"]
+                            placeholder.markdown(texto_parcial + "▌")
+                        elif evento["tipo"] == "fim":
+                            data = evento
+                        elif evento["tipo"] == "erro":
+                            # Recusa depois do início do stream (fila da API cheia)
+                            erro = mensagem_de_erro(evento.get("detalhe", "erro na API."), evento.get("retry_after"))
+                except requests.RequestException:
+                    pass # Tratado abaixo como resposta interrompida
+                finally:
+                    response.close() # Devolve a conexão ao pool
 
-                if response.status_code == 200:
-                    data = response.json()
+                if data:
                     resposta = data.get("resposta", "Desculpe, ocorreu um erro.")
                     citacoes = data.get("citacoes", [])
                     imagens_rag = [f"{API_BASE_URL}{p}" for p in data.get("imagens", [])]
+                    miniaturas_rag = [f"{API_BASE_URL}{p}" for p in data.get("miniaturas", [])]
                     
-                    st.markdown(resposta)
+                    # Substitui o texto parcial pela resposta final (pode ter virado abertura de chamado)
+                    placeholder.markdown(resposta)
                     if imagens_rag:
-                        st.markdown("**Imagens relevantes da documentação:**")
-                        num_cols = min(len(imagens_rag), 3)
-                        cols = st.columns(num_cols)
-                        for i, img_url in enumerate(imagens_rag):
-                            if img_url:  # Verifica se a URL não está vazia
-                                cols[i % num_cols].image(img_url, use_container_width=True, output_format="PNG")
-                            else:
-                                st.warning("URL de imagem inválida ou ausente.")
+                        exibir_imagens_documentacao(imagens_rag, miniaturas_rag)
                     
                     if citacoes:
-                        with st.expander("Ver referências de texto"):
-                            for c in citacoes:
-                                st.info(f"**📄 Documento:** `{c['documento']}` (Página: {c['pagina']})\n\n> _{c['trecho']}_")
+                        exibir_citacoes(citacoes)
 
-                    assistant_message = {"role": "assistant", "content": resposta, "citacoes": citacoes, "imagens_resposta": imagens_rag}
+                    assistant_message = {"role": "assistant", "content": resposta, "citacoes": citacoes, "imagens_resposta": imagens_rag, "miniaturas_resposta": miniaturas_rag}
                     st.session_state.messages.append(assistant_message)
+                elif erro:
+                    placeholder.empty()
+                    st.error(f"Erro no chat: {erro}")
                 else:
-                    st.error(f"Erro no chat: {response.text}")
+                    st.error("Erro no chat: a resposta foi interrompida antes do fim.")
+            elif response is not None:
+                st.error(f"Erro no chat: {erro_da_resposta(response)}")
     
     # Reseta o uploader e força reload para atualizar a interface
     st.session_state.uploader_key += 1
@@ -0,0 +1,318 @@
+# benchmark.py
+# Testes de carga e micro-benchmarks sem chamar o Gemini
+#
+# Carga: reenvia um arquivo de perguntas (JSONL com "pergunta" ou uma por linha) ao /chat
+# com N requisições simultâneas e mede p50/p95/p99, requisições/s e o tempo de cada etapa
+# (spans do header X-Debug-Tempos). Sem --url, a API roda no próprio processo com
+# CHAT_BACKEND=fake e EMBEDDINGS_BACKEND=fake e a latência escolhida para cada modelo:
+#   python benchmark.py carga perguntas.jsonl --concorrencia 32 --latencia-llm-ms 800
+#   python benchmark.py carga --gerar 500 --sem-cache          (perguntas tiradas dos chunks)
+#   python benchmark.py carga perguntas.jsonl --url http://127.0.0.1:8000
+#
+# Micro-benchmarks (ingestão, busca no FAISS, extrair_trecho, citações), com comparação
+# contra uma execução anterior para pegar regressões antes do deploy:
+#   python benchmark.py micro --salvar bench_base.json
+#   python benchmark.py micro --comparar bench_base.json --tolerancia 0.25
+#
+# O índice em ./vector_store precisa ter sido gerado com o mesmo modelo de embeddings usado
+# aqui (EMBEDDINGS_BACKEND=fake python create_vector_store.py, num checkout separado).
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+RAIZ = Path(__file__).resolve().parent
+
+
+def _configurar_modelos_falsos(latencia_llm_ms: float, latencia_embeddings_ms: float, sem_cache: bool):
+    # Antes de importar o main: as variáveis são lidas na importação ou na criação dos recursos
+    os.environ.setdefault("CHAT_BACKEND", "fake")
+    os.environ.setdefault("EMBEDDINGS_BACKEND", "fake")
+    os.environ["FAKE_CHAT_LATENCY_MS"] = str(latencia_llm_ms)
+    os.environ["FAKE_EMBEDDINGS_LATENCY_MS"] = str(latencia_embeddings_ms)
+    os.environ.setdefault("STARTUP_WARMUP", "0")
+    os.environ.setdefault("INDEX_WATCH_INTERVAL", "0")
+    if sem_cache:
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+
+
+def _percentis(valores: List[float]) -> Dict[str, float]:
+    if not valores:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "media": 0.0}
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "media": float(np.mean(valores))}
+
+
+def ler_perguntas(path: Path) -> List[str]:
+    perguntas = []
+    with open(path, encoding="utf-8") as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            perguntas.append(json.loads(linha)["pergunta"] if linha.startswith("{") else linha)
+    return perguntas
+
+
+def perguntas_do_indice(indice_carregado, n: int, seed: int = 0) -> List[str]:
+    """Perguntas sintéticas: janelas de 6 a 10 palavras de chunks sorteados do índice."""
+    docstore = indice_carregado.vectorstore.docstore
+    ids = indice_carregado.vectorstore.index_to_docstore_id
+    rng = random.Random(seed)
+    perguntas = []
+    for _ in range(n):
+        doc = docstore.search(ids[rng.randrange(len(ids))])
+        palavras = doc.page_content.split()
+        tamanho = rng.randint(6, 10)
+        inicio = rng.randrange(max(1, len(palavras) - tamanho))
+        perguntas.append("Como " + " ".join(palavras[inicio:inicio + tamanho]))
+    return perguntas
+
+
+# --- Carga ---
+
+async def _executar_carga(cliente, perguntas: List[str], concorrencia: int, endpoint: str) -> Dict:
+    fila: asyncio.Queue = asyncio.Queue()
+    for pergunta in perguntas:
+        fila.put_nowait(pergunta)
+    latencias: List[float] = []
+    spans: Dict[str, List[float]] = {}
+    status: Dict[str, int] = {}
+    cache: Dict[str, int] = {}
+
+    async def trabalhador():
+        while True:
+            try:
+                pergunta = fila.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            inicio = time.perf_counter()
+            try:
+                resposta = await cliente.post(endpoint, json={"pergunta": pergunta}, headers={"X-Debug-Tempos": "1"})
+                codigo = str(resposta.status_code)
+            except Exception as e:
+                status[type(e).__name__] = status.get(type(e).__name__, 0) + 1
+                continue
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            status[codigo] = status.get(codigo, 0) + 1
+            if resposta.status_code != 200:
+                continue
+            corpo = resposta.json()
+            cache[corpo.get("cache", "-")] = cache.get(corpo.get("cache", "-"), 0) + 1
+            for span in (corpo.get("debug") or {}).get("spans", []):
+                spans.setdefault(f"{span['tipo']}:{span['nome']}", []).append(span["ms"])
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    return {
+        "requisicoes": len(latencias),
+        "duracao_s": duracao,
+        "rps": len(latencias) / duracao if duracao else 0.0,
+        "latencia_ms": _percentis(latencias),
+        "status": status,
+        "cache": cache,
+        "etapas_ms": {nome: {**_percentis(v), "n": len(v)} for nome, v in sorted(spans.items())},
+    }
+
+
+async def carga(perguntas: List[str], concorrencia: int, endpoint: str, url: Optional[str]) -> Dict:
+    import httpx
+
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=120, limits=limites) as cliente:
+            return await _executar_carga(cliente, perguntas, concorrencia, endpoint)
+
+    # API no próprio processo (o cliente divide o event loop com ela; medir com --url para isolar)
+    import main
+    await asyncio.to_thread(main._aquecer)
+    dimensao_indice = main.obter_index_manager().atual.vectorstore.index.d
+    if len(main.obter_embeddings().embed_query("teste")) != dimensao_indice:
+        raise SystemExit("O índice em ./vector_store foi gerado com outro modelo de embeddings; "
+                         "gere um com EMBEDDINGS_BACKEND=fake para o teste de carga offline.")
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", timeout=120) as cliente:
+        return await _executar_carga(cliente, perguntas, concorrencia, endpoint)
+
+
+def imprimir_carga(r: Dict):
+    lat = r["latencia_ms"]
+    print(f"\n{r['requisicoes']} requisições em {r['duracao_s']:.1f}s: {r['rps']:.1f} req/s")
+    print(f"latência (ms): p50 {lat['p50']:.1f}  p95 {lat['p95']:.1f}  p99 {lat['p99']:.1f}  média {lat['media']:.1f}")
+    print(f"status: {r['status']}  cache: {r['cache']}")
+    print(f"\n{'etapa':<28} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for nome, e in r["etapas_ms"].items():
+        print(f"{nome:<28} {e['n']:>6} {e['p50']:>9.2f} {e['p95']:>9.2f} {e['p99']:>9.2f}")
+
+
+# --- Micro-benchmarks ---
+
+def _cronometrar(fn, repeticoes: int, rodadas: int = 5) -> Dict[str, float]:
+    """Mediana e p95 por chamada, em µs; fica a melhor de `rodadas` rodadas (menos ruído da máquina)."""
+    fn()  # Aquecimento (caches, imports preguiçosos)
+    melhor = None
+    for _ in range(rodadas):
+        tempos = []
+        for _ in range(max(1, repeticoes // rodadas)):
+            inicio = time.perf_counter()
+            fn()
+            tempos.append((time.perf_counter() - inicio) * 1e6)
+        rodada = {"mediana_us": float(np.median(tempos)), "p95_us": float(np.percentile(tempos, 95))}
+        if melhor is None or rodada["mediana_us"] < melhor["mediana_us"]:
+            melhor = rodada
+    return melhor
+
+
+def micro_ingestao(data_path: Path) -> Dict[str, float]:
+    """create_vector_store.py completo (PDFs -> versão publicada) num diretório temporário, do zero."""
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp) / "data").symlink_to(data_path.resolve(), target_is_directory=True)
+        env = {**os.environ, "EMBEDDINGS_BACKEND": "fake", "EMBED_CACHE_PATH": str(Path(tmp) / "cache.sqlite3")}
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, str(RAIZ / "create_vector_store.py")], cwd=tmp, env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        segundos = time.perf_counter() - inicio
+    return {"mediana_us": segundos * 1e6, "p95_us": segundos * 1e6}
+
+
+def micro(repeticoes: int, data_path: Optional[Path], seed: int = 0) -> Dict[str, Dict[str, float]]:
+    import main
+    from context_packing import empacotar
+    from snippets import extrair_trecho, termos_da_consulta
+
+    indice_carregado = main.obter_index_manager().atual
+    index = indice_carregado.vectorstore.index
+    rng = np.random.default_rng(seed)
+    # Consultas: vetores do próprio índice com ruído (não depende do modelo de embeddings)
+    base = np.stack([index.reconstruct(int(i)) for i in rng.choice(index.ntotal, min(64, index.ntotal), replace=False)])
+    consultas = (base + rng.normal(0, 0.02, base.shape)).astype(np.float32)
+    perguntas = perguntas_do_indice(indice_carregado, len(consultas), seed)
+    docs_por_consulta = indice_carregado.buscar_lote(perguntas, consultas.tolist())
+    docs_por_consulta = [d for d in docs_por_consulta if d] or [[indice_carregado.vectorstore.docstore.search(
+        indice_carregado.vectorstore.index_to_docstore_id[0])]]
+
+    def ciclo(lista):
+        # Cada benchmark percorre a mesma sequência de entradas
+        proxima = iter(range(10**9))
+        return lambda: lista[next(proxima) % len(lista)]
+    pares = list(zip(perguntas, docs_por_consulta))
+
+    resultados = {}
+    consulta = ciclo(consultas)
+    resultados["faiss_busca"] = _cronometrar(lambda: index.search(consulta()[None, :], 20), repeticoes)
+    consulta = ciclo(consultas)
+    resultados["recuperacao_buscar_lote_1"] = _cronometrar(
+        lambda: indice_carregado.buscar_lote(["como importar"], [consulta().tolist()]), repeticoes)
+    lote = consultas.tolist()
+    resultados[f"recuperacao_buscar_lote_{len(lote)}_por_pergunta"] = {
+        k: v / len(lote) for k, v in _cronometrar(
+            lambda: indice_carregado.buscar_lote(perguntas, lote), max(1, repeticoes // 10)).items()}
+
+    def trecho(precalculado: bool):
+        pergunta_docs = ciclo(pares)
+        def fn():
+            pergunta, docs = pergunta_docs()
+            termos = termos_da_consulta(pergunta)
+            for d in docs:
+                extrair_trecho(d.page_content, janela=240, dados=d.metadata if precalculado else None, termos=termos)
+        return fn
+    resultados["extrair_trecho_precalculado"] = _cronometrar(trecho(True), repeticoes)
+    resultados["extrair_trecho_sem_dados"] = _cronometrar(trecho(False), repeticoes)
+    pergunta_docs = ciclo(pares)
+    def citacoes():
+        pergunta, docs = pergunta_docs()
+        main.formatar_citacoes_e_imagens(docs, pergunta)
+    resultados["formatar_citacoes"] = _cronometrar(citacoes, repeticoes)
+
+    vetores = {id(d): v for docs in docs_por_consulta for d, v in zip(docs, indice_carregado.vetores_armazenados(docs))}
+    pergunta_docs, consulta = ciclo(pares), ciclo(consultas)
+    def empacotar_contexto():
+        _, docs = pergunta_docs()
+        vs = [vetores[id(d)] if vetores[id(d)] is not None else np.zeros(index.d, dtype=np.float32) for d in docs]
+        empacotar(docs, vs, consulta())
+    resultados["empacotar_contexto"] = _cronometrar(empacotar_contexto, repeticoes)
+
+    if data_path is not None:
+        resultados["ingestao_completa"] = micro_ingestao(data_path)
+    return resultados
+
+
+def comparar_micro(atual: Dict, anterior: Dict, tolerancia: float) -> List[str]:
+    """Nomes dos benchmarks com mediana mais de `tolerancia` acima da execução anterior."""
+    regressoes = []
+    print(f"\n{'benchmark':<40} {'anterior µs':>12} {'atual µs':>12} {'variação':>9}")
+    for nome, r in atual.items():
+        if nome not in anterior:
+            continue
+        antes, agora = anterior[nome]["mediana_us"], r["mediana_us"]
+        variacao = agora / antes - 1 if antes else 0.0
+        marca = " ⚠️" if variacao > tolerancia else ""
+        print(f"{nome:<40} {antes:>12.1f} {agora:>12.1f} {variacao:>+9.1%}{marca}")
+        if variacao > tolerancia:
+            regressoes.append(nome)
+    return regressoes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Testes de carga e micro-benchmarks offline")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_carga = sub.add_parser("carga", help="Reenvia perguntas à API e mede latência e vazão")
+    p_carga.add_argument("perguntas", type=Path, nargs="?", help="JSONL com 'pergunta' ou uma pergunta por linha")
+    p_carga.add_argument("--gerar", type=int, default=200, help="Sem arquivo: N perguntas tiradas do índice")
+    p_carga.add_argument("--total", type=int, help="Requisições no total (repete as perguntas se preciso)")
+    p_carga.add_argument("--concorrencia", type=int, default=16)
+    p_carga.add_argument("--endpoint", default="/chat")
+    p_carga.add_argument("--url", help="API já rodando (ex.: http://127.0.0.1:8000); sem ela, roda no processo")
+    p_carga.add_argument("--latencia-llm-ms", type=float, default=800)
+    p_carga.add_argument("--latencia-embeddings-ms", type=float, default=60)
+    p_carga.add_argument("--sem-cache", action="store_true", help="Desliga o cache de respostas (só no processo)")
+    p_carga.add_argument("--saida", type=Path, help="Grava o resultado em JSON")
+    p_micro = sub.add_parser("micro", help="Micro-benchmarks das etapas internas")
+    p_micro.add_argument("--repeticoes", type=int, default=300)
+    p_micro.add_argument("--data", type=Path, default=Path("./data/"), help="PDFs para o benchmark de ingestão")
+    p_micro.add_argument("--sem-ingestao", action="store_true")
+    p_micro.add_argument("--salvar", type=Path, help="Grava o resultado em JSON (base para --comparar)")
+    p_micro.add_argument("--comparar", type=Path, help="Resultado anterior; sai com código 1 se houver regressão")
+    p_micro.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.comando == "carga":
+        if not args.url:
+            _configurar_modelos_falsos(args.latencia_llm_ms, args.latencia_embeddings_ms, args.sem_cache)
+        if args.perguntas:
+            perguntas = ler_perguntas(args.perguntas)
+        else:
+            import main
+            perguntas = perguntas_do_indice(main.obter_index_manager().atual, args.gerar)
+        total = args.total or len(perguntas)
+        perguntas = [perguntas[i % len(perguntas)] for i in range(total)]
+        resultado = asyncio.run(carga(perguntas, args.concorrencia, args.endpoint, args.url))
+        imprimir_carga(resultado)
+        destino = args.saida
+    else:
+        _configurar_modelos_falsos(0, 0, sem_cache=True)
+        resultado = micro(args.repeticoes, None if args.sem_ingestao else args.data)
+        print(f"{'benchmark':<40} {'mediana µs':>12} {'p95 µs':>12}")
+        for nome, r in resultado.items():
+            print(f"{nome:<40} {r['mediana_us']:>12.1f} {r['p95_us']:>12.1f}")
+        destino = args.salvar
+
+    if destino:
+        with open(destino, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    if args.comando == "micro" and args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regressoes = comparar_micro(resultado, json.load(f), args.tolerancia)
+        if regressoes:
+            print(f"\n❌ Regressões acima de {args.tolerancia:.0%}: {', '.join(regressoes)}")
+            raise SystemExit(1)
@@ -0,0 +1,126 @@
+# bm25_index.py
+# Índice invertido BM25 compacto (postings em arrays numpy), salvo ao lado do índice FAISS
+import os
+import re
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Palavras muito frequentes nas perguntas que não ajudam a achar o trecho certo
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "da", "do", "das", "dos", "em", "no", "na", "nos", "nas",
+    "e", "ou", "que", "como", "para", "por", "com", "se", "nao", "sim", "eu", "meu", "minha", "me",
+    "ao", "aos", "qual", "quais", "onde", "quando", "faco", "fazer", "ser", "esta", "isso", "este",
+}
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Minúsculas, sem acentos; mantém códigos (CFOP 5102, NF-e -> nf, e) e ignora stopwords."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    # Tokens muito longos (lixo de extração) só inflariam o vocabulário
+    return [t for t in re.findall(r"\w+", texto) if t not in STOPWORDS and len(t) <= 40]
+
+
+class BM25Index:
+    """BM25 (Okapi) com postings contíguas por termo.
+
+    `offsets[i]:offsets[i+1]` delimita, em `docs`/`tfs`, as postings do i-ésimo termo de
+    `termos` (ordenados). Tudo cabe em poucos arrays numpy, sem objetos Python por posting.
+    """
+
+    def __init__(self, ids: np.ndarray, termos: np.ndarray, offsets: np.ndarray, docs: np.ndarray,
+                 tfs: np.ndarray, doc_len: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.termos = termos
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {str(t): i for i, t in enumerate(termos)}
+        n = len(ids)
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Normalização de tamanho pré-calculada por documento: k1 * (1 - b + b * dl / avgdl)
+        avgdl = float(doc_len.mean()) if n else 1.0
+        self.norma = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def construir(cls, ids: List[str], textos: List[str]) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_len = np.zeros(len(ids), dtype=np.float32)
+        for d, texto in enumerate(textos):
+            tokens = tokenizar(texto)
+            doc_len[d] = len(tokens)
+            contagem: Dict[str, int] = {}
+            for t in tokens:
+                contagem[t] = contagem.get(t, 0) + 1
+            for t, tf in contagem.items():
+                postings.setdefault(t, []).append((d, tf))
+
+        termos = sorted(postings)
+        offsets = np.zeros(len(termos) + 1, dtype=np.int64)
+        for i, t in enumerate(termos):
+            offsets[i + 1] = offsets[i] + len(postings[t])
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for i, t in enumerate(termos):
+            lista = postings[t]
+            docs[offsets[i]:offsets[i + 1]] = [d for d, _ in lista]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in lista]
+        return cls(np.asarray(ids, dtype=str), np.asarray(termos, dtype=str), offsets, docs, tfs, doc_len)
+
+    def salvar(self, path: Path):
+        tmp_path = path.with_name(f".{path.name}.tmp.npz")
+        np.savez(tmp_path, ids=self.ids, termos=self.termos, offsets=self.offsets,
+                 docs=self.docs, tfs=self.tfs, doc_len=self.doc_len)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def carregar(cls, path: Path) -> "BM25Index":
+        dados = np.load(path, allow_pickle=False)
+        return cls(dados["ids"], dados["termos"], dados["offsets"], dados["docs"], dados["tfs"], dados["doc_len"])
+
+    def score_referencia(self, consulta: str) -> float:
+        """Score BM25 de um chunk de tamanho médio com cada termo conhecido da consulta uma vez
+        (soma dos idf dos termos que existem no vocabulário; 0 se nenhum existe).
+
+        Termos fora do vocabulário não entram: nenhum chunk pode pontuar por eles, então só
+        afastariam a referência do melhor score possível (ex.: "XML" num corpus que não o tem).
+        Quanto da pergunta o corpus conhece é medido à parte, por cobertura().
+        """
+        return sum(float(self.idf[self.vocab[t]]) for t in set(tokenizar(consulta)) if t in self.vocab)
+
+    def cobertura(self, consulta: str) -> float:
+        """Fração dos termos distintos da consulta que existem no vocabulário (0 a 1)."""
+        termos = set(tokenizar(consulta))
+        if not termos:
+            return 0.0
+        return sum(t in self.vocab for t in termos) / len(termos)
+
+    def buscar(self, consulta: str, k: int = 20) -> List[Tuple[str, float]]:
+        """Retorna até k pares (id do chunk, score BM25), do maior para o menor."""
+        partes_docs, partes_scores = [], []
+        for t in set(tokenizar(consulta)):
+            i = self.vocab.get(t)
+            if i is None:
+                continue
+            ini, fim = self.offsets[i], self.offsets[i + 1]
+            docs, tfs = self.docs[ini:fim], self.tfs[ini:fim]
+            partes_docs.append(docs)
+            partes_scores.append(self.idf[i] * tfs * (self.k1 + 1) / (tfs + self.norma[docs]))
+        if not partes_docs:
+            return []
+
+        docs = np.concatenate(partes_docs)
+        scores = np.concatenate(partes_scores)
+        unicos, inverso = np.unique(docs, return_inverse=True)
+        totais = np.bincount(inverso, weights=scores)
+        k = min(k, len(unicos))
+        melhores = np.argpartition(-totais, k - 1)[:k]
+        melhores = melhores[np.argsort(-totais[melhores])]
+        return [(str(self.ids[unicos[j]]), float(totais[j])) for j in melhores]
@@ -0,0 +1,124 @@
+# context_packing.py
+# Montagem do contexto entre o retriever e o LLM: remove repetições, reordena por MMR e
+# corta no orçamento de tokens
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from snippets import remover_campos_trecho
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200)) # Tokens de documentos por prompt
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7)) # 1 = só relevância, 0 = só diversidade
+SOBREPOSICAO_MINIMA = 20 # Caracteres em comum para juntar dois chunks vizinhos da mesma página
+
+
+def estimar_tokens(texto: str) -> int:
+    # Aproximação para o Gemini em português (~4 caracteres por token); basta para orçamento e relatório
+    return (len(texto) + 3) // 4
+
+
+def _normalizar(texto: str) -> str:
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+def _sobreposicao(a: str, b: str) -> int:
+    """Tamanho do maior sufixo de `a` que também é prefixo de `b` (o chunk_overlap do splitter)."""
+    for n in range(min(len(a), len(b)), SOBREPOSICAO_MINIMA - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _unitario(vetor: np.ndarray) -> np.ndarray:
+    norma = np.linalg.norm(vetor)
+    return vetor / norma if norma > 0 else vetor
+
+
+def deduplicar(docs: List[Document], vetores: List[np.ndarray]) -> Tuple[List[Document], List[np.ndarray]]:
+    """Remove chunks repetidos ou contidos em outros e junta vizinhos sobrepostos da mesma página.
+
+    A ordem é a do retriever; um chunk juntado herda a posição do primeiro.
+    """
+    saida_docs: List[Document] = []
+    saida_vetores: List[np.ndarray] = []
+    for doc, vetor in zip(docs, vetores):
+        texto = _normalizar(doc.page_content)
+        pagina = (doc.metadata.get("source"), doc.metadata.get("page"))
+        descartar = False
+        for i, anterior in enumerate(saida_docs):
+            texto_anterior = _normalizar(anterior.page_content)
+            if texto in texto_anterior:
+                descartar = True
+                break
+            if (anterior.metadata.get("source"), anterior.metadata.get("page")) != pagina:
+                continue
+            if texto_anterior in texto:
+                # O novo contém o anterior: fica o maior, na posição do anterior
+                saida_docs[i], saida_vetores[i] = doc, vetor
+                descartar = True
+                break
+            n = _sobreposicao(texto_anterior, texto)
+            m = _sobreposicao(texto, texto_anterior)
+            if n or m:
+                unido = texto_anterior + texto[n:] if n >= m else texto + texto_anterior[m:]
+                # Os dados de trecho pré-calculados eram do chunk isolado, não do texto unido
+                saida_docs[i] = Document(id=anterior.id, page_content=unido,
+                                         metadata=remover_campos_trecho(anterior.metadata))
+                saida_vetores[i] = _unitario(_unitario(saida_vetores[i]) + _unitario(vetor))
+                descartar = True
+                break
+        if not descartar:
+            saida_docs.append(doc)
+            saida_vetores.append(vetor)
+    return saida_docs, saida_vetores
+
+
+def ordenar_mmr(vetor_consulta: np.ndarray, vetores: List[np.ndarray], lambda_mmr: float) -> List[int]:
+    """Maximal Marginal Relevance: relevância para a pergunta menos a redundância com os já escolhidos."""
+    if not vetores:
+        return []
+    matriz = np.stack([_unitario(v) for v in vetores])
+    relevancia = matriz @ _unitario(vetor_consulta)
+    similaridade = matriz @ matriz.T
+    escolhidos: List[int] = []
+    restantes = list(range(len(vetores)))
+    while restantes:
+        if escolhidos:
+            redundancia = similaridade[np.ix_(restantes, escolhidos)].max(axis=1)
+        else:
+            redundancia = np.zeros(len(restantes))
+        scores = lambda_mmr * relevancia[restantes] - (1 - lambda_mmr) * redundancia
+        escolhidos.append(restantes.pop(int(np.argmax(scores))))
+    return escolhidos
+
+
+def empacotar(docs: List[Document], vetores: List[np.ndarray], vetor_consulta: np.ndarray,
+              orcamento_tokens: int = CONTEXT_TOKEN_BUDGET,
+              lambda_mmr: float = CONTEXT_MMR_LAMBDA) -> Tuple[List[Document], Dict]:
+    """Dedup + MMR + corte no orçamento. Retorna (documentos para o prompt, relatório de tokens).
+
+    O primeiro trecho pela ordem do MMR sempre entra, mesmo passando do orçamento; os seguintes
+    entram enquanto couberem (um trecho grande não impede que um menor depois dele entre).
+    """
+    recuperados = len(docs)
+    tokens_recuperados = sum(estimar_tokens(d.page_content) for d in docs)
+    docs, vetores = deduplicar(docs, vetores)
+
+    selecionados, usados = [], 0
+    for i in ordenar_mmr(vetor_consulta, vetores, lambda_mmr):
+        tokens = estimar_tokens(docs[i].page_content)
+        if selecionados and usados + tokens > orcamento_tokens:
+            continue
+        selecionados.append(docs[i])
+        usados += tokens
+
+    return selecionados, {
+        "documentos_recuperados": recuperados,
+        "documentos_enviados": len(selecionados),
+        "tokens_recuperados": tokens_recuperados,
+        "tokens_enviados": usados,
+        "tokens_economizados": tokens_recuperados - usados,
+    }
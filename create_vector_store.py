@@ -1,77 +1,376 @@
 # create_vector_store.py
 import os
+import sys
+import json
+import math
+import shutil
+import hashlib
 import fitz  # PyMuPDF
+import numpy as np
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 
-from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 
-# Carrega a chave de API do arquivo .env
+from embedding_cache import build_embeddings
+from image_index import write_image_index
+from bm25_index import BM25Index
+from vector_index import escrever_indice_busca, INDEX_TYPES
+from mmap_docstore import escrever_docstore, escrever_documentos, existe_docstore, MmapDocstore
+from snippets import preparar_documentos
+from parent_chunks import CHUNKING_MODOS, PARENTS_NOME, titulos_da_pagina, gerar_pais_e_filhos
+from index_versions import (nova_versao, diretorio_publicado, diretorio_versao, preparar_versao,
+                            publicar_versao, remover_versoes_antigas, listar_versoes)
+
+# Carrega a chave de API do arquivo .env (validada ao criar os embeddings;
+# com EMBEDDINGS_BACKEND=fake a indexação roda offline, sem chave)
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GEMINI_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("GEMINI_KEY não encontrada. Por favor, configure no arquivo .env")
 
 # --- CAMINHOS ---
 DATA_PATH = Path("./data/")
-VECTOR_STORE_PATH = Path("./vector_store/")
+VECTOR_STORE_PATH = Path("./vector_store/") # Cada execução publica uma nova versão em versions/<versão>/
 IMAGE_SAVE_DIR = Path("./imagens_documentos/") # Pasta para salvar imagens extraídas
+THUMB_DIR = IMAGE_SAVE_DIR / "thumbs" # Miniaturas JPEG servidas nas respostas do chat
+
+# --- ARQUIVOS DE CADA VERSÃO ---
+MANIFEST_FILENAME = "manifest.json" # Hash, chunks e imagens de cada PDF indexado
+IMAGE_INDEX_FILENAME = "image_index.json" # (documento, página) -> imagens, lido pela API
+BM25_FILENAME = "bm25.npz" # Índice lexical sobre os mesmos chunks do FAISS
+
+# Número de processos usados na leitura dos PDFs (padrão: um por núcleo)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+THUMB_MAX_SIZE = int(os.getenv("THUMB_MAX_SIZE", 320)) # Lado maior da miniatura, em pixels
+# Índice usado na busca: flat (exato), hnsw ou ivfpq. O flat em index.faiss é sempre mantido
+# para as atualizações incrementais; os demais são derivados dele a cada execução.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+if INDEX_TYPE not in INDEX_TYPES:
+    raise ValueError(f"INDEX_TYPE inválido: {INDEX_TYPE}. Use um de {INDEX_TYPES}")
+INDEX_VERSIONS_KEEP = int(os.getenv("INDEX_VERSIONS_KEEP", 3)) # Versões antigas mantidas em disco
+# simples: chunks de 300 caracteres; pai: trechos para a busca + seções/páginas para o LLM
+# (ver parent_chunks.py). Trocar o modo reindexa todos os PDFs.
+CHUNKING = os.getenv("CHUNKING", "simples")
+if CHUNKING not in CHUNKING_MODOS:
+    raise ValueError(f"CHUNKING inválido: {CHUNKING}. Use um de {CHUNKING_MODOS}")
+
+# Formatos que o navegador exibe direto; os demais (jpx, jbig2...) são convertidos para PNG
+WEB_IMAGE_EXTS = {"png", "jpg", "jpeg", "gif", "webp"}
 
 # Cria os diretórios se não existirem
 VECTOR_STORE_PATH.mkdir(exist_ok=True)
 IMAGE_SAVE_DIR.mkdir(exist_ok=True)
+THUMB_DIR.mkdir(exist_ok=True)
+
+def _file_hash(path: Path) -> str:
+    """Calcula o SHA-256 do conteúdo do arquivo, lendo em blocos."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _load_manifest(version_dir) -> dict:
+    # O manifest só vale se o índice FAISS correspondente também existir
+    if version_dir and (version_dir / MANIFEST_FILENAME).exists() and (version_dir / "index.faiss").exists():
+        with open(version_dir / MANIFEST_FILENAME, encoding="utf-8") as f:
+            return json.load(f)
+    return {"arquivos": {}}
+
+def _save_manifest(version_dir: Path, manifest: dict):
+    with open(version_dir / MANIFEST_FILENAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+def _previous_version_dir():
+    # No formato antigo (sem versões) os arquivos ficam direto em vector_store/
+    version_dir = diretorio_publicado(VECTOR_STORE_PATH)
+    return version_dir if (version_dir / "index.faiss").exists() else None
+
+def _empty_vectorstore(embeddings, dir_anterior) -> FAISS:
+    """Índice sem nenhum chunk, com a dimensão da versão anterior (ou a dos embeddings)."""
+    import faiss
+    if dir_anterior is not None:
+        dim = faiss.read_index(str(dir_anterior / "index.faiss")).d
+    else:
+        dim = len(embeddings.embed_query("dimensão"))
+    return FAISS(embeddings, faiss.IndexFlatL2(dim), InMemoryDocstore({}), {})
+
+def _write_atomic(path: Path, data: bytes):
+    # Vários processos podem salvar a mesma imagem ao mesmo tempo; o rename evita arquivos truncados
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _save_image(doc_fitz, xref: int) -> str:
+    """Salva a imagem uma única vez, com nome derivado do hash do conteúdo, e gera a miniatura."""
+    base_image = doc_fitz.extract_image(xref)
+    image_bytes, ext = base_image["image"], base_image["ext"].lower()
+    image_hash = hashlib.sha256(image_bytes).hexdigest()[:24]
+
+    pix = None
+    if ext not in WEB_IMAGE_EXTS:
+        pix = fitz.Pixmap(doc_fitz, xref)
+        if pix.n - pix.alpha >= 4:  # CMYK -> RGB
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        image_bytes, ext = pix.tobytes("png"), "png"
+
+    image_filename = f"{image_hash}.{ext}"
+    if not (IMAGE_SAVE_DIR / image_filename).exists():
+        _write_atomic(IMAGE_SAVE_DIR / image_filename, image_bytes)
+
+    thumb_path = THUMB_DIR / f"{image_hash}.jpg"
+    if not thumb_path.exists():
+        pix = pix or fitz.Pixmap(doc_fitz, xref)
+        if pix.n - pix.alpha >= 4:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        if pix.alpha:  # JPEG não tem canal alfa
+            pix = fitz.Pixmap(pix, 0)
+        maior_lado = max(pix.width, pix.height)
+        if maior_lado > THUMB_MAX_SIZE:
+            pix.shrink(math.ceil(math.log2(maior_lado / THUMB_MAX_SIZE)))
+        _write_atomic(thumb_path, pix.tobytes("jpg", jpg_quality=80))
+
+    return image_filename
+
+def _process_pdf(pdf_path: Path, com_titulos: bool = False) -> dict:
+    """Lê o PDF uma única vez, extraindo o texto e salvando as imagens de cada página.
+
+    Roda dentro de um processo do pool; devolve apenas dados simples (picklable).
+    Com `com_titulos`, inclui as linhas de título de cada página (chunking pai/filho).
+    """
+    paginas, image_files = [], {}
+    doc_fitz = fitz.open(pdf_path)
+    total_pages = doc_fitz.page_count
+    for page_num, page in enumerate(doc_fitz):
+        # 1. Texto da página (mesmos metadados que o PyMuPDFLoader gerava)
+        paginas.append({
+            "texto": page.get_text(),
+            "metadata": {"source": str(pdf_path), "file_path": str(pdf_path),
+                         "page": page_num, "total_pages": total_pages},
+        })
+        if com_titulos:
+            paginas[-1]["titulos"] = titulos_da_pagina(page)
+
+        # 2. Imagens da página, agrupadas pelo número da página (1-based, como nas citações)
+        page_images = image_files.setdefault(str(page_num + 1), [])
+        image_list = page.get_images(full=True)
+        for img in image_list:
+            xref = img[0]
+            # Logos e cabeçalhos repetidos apontam todos para o mesmo arquivo
+            image_filename = _save_image(doc_fitz, xref)
+            if image_filename not in page_images:
+                page_images.append(image_filename)
+    doc_fitz.close()
+    return {"paginas": paginas, "imagens": image_files}
+
+def _image_names(image_files: dict) -> set:
+    return {image_filename for page_images in image_files.values() for image_filename in page_images}
 
-def create_store_and_extract_images():
+def _remove_unused_images() -> int:
+    """Apaga imagens e miniaturas que nenhuma versão mantida em disco referencia mais.
+
+    A API pode estar servindo uma versão anterior, então o que conta é o conjunto de
+    todas as versões guardadas, não só a recém-criada.
+    """
+    em_uso = set()
+    for versao in listar_versoes(VECTOR_STORE_PATH):
+        for entrada in _load_manifest(diretorio_versao(VECTOR_STORE_PATH, versao))["arquivos"].values():
+            em_uso |= _image_names(entrada["imagens"])
+    stems_em_uso = {Path(nome).stem for nome in em_uso}
+    for path in IMAGE_SAVE_DIR.iterdir():
+        if path.is_file() and not path.name.startswith(".") and path.name not in em_uso:
+            path.unlink(missing_ok=True)
+    for path in THUMB_DIR.iterdir():
+        if path.is_file() and not path.name.startswith(".") and path.stem not in stems_em_uso:
+            path.unlink(missing_ok=True)
+    return len(em_uso)
+
+def create_store_and_extract_images() -> dict:
+    """Indexa os PDFs novos/alterados e publica uma nova versão; retorna os PDFs com erro (nome -> erro)."""
     print("Iniciando processo de preparação...")
-    docs = []
-
-    for pdf_path in DATA_PATH.glob("*.pdf"):
-        try:
-            # 1. Carrega o texto usando LangChain
-            loader = PyMuPDFLoader(str(pdf_path))
-            docs.extend(loader.load())
-
-            # 2. Extrai e salva as imagens usando PyMuPDF (fitz)
-            doc_fitz = fitz.open(pdf_path)
-            for page_num, page in enumerate(doc_fitz):
-                image_list = page.get_images(full=True)
-                for img_index, img in enumerate(image_list):
-                    xref = img[0]
-                    base_image = doc_fitz.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    # Nome de arquivo único para cada imagem
-                    image_filename = f"{pdf_path.stem}_page{page_num+1}_img{img_index}.png"
-                    image_save_path = IMAGE_SAVE_DIR / image_filename
-
-                    with open(image_save_path, "wb") as image_file:
-                        image_file.write(image_bytes)
-
-            print(f"✔️ Arquivo '{pdf_path.name}' processado (texto e imagens).")
-        except Exception as e:
-            print(f"❌ Erro ao processar o arquivo {pdf_path.name}: {e}")
-
-    if not docs:
-        print("⚠️ Nenhum documento foi carregado. Verifique a pasta 'data'.")
-        return
-
-    print(f"\nTotal de páginas de texto carregadas: {len(docs)}")
-
-    # 3. Cria e salva o Vector Store (mesma lógica de antes)
-    print("Dividindo documentos em chunks...")
+    dir_anterior = _previous_version_dir()
+    manifest = _load_manifest(dir_anterior)
+    indexados = manifest["arquivos"]
+
+    # 1. Compara os PDFs da pasta 'data' com o manifest da última execução
+    atuais = {pdf_path.name: pdf_path for pdf_path in DATA_PATH.glob("*.pdf")}
+    hashes = {nome: _file_hash(path) for nome, path in atuais.items()}
+
+    adicionados = sorted(n for n in atuais if n not in indexados)
+    alterados = sorted(n for n in atuais if n in indexados and indexados[n]["hash"] != hashes[n])
+    removidos = sorted(n for n in indexados if n not in atuais)
+    # As configurações da indexação ficam no manifest: trocar qualquer uma refaz o que depende dela
+    modo_anterior = manifest.get("chunking", "simples")
+    if indexados and modo_anterior != CHUNKING:
+        print(f"🔁 Chunking mudou de '{modo_anterior}' para '{CHUNKING}': todos os PDFs serão reindexados.")
+        alterados = sorted(n for n in atuais if n in indexados)
+    # O tipo do índice de busca só depende dos vetores (refeito a partir do flat, sem novos embeddings)
+    tipo_anterior = manifest.get("index_type", "flat")
+    trocar_tipo = bool(indexados) and tipo_anterior != INDEX_TYPE
+    if trocar_tipo:
+        print(f"🔁 Índice de busca mudou de '{tipo_anterior}' para '{INDEX_TYPE}': será refeito.")
+
+    if not adicionados and not alterados and not removidos and not trocar_tipo:
+        print("✅ Nenhuma alteração nos PDFs nem nas configurações desde a última indexação.")
+        return {}
+
+    # Lotes, paralelismo e retry configuráveis; chunks já vistos saem do cache em disco
+    embeddings = build_embeddings(GOOGLE_API_KEY)
+    vectorstore = None
+    pais = {} # Seções (chunking pai) de todos os PDFs indexados, por id
+    vetores_pais = {} # Embedding de cada seção, gravado junto delas (a API não embute seções por requisição)
+    # Com o mesmo chunking, parte-se da versão anterior (os chunks dos PDFs inalterados são mantidos)
+    reaproveitada = bool(indexados) and modo_anterior == CHUNKING
+    if reaproveitada:
+        # A versão publicada não é alterada: a nova é salva em outro diretório
+        vectorstore = FAISS.load_local(str(dir_anterior), embeddings, allow_dangerous_deserialization=True)
+        if CHUNKING == "pai" and existe_docstore(dir_anterior, PARENTS_NOME):
+            docstore_pais = MmapDocstore(dir_anterior, PARENTS_NOME)
+            pais = {doc.id: doc for doc in docstore_pais.documentos()}
+            if docstore_pais.vetores is not None:
+                vetores_pais = {doc_id: docstore_pais.vetor(i) for i, doc_id in enumerate(pais)}
+
+    def remover_chunks(entrada: dict):
+        if entrada["chunk_ids"] and vectorstore is not None and reaproveitada:
+            vectorstore.delete(entrada["chunk_ids"])
+        for parent_id in entrada.get("parent_ids", []):
+            pais.pop(parent_id, None)
+            vetores_pais.pop(parent_id, None)
+
+    # 2. Remove do índice os chunks dos PDFs excluídos; os dos alterados só saem quando a nova
+    # versão do PDF for processada com sucesso. As imagens podem ser compartilhadas com outros
+    # PDFs e versões, então só são apagadas no fim, se ninguém mais as usar.
+    for nome in removidos:
+        remover_chunks(indexados.pop(nome))
+
+    # 3. Processa somente os PDFs novos ou alterados, distribuídos entre processos.
+    # Cada PDF é dividido e enviado ao embedder assim que termina. No máximo 2 × workers PDFs
+    # ficam em voo (cada worker devolve todas as páginas do PDF de uma vez), o que limita o
+    # texto extraído ainda não indexado; os chunks indexados, no entanto, ficam todos no
+    # InMemoryDocstore do FAISS até o save_local, então esse pico cresce com o corpus.
     splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=30)
-    chunks = splitter.split_documents(docs)
-    
-    print("Gerando embeddings e criando o vector store FAISS...")
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/gemini-embedding-001", google_api_key=GOOGLE_API_KEY
-    )
-    vectorstore = FAISS.from_documents(chunks, embeddings)
-    vectorstore.save_local(str(VECTOR_STORE_PATH))
-    print(f"✅ Vector store criado e salvo com sucesso em '{VECTOR_STORE_PATH}'!")
+    fila = adicionados + alterados
+    falhas = {}
+    workers = max(1, min(INGEST_WORKERS, len(fila) or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        em_voo = {}
+        while fila or em_voo:
+            while fila and len(em_voo) < 2 * workers:
+                nome = fila.pop(0)
+                em_voo[pool.submit(_process_pdf, atuais[nome], CHUNKING == "pai")] = nome
+            prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+            for future in prontos:
+                nome = em_voo.pop(future)
+                try:
+                    resultado = future.result()
+                    docs = [Document(page_content=p["texto"], metadata=p["metadata"]) for p in resultado["paginas"]]
+                    pais_pdf = []
+                    if CHUNKING == "pai":
+                        pais_pdf, chunks = gerar_pais_e_filhos(resultado["paginas"], f"{nome}#{hashes[nome][:12]}")
+                    else:
+                        chunks = splitter.split_documents(docs)
+                    # Texto limpo/minúsculo e posições das palavras para os trechos das citações
+                    preparar_documentos(chunks + pais_pdf)
+                    # IDs estáveis por conteúdo, usados para remover os chunks numa próxima execução
+                    chunk_ids = [f"{nome}#{hashes[nome][:12]}#{i}" for i in range(len(chunks))]
+                    # Seções embutidas antes de mexer no índice: uma falha aqui mantém o conteúdo anterior
+                    novos_vetores_pais = embeddings.embed_documents([doc.page_content for doc in pais_pdf]) if pais_pdf else []
+
+                    if nome in indexados:
+                        remover_chunks(indexados[nome])
+                    if chunks:
+                        if vectorstore is None:
+                            vectorstore = FAISS.from_documents(chunks, embeddings, ids=chunk_ids)
+                        else:
+                            vectorstore.add_documents(chunks, ids=chunk_ids)
+
+                    indexados[nome] = {"hash": hashes[nome], "chunk_ids": chunk_ids, "imagens": resultado["imagens"]}
+                    if pais_pdf:
+                        pais.update((doc.id, doc) for doc in pais_pdf)
+                        vetores_pais.update((doc.id, vetor) for doc, vetor in zip(pais_pdf, novos_vetores_pais))
+                        indexados[nome]["parent_ids"] = [doc.id for doc in pais_pdf]
+                    print(f"✔️ Arquivo '{nome}' processado ({len(docs)} páginas, {len(chunks)} chunks, {sum(map(len, resultado['imagens'].values()))} imagens).")
+                except Exception as e:
+                    print(f"❌ Erro ao processar o arquivo {nome}: {e}")
+                    falhas[nome] = str(e)
+                    # O manifest não recebe o hash novo, então o PDF é tentado de novo na próxima
+                    # execução. Um PDF alterado continua com o conteúdo anterior, se ele ainda
+                    # está no índice (mesmo chunking); senão, fica de fora desta versão.
+                    if nome in alterados:
+                        alterados.remove(nome)
+                        if not reaproveitada:
+                            remover_chunks(indexados.pop(nome))
+                    else:
+                        adicionados.remove(nome)
+
+    if not adicionados and not alterados and not removidos and not trocar_tipo:
+        print(f"⚠️ Nenhum PDF novo ou alterado foi processado ({len(falhas)} com erro, ver acima). "
+              "A versão publicada continua em uso; eles serão tentados de novo na próxima execução.")
+        return falhas
+    if vectorstore is None and atuais:
+        print("⚠️ Nenhum documento foi carregado (ver os erros acima). A versão publicada anterior "
+              "continua em uso; os PDFs com erro serão tentados de novo na próxima execução.")
+        return falhas
+    if vectorstore is None:
+        # Todos os PDFs foram removidos da pasta 'data': publica um índice vazio, senão a API
+        # continuaria respondendo com trechos dos documentos excluídos
+        print("⚠️ Nenhum PDF na pasta 'data': publicando um índice vazio.")
+        vectorstore = _empty_vectorstore(embeddings, dir_anterior)
+
+    # 4. Escreve a nova versão completa num diretório temporário e só então a publica
+    # (rename do diretório + troca atômica do ponteiro CURRENT); a API nunca vê uma versão pela metade
+    versao = nova_versao()
+    tmp_dir = preparar_versao(VECTOR_STORE_PATH, versao)
+    try:
+        vectorstore.save_local(str(tmp_dir))
+
+        # O BM25 é reconstruído a partir do docstore (só tokenização, sem chamadas de embedding)
+        chunk_ids = list(vectorstore.index_to_docstore_id.values())
+        BM25Index.construir(chunk_ids, [vectorstore.docstore.search(i).page_content for i in chunk_ids]).salvar(tmp_dir / BM25_FILENAME)
+        tipo_indice = escrever_indice_busca(vectorstore.index, INDEX_TYPE, tmp_dir)
+        # Cópia mapeável do docstore para a API; o index.pkl fica só para a próxima indexação incremental
+        escrever_docstore(vectorstore.docstore, vectorstore.index_to_docstore_id, tmp_dir)
+        if CHUNKING == "pai":
+            # Seções mantidas de uma versão gravada sem os vetores: embutidas uma vez, aqui
+            sem_vetor = [doc_id for doc_id in pais if doc_id not in vetores_pais]
+            if sem_vetor:
+                vetores_pais.update(zip(sem_vetor, embeddings.embed_documents([pais[i].page_content for i in sem_vetor])))
+            vetores = np.asarray([vetores_pais[doc_id] for doc_id in pais], dtype=np.float32)
+            escrever_documentos(list(pais.values()), tmp_dir, PARENTS_NOME,
+                                vetores=vetores.reshape(len(pais), vectorstore.index.d))
+
+        manifest["chunking"] = CHUNKING
+        manifest["index_type"] = INDEX_TYPE
+
+        _save_manifest(tmp_dir, manifest)
+        write_image_index(tmp_dir / IMAGE_INDEX_FILENAME, manifest)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    publicar_versao(VECTOR_STORE_PATH, versao, tmp_dir)
+    print(f"✅ Vector store salvo e publicado como versão '{versao}' (índice de busca: {tipo_indice})!")
+
+    removidas = remover_versoes_antigas(VECTOR_STORE_PATH, INDEX_VERSIONS_KEEP)
+    imagens_em_uso = _remove_unused_images()
+
+    # 5. Resumo da execução
+    print("\nResumo da indexação:")
+    print(f"  ➕ Adicionados ({len(adicionados)}): {', '.join(adicionados) or '-'}")
+    print(f"  🔄 Alterados ({len(alterados)}): {', '.join(alterados) or '-'}")
+    print(f"  ➖ Removidos ({len(removidos)}): {', '.join(removidos) or '-'}")
+    if falhas:
+        print(f"  ❌ Falhas ({len(falhas)}), mantidas na versão anterior ou fora do índice: {', '.join(sorted(falhas))}")
+    print(f"  📚 Total indexado: {len(indexados)} PDFs, {sum(len(e['chunk_ids']) for e in indexados.values())} chunks")
+    if CHUNKING == "pai":
+        print(f"  📑 Seções (pais) devolvidas ao LLM: {len(pais)}")
+    print(f"  🖼️ Imagens únicas em disco (todas as versões mantidas): {imagens_em_uso}")
+    print(f"  🗑️ Versões antigas removidas: {', '.join(removidas) or '-'}")
+    return falhas
 
 if __name__ == "__main__":
-    create_store_and_extract_images()
\ No newline at end of file
+    # Código de saída 1 se algum PDF falhou (cron/CI percebem a indexação incompleta)
+    sys.exit(1 if create_store_and_extract_images() else 0)
@@ -0,0 +1,231 @@
+# embedding_cache.py
+# Etapa de embeddings com lotes, paralelismo limitado, retry e cache em disco
+import os
+import time
+import atexit
+import random
+import inspect
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBED_CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", "./embedding_cache.sqlite3"))
+# Espera (s) por um lock do SQLite quando outro processo (worker, indexação) está gravando
+EMBED_CACHE_BUSY_TIMEOUT = float(os.getenv("EMBED_CACHE_BUSY_TIMEOUT", 30))
+# Intervalo (s) em que os embeddings de perguntas novas são gravados em lote
+EMBED_CACHE_FLUSH_INTERVAL = float(os.getenv("EMBED_CACHE_FLUSH_INTERVAL", 1.0))
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Envolve um modelo de embeddings com lotes, chamadas paralelas, retry e cache em disco.
+
+    O cache é uma tabela SQLite com chave (modelo, tipo, hash do texto), então um chunk
+    idêntico nunca é enviado duas vezes à API, seja no mesmo manual, em manuais
+    diferentes ou em reindexações futuras.
+
+    O banco fica em modo WAL (leituras não esperam gravações; vários workers dividem o
+    arquivo). Embeddings de perguntas, calculados durante as requisições, não são gravados
+    na hora: ficam em memória e uma thread os grava em lote a cada `flush_interval` segundos.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache_path: Path = EMBED_CACHE_PATH,
+                 batch_size: int = 100, max_concurrency: int = 4,
+                 max_retries: int = 5, backoff: float = 1.0,
+                 flush_interval: float = EMBED_CACHE_FLUSH_INTERVAL):
+        self.base = base
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(cache_path), timeout=EMBED_CACHE_BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL") # Com WAL, só os checkpoints fazem fsync
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, kind TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, kind, text_hash))"
+        )
+        self._db.commit()
+        # Gravação adiada das perguntas: (tipo, hash) -> vetor, ainda não gravados
+        self._pendentes: dict = {}
+        self._acordar = threading.Event()
+        self._gravador: Optional[threading.Thread] = None
+
+    # --- Cache em disco ---
+
+    def _cache_get(self, kind: str, hashes: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            if self._pendentes:
+                for h in hashes:
+                    vetor = self._pendentes.get((kind, h))
+                    if vetor is not None:
+                        found[h] = vetor
+                hashes = [h for h in hashes if h not in found]
+            # O SQLite limita a quantidade de parâmetros por consulta
+            for i in range(0, len(hashes), 500):
+                parte = hashes[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND kind = ? "
+                    f"AND text_hash IN ({','.join('?' * len(parte))})",
+                    [self.model_name, kind, *parte],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _gravar(self, linhas: List[tuple]):
+        # Chamado com self._lock; uma transação para todas as linhas
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, kind, text_hash, vector) VALUES (?, ?, ?, ?)",
+            [(self.model_name, kind, h, np.asarray(v, dtype=np.float32).tobytes()) for kind, h, v in linhas],
+        )
+        self._db.commit()
+
+    def _cache_put(self, kind: str, items: dict):
+        with self._lock:
+            self._gravar([(kind, h, v) for h, v in items.items()])
+
+    def _cache_put_adiado(self, kind: str, items: dict):
+        """Guarda em memória (já visível para _cache_get) e deixa a gravação para a thread."""
+        with self._lock:
+            for h, v in items.items():
+                self._pendentes[(kind, h)] = v
+            if self._gravador is None:
+                self._gravador = threading.Thread(target=self._gravar_periodicamente,
+                                                  name="cache-embeddings", daemon=True)
+                self._gravador.start()
+                atexit.register(self.flush)
+
+    def _gravar_periodicamente(self):
+        while True:
+            self._acordar.wait(self.flush_interval)
+            self._acordar.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # Banco ocupado além do busy_timeout: os vetores ficam para a próxima rodada
+                print(f"⚠️ Falha ao gravar o cache de embeddings ({e}); nova tentativa em {self.flush_interval}s.")
+
+    def flush(self):
+        """Grava agora os embeddings de perguntas pendentes."""
+        with self._lock:
+            if not self._pendentes:
+                return
+            self._gravar([(kind, h, v) for (kind, h), v in self._pendentes.items()])
+            self._pendentes.clear()
+
+    # --- Chamadas ao modelo ---
+
+    def _with_retry(self, fn, *args):
+        for tentativa in range(self.max_retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if tentativa == self.max_retries:
+                    raise
+                # Backoff exponencial com jitter para não sincronizar as novas tentativas
+                espera = self.backoff * (2 ** tentativa) * (0.5 + random.random())
+                print(f"⚠️ Falha ao gerar embeddings ({e}); nova tentativa em {espera:.1f}s...")
+                time.sleep(espera)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_text_hash(t) for t in texts]
+        vetores = self._cache_get("document", list(set(hashes)))
+
+        # Só os textos inéditos (e sem repetição) vão para a API
+        pendentes = {}
+        for h, t in zip(hashes, texts):
+            if h not in vetores:
+                pendentes.setdefault(h, t)
+        if pendentes:
+            itens = list(pendentes.items())
+            lotes = [itens[i:i + self.batch_size] for i in range(0, len(itens), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                resultados = pool.map(
+                    lambda lote: self._with_retry(self.base.embed_documents, [t for _, t in lote]), lotes
+                )
+                for lote, vetores_lote in zip(lotes, resultados):
+                    novos = {h: v for (h, _), v in zip(lote, vetores_lote)}
+                    self._cache_put("document", novos)
+                    vetores.update(novos)
+
+        return [vetores[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        h = _text_hash(text)
+        cached = self._cache_get("query", [h])
+        if h in cached:
+            return cached[h]
+        vetor = self._with_retry(self.base.embed_query, text)
+        self._cache_put_adiado("query", {h: vetor})
+        return vetor
+
+    def _embed_query_lote(self, texts: List[str]) -> List[List[float]]:
+        # Uma chamada em lote com o tipo de tarefa das consultas, quando o modelo aceita
+        # (o Gemini diferencia RETRIEVAL_QUERY de RETRIEVAL_DOCUMENT); senão, uma a uma
+        if "task_type" in inspect.signature(self.base.embed_documents).parameters:
+            return self.base.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return [self.base.embed_query(t) for t in texts]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings de várias perguntas (tipo "query" no cache), com os inéditos em lotes."""
+        hashes = [_text_hash(t) for t in texts]
+        vetores = self._cache_get("query", list(set(hashes)))
+        pendentes = {}
+        for h, t in zip(hashes, texts):
+            if h not in vetores:
+                pendentes.setdefault(h, t)
+        if pendentes:
+            itens = list(pendentes.items())
+            lotes = [itens[i:i + self.batch_size] for i in range(0, len(itens), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                resultados = pool.map(
+                    lambda lote: self._with_retry(self._embed_query_lote, [t for _, t in lote]), lotes
+                )
+                for lote, vetores_lote in zip(lotes, resultados):
+                    novos = {h: v for (h, _), v in zip(lote, vetores_lote)}
+                    self._cache_put_adiado("query", novos)
+                    vetores.update(novos)
+        return [vetores[h] for h in hashes]
+
+
+def build_embeddings(api_key: Optional[str] = None) -> CachedEmbeddings:
+    """Cria o modelo de embeddings configurado no .env, já envolvido pelo cache.
+
+    EMBEDDINGS_BACKEND=fake usa o FakeEmbeddings local (sem chave de API), com
+    FAKE_EMBEDDINGS_LATENCY_MS de latência por chamada.
+    """
+    backend = os.getenv("EMBEDDINGS_BACKEND", "google")
+    if backend == "fake":
+        from fake_models import FakeEmbeddings
+        base = FakeEmbeddings(latencia=float(os.getenv("FAKE_EMBEDDINGS_LATENCY_MS", 0)) / 1000)
+        model_name = base.model
+    else:
+        if not api_key:
+            raise ValueError("GEMINI_KEY não encontrada. Por favor, configure no arquivo .env")
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        base = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=api_key)
+        model_name = EMBEDDING_MODEL
+
+    return CachedEmbeddings(
+        base,
+        model_name,
+        batch_size=int(os.getenv("EMBED_BATCH_SIZE", 100)),
+        max_concurrency=int(os.getenv("EMBED_MAX_CONCURRENCY", 4)),
+        max_retries=int(os.getenv("EMBED_MAX_RETRIES", 5)),
+    )
@@ -0,0 +1,136 @@
+# fake_models.py
+# Modelos locais e determinísticos para rodar o pipeline sem chamar a API do Gemini
+# (EMBEDDINGS_BACKEND=fake e CHAT_BACKEND=fake; latência injetada para testes de carga)
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+
+class FakeEmbeddings(Embeddings):
+    """Embeddings de "bag of words" com hashing: textos com palavras em comum ficam próximos.
+
+    Não tem qualidade semântica, mas é estável entre execuções e suficiente para
+    testar indexação, busca e cache offline.
+    """
+
+    def __init__(self, dim: int = 256, latencia: float = 0.0):
+        self.dim = dim
+        self.model = f"fake-embedding-{dim}"
+        self.latencia = latencia # Segundos por chamada (um lote inteiro conta como uma chamada)
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", (text or "").lower()):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+            vec[h % self.dim] += 1.0 if h & (1 << 31) else -1.0
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec.tolist()
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        if self.latencia:
+            time.sleep(self.latencia)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self._embed(text)
+
+
+def _texto(mensagem: BaseMessage) -> str:
+    if isinstance(mensagem.content, str):
+        return mensagem.content
+    # Mensagens multimodais: só as partes de texto
+    return " ".join(p.get("text", "") for p in mensagem.content if isinstance(p, dict))
+
+
+def triagem_simulada(mensagem: str) -> Dict:
+    """Decisão de triagem determinística a partir de palavras-chave e do tamanho da mensagem."""
+    texto = mensagem.lower()
+    if any(p in texto for p in ("chamado", "acesso", "continua", "remoto")):
+        return {"decisao": "ABRIR_CHAMADO", "urgencia": "ALTA" if "urgente" in texto else "MEDIA",
+                "campos_faltantes": []}
+    if len(re.findall(r"\w+", texto)) < 4:
+        return {"decisao": "PEDIR_INFO", "urgencia": "BAIXA",
+                "campos_faltantes": ["módulo do sistema", "descrição do problema"]}
+    return {"decisao": "AUTO_RESOLVER", "urgencia": "BAIXA", "campos_faltantes": []}
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat determinístico no lugar do ChatGoogleGenerativeAI, com latência injetada.
+
+    A resposta do RAG repete o início do contexto recebido ("Não sei..." sem contexto); a
+    triagem (with_structured_output) sai de triagem_simulada(). O uso de tokens é estimado
+    (4 caracteres por token) e vai em usage_metadata, como no Gemini.
+    """
+
+    latencia: float = 0.0 # Segundos por chamada
+    variacao: float = 0.0 # Fração de variação da latência (+/-), fixa para cada prompt
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _espera(self, prompt: str) -> float:
+        if not self.variacao:
+            return self.latencia
+        sorteio = int.from_bytes(hashlib.md5(prompt.encode("utf-8")).digest()[:4], "little") / 2**32
+        return self.latencia * (1 + self.variacao * (2 * sorteio - 1))
+
+    def _responder(self, messages: List[BaseMessage], saida_json: bool = False) -> AIMessage:
+        prompt = "\n".join(_texto(m) for m in messages)
+        pergunta = _texto(messages[-1])
+        if saida_json:
+            conteudo = json.dumps(triagem_simulada(pergunta), ensure_ascii=False)
+        elif "Contexto:" in pergunta:
+            contexto = re.sub(r"\s+", " ", pergunta.split("Contexto:", 1)[1]).strip()
+            conteudo = f"Conforme a documentação: {contexto[:200]}" if contexto else "Não sei, melhor abrir um chamado."
+        else:
+            conteudo = "Análise simulada: " + re.sub(r"\s+", " ", pergunta).strip()[:200]
+        entrada, saida = (len(prompt) + 3) // 4, (len(conteudo) + 3) // 4
+        return AIMessage(content=conteudo, usage_metadata={"input_tokens": entrada, "output_tokens": saida,
+                                                           "total_tokens": entrada + saida})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs) -> ChatResult:
+        mensagem = self._responder(messages, kwargs.get("saida_json", False))
+        time.sleep(self._espera(_texto(messages[-1])))
+        return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs) -> ChatResult:
+        mensagem = self._responder(messages, kwargs.get("saida_json", False))
+        await asyncio.sleep(self._espera(_texto(messages[-1])))
+        return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        # Primeiro token depois de metade da latência; o restante distribuído entre as palavras
+        mensagem = self._responder(messages, kwargs.get("saida_json", False))
+        espera = self._espera(_texto(messages[-1]))
+        palavras = re.findall(r"\S+\s*", mensagem.content)
+        await asyncio.sleep(espera / 2)
+        for i, palavra in enumerate(palavras):
+            if i:
+                await asyncio.sleep(espera / 2 / len(palavras))
+            uso = mensagem.usage_metadata if i == len(palavras) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=palavra, usage_metadata=uso))
+            if run_manager:
+                await run_manager.on_llm_new_token(palavra, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        # Sem tool calling: o modelo devolve o JSON da triagem e ele é validado no schema
+        return self.bind(saida_json=True) | RunnableLambda(lambda m: schema.model_validate_json(m.content))
@@ -0,0 +1,115 @@
+# hybrid_retriever.py
+# Recuperação híbrida: busca vetorial (FAISS) + lexical (BM25) combinadas por Reciprocal Rank Fusion
+#
+# Comparação de acerto num conjunto rotulado (uma pergunta por linha, em JSON):
+#   {"pergunta": "...", "documento": "manual.pdf", "pagina": 12}
+#   python hybrid_retriever.py avaliar perguntas_rotuladas.jsonl
+import os
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[str]:
+    """Combina listas ordenadas de ids: score(id) = soma de 1 / (rrf_k + posição)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for posicao, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + posicao)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever que funde os resultados do FAISS (acima do score_threshold) com os do BM25
+    (acima do bm25_threshold, em fração do score de referência da consulta; ver BM25Index).
+    O BM25 só participa quando o corpus conhece ao menos bm25_cobertura dos termos da pergunta.
+
+    Códigos de CFOP, nomes de menu e mensagens de erro costumam ser achados só pela
+    busca lexical; perguntas parafraseadas, só pela vetorial. Os dois limiares mantêm o
+    "nada relevante -> não sei / abrir chamado": uma pergunta fora do assunto que só
+    compartilha uma palavra comum com os manuais não traz documentos.
+    """
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 4
+    fetch_k: int = 20
+    score_threshold: float = 0.4
+    bm25_threshold: float = 0.3
+    bm25_cobertura: float = 0.5
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vetoriais = self.vectorstore.similarity_search_with_relevance_scores(query, k=self.fetch_k)
+        return self.fundir(query, vetoriais)
+
+    def fundir(self, query: str, vetoriais: List[Tuple[Document, float]]) -> List[Document]:
+        """RRF dos resultados vetoriais (documento, relevância) já buscados com o ranking do BM25."""
+        docs = {doc.id: doc for doc, score in vetoriais if score >= self.score_threshold}
+        ranking_vetorial = list(docs)
+        lexicais = []
+        if self.bm25.cobertura(query) >= self.bm25_cobertura:
+            lexicais = self.bm25.buscar(query, self.fetch_k)
+        minimo = self.bm25_threshold * self.bm25.score_referencia(query) if lexicais else 0.0
+        ranking_lexical = [doc_id for doc_id, score in lexicais if score >= minimo]
+
+        resultado = []
+        for doc_id in reciprocal_rank_fusion([ranking_vetorial, ranking_lexical], self.rrf_k)[:self.k]:
+            doc = docs.get(doc_id) or self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                resultado.append(doc)
+        return resultado
+
+
+def _acertou(docs: List[Document], esperado: Dict) -> bool:
+    for d in docs:
+        if Path(d.metadata.get("source", "")).name == esperado["documento"] and \
+                int(d.metadata.get("page", 0)) + 1 == int(esperado["pagina"]):
+            return True
+    return False
+
+
+def avaliar(retrievers: Dict[str, BaseRetriever], perguntas_path: Path) -> Dict[str, float]:
+    """Taxa de acerto (documento e página esperados entre os k retornados) de cada retriever."""
+    with open(perguntas_path, encoding="utf-8") as f:
+        rotuladas = [json.loads(linha) for linha in f if linha.strip()]
+    return {
+        nome: sum(_acertou(r.invoke(q["pergunta"]), q) for q in rotuladas) / max(len(rotuladas), 1)
+        for nome, r in retrievers.items()
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from langchain_community.vectorstores import FAISS
+    from bm25_index import BM25Index
+    from embedding_cache import build_embeddings
+    from index_versions import diretorio_publicado
+
+    parser = argparse.ArgumentParser(description="Recuperação híbrida FAISS + BM25")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_avaliar = sub.add_parser("avaliar", help="Compara a taxa de acerto vetorial, lexical e híbrida")
+    p_avaliar.add_argument("perguntas", type=Path)
+    p_avaliar.add_argument("--vector-store", type=Path, default=Path("./vector_store/"))
+    p_avaliar.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    load_dotenv()
+    args.vector_store = diretorio_publicado(args.vector_store)
+    vectorstore = FAISS.load_local(str(args.vector_store), build_embeddings(os.getenv("GEMINI_KEY")),
+                                   allow_dangerous_deserialization=True)
+    bm25 = BM25Index.carregar(args.vector_store / "bm25.npz")
+    retrievers = {
+        "vetorial": vectorstore.as_retriever(search_type="similarity_score_threshold",
+                                             search_kwargs={"score_threshold": 0.4, "k": args.k}),
+        # score_threshold acima de 1 descarta todos os resultados vetoriais
+        "lexical": HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=args.k, score_threshold=2.0),
+        "hibrida": HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=args.k),
+    }
+    for nome, taxa in avaliar(retrievers, args.perguntas).items():
+        print(f"  {nome:<9} acerto@{args.k}: {taxa:.1%}")
@@ -0,0 +1,169 @@
+# image_analysis.py
+# Preparo em memória das imagens enviadas ao /analyze_image e cache das análises por hash perceptual
+import io
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from answer_cache import normalizar_pergunta
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", 1600)) # Lado maior enviado ao Gemini, em pixels
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", 10 * 2**20))
+
+# Assinaturas (magic bytes) dos formatos aceitos pelo Gemini
+_ASSINATURAS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class ImagemInvalida(ValueError):
+    pass
+
+
+def detectar_mime(dados: bytes) -> Optional[str]:
+    """Tipo da imagem pelo conteúdo (o nome do arquivo enviado pode mentir ou nem ter extensão)."""
+    for assinatura, mime in _ASSINATURAS:
+        if dados.startswith(assinatura):
+            return mime
+    if dados[:4] == b"RIFF" and dados[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _dhash(pix: fitz.Pixmap) -> int:
+    """Difference hash de 64 bits: cinza 9x8, cada bit diz se o pixel é mais claro que o vizinho."""
+    cinza = fitz.Pixmap(fitz.csGRAY, pix) if pix.n - pix.alpha != 1 else pix
+    if cinza.alpha:
+        cinza = fitz.Pixmap(cinza, 0)
+    pequena = fitz.Pixmap(cinza, 9, 8, None)
+    pixels = np.frombuffer(pequena.samples, dtype=np.uint8).reshape(8, pequena.stride)[:, :9].astype(np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _decodificar(dados: bytes, mime: str) -> fitz.Pixmap:
+    try:
+        return fitz.Pixmap(dados)
+    except Exception:
+        if mime != "image/webp":
+            raise
+    # O PyMuPDF não lê WebP: o Pillow decodifica e o resto do preparo (redução, hash) é o mesmo
+    from PIL import Image
+
+    with Image.open(io.BytesIO(dados)) as imagem:
+        com_alfa = imagem.mode in ("RGBA", "LA", "PA") or "transparency" in imagem.info
+        imagem = imagem.convert("RGBA" if com_alfa else "RGB")
+        return fitz.Pixmap(fitz.csRGB, imagem.width, imagem.height, imagem.tobytes(), com_alfa)
+
+
+def preparar_imagem(dados: bytes) -> Tuple[bytes, str, Optional[int]]:
+    """Decodifica uma única vez, reduz para IMAGE_MAX_SIDE e recomprime.
+
+    Retorna (bytes para o modelo, MIME, hash perceptual). Imagens já pequenas e menores que a
+    versão em JPEG seguem como vieram; as reduzidas vão em JPEG ou PNG, o que ficar menor.
+    """
+    mime = detectar_mime(dados)
+    if mime is None:
+        raise ImagemInvalida("Formato de imagem não suportado. Envie PNG, JPEG, GIF ou WebP.")
+    try:
+        pix = _decodificar(dados, mime)
+    except Exception:
+        raise ImagemInvalida("Não foi possível ler a imagem enviada.")
+
+    hash_perceptual = _dhash(pix)
+    if pix.n - pix.alpha >= 4:  # CMYK -> RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    if pix.alpha:  # JPEG não tem canal alfa
+        pix = fitz.Pixmap(pix, 0)
+
+    maior_lado = max(pix.width, pix.height)
+    reduzir = maior_lado > IMAGE_MAX_SIDE
+    if reduzir:
+        escala = IMAGE_MAX_SIDE / maior_lado
+        pix = fitz.Pixmap(pix, max(1, round(pix.width * escala)), max(1, round(pix.height * escala)), None)
+    jpeg = pix.tobytes("jpg", jpg_quality=IMAGE_JPEG_QUALITY)
+    if not reduzir:
+        if len(dados) <= len(jpeg) and mime != "image/gif":
+            return dados, mime, hash_perceptual
+        return jpeg, "image/jpeg", hash_perceptual
+    # Prints de tela (texto, cores chapadas) costumam ficar menores em PNG do que em JPEG
+    png = pix.tobytes("png")
+    if len(png) < len(jpeg):
+        return png, "image/png", hash_perceptual
+    return jpeg, "image/jpeg", hash_perceptual
+
+
+class ImageAnalysisCache:
+    """Cache LRU com TTL das análises, por (hash perceptual, pergunta normalizada).
+
+    Um print reenviado (mesmo recortado/recomprimido de leve) tem hash a no máximo
+    `distancia_maxima` bits de diferença do original e reaproveita a análise. Os 64 bits
+    são divididos em distancia_maxima + 1 faixas: hashes tão próximos têm ao menos uma faixa
+    idêntica, então a busca só compara as entradas que coincidem em alguma faixa.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl: float = 3600.0, distancia_maxima: int = 4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.distancia_maxima = distancia_maxima
+        self._largura_faixa = -(-64 // (distancia_maxima + 1))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Any]]" = OrderedDict()
+        # (faixa, bits da faixa, pergunta) -> hashes guardados com esses bits
+        self._faixas: Dict[Tuple[int, int, str], Set[int]] = {}
+        self.hits_exatos = self.hits_semanticos = self.misses = 0
+
+    def _chaves_faixas(self, hash_perceptual: int, pergunta: str) -> List[Tuple[int, int, str]]:
+        mascara = (1 << self._largura_faixa) - 1
+        return [(i, (hash_perceptual >> inicio) & mascara, pergunta)
+                for i, inicio in enumerate(range(0, 64, self._largura_faixa))]
+
+    def get(self, hash_perceptual: int, pergunta: str) -> Tuple[Optional[Any], str]:
+        """Retorna (análise ou None, tipo: HIT_EXATO | HIT_SEMANTICO | MISS)."""
+        pergunta = normalizar_pergunta(pergunta)
+        limite = time.monotonic() - self.ttl
+        with self._lock:
+            entrada = self._entries.get((hash_perceptual, pergunta))
+            if entrada is not None and entrada[0] >= limite:
+                self._entries.move_to_end((hash_perceptual, pergunta))
+                self.hits_exatos += 1
+                return entrada[1], "HIT_EXATO"
+            candidatos = set()
+            for chave_faixa in self._chaves_faixas(hash_perceptual, pergunta):
+                candidatos |= self._faixas.get(chave_faixa, set())
+            melhor = None # (distância, -criado, hash): o mais próximo e, no empate, o mais recente
+            for h in candidatos:
+                criado, _ = self._entries[(h, pergunta)]
+                distancia = (h ^ hash_perceptual).bit_count()
+                if criado >= limite and distancia <= self.distancia_maxima:
+                    melhor = min(melhor or (distancia, -criado, h), (distancia, -criado, h))
+            if melhor is not None:
+                self._entries.move_to_end((melhor[2], pergunta))
+                self.hits_semanticos += 1
+                return self._entries[(melhor[2], pergunta)][1], "HIT_SEMANTICO"
+            self.misses += 1
+            return None, "MISS"
+
+    def put(self, hash_perceptual: int, pergunta: str, valor: Any):
+        chave = (hash_perceptual, normalizar_pergunta(pergunta))
+        with self._lock:
+            self._entries[chave] = (time.monotonic(), valor)
+            self._entries.move_to_end(chave)
+            for chave_faixa in self._chaves_faixas(*chave):
+                self._faixas.setdefault(chave_faixa, set()).add(hash_perceptual)
+            while len(self._entries) > self.max_entries:
+                (h, p), _ = self._entries.popitem(last=False)
+                for chave_faixa in self._chaves_faixas(h, p):
+                    hashes = self._faixas[chave_faixa]
+                    hashes.discard(h)
+                    if not hashes:
+                        del self._faixas[chave_faixa]
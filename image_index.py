@@ -0,0 +1,42 @@
+# image_index.py
+# Índice (documento, página) -> imagens extraídas, gerado na indexação e lido pela API
+import os
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+def write_image_index(path: Path, manifest: dict):
+    """Gera o índice compacto {documento: {página: [arquivos]}} a partir do manifest."""
+    indice = {}
+    for nome, entrada in manifest["arquivos"].items():
+        paginas = {pagina: arquivos for pagina, arquivos in entrada["imagens"].items() if arquivos}
+        if paginas:
+            indice[Path(nome).stem] = paginas
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(indice, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class ImageIndex:
+    """Consulta O(1) das imagens de uma página.
+
+    Cada versão do índice tem o seu image_index.json, que nunca é regravado; uma
+    reconstrução publica outra versão, carregada junto com o restante do índice.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._index: Dict[Tuple[str, int], List[str]] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                bruto = json.load(f)
+            self._index = {
+                (src, int(pagina)): arquivos
+                for src, paginas in bruto.items()
+                for pagina, arquivos in paginas.items()
+            }
+
+    def get(self, src: str, page: int) -> List[str]:
+        return self._index.get((src, page), [])
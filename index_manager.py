@@ -0,0 +1,181 @@
+# index_manager.py
+# Versão do índice em uso pela API e troca a quente (hot swap) quando uma nova é publicada
+import os
+import asyncio
+import weakref
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from bm25_index import BM25Index
+from hybrid_retriever import HybridRetriever
+from image_index import ImageIndex
+from index_versions import versao_atual, diretorio_versao
+from mmap_docstore import MmapDocstore, existe_docstore
+from parent_chunks import ParentRetriever, PARENTS_NOME
+from vector_index import load_vectorstore
+
+# Chunking pai/filho: seções entregues ao LLM e trechos buscados para chegar a elas
+PARENT_K = int(os.getenv("PARENT_K", 3))
+PARENT_FETCH_K = int(os.getenv("PARENT_FETCH_K", 12))
+
+
+class IndiceCarregado:
+    """Tudo o que uma requisição precisa de uma versão do índice, carregado junto.
+
+    Cada requisição pega uma referência no início e a usa até o fim; quando a última
+    referência a uma versão substituída some, o objeto é coletado e a memória liberada.
+    """
+
+    def __init__(self, versao: str, diretorio: Path, embeddings):
+        self.versao = versao
+        self.diretorio = diretorio
+        # Índice do tipo escolhido na indexação (flat/HNSW/IVF-PQ), mapeado via mmap em vez de lido para a RAM
+        self.vectorstore = load_vectorstore(diretorio, embeddings)
+        # Índice gerado com CHUNKING=pai: busca mais trechos, que depois viram no máximo PARENT_K seções
+        com_pais = existe_docstore(diretorio, PARENTS_NOME)
+        self.k = PARENT_FETCH_K if com_pais else 4
+        self.score_threshold = 0.4
+        self.retriever = self.vectorstore.as_retriever(
+            search_type="similarity_score_threshold",
+            search_kwargs={"score_threshold": self.score_threshold, "k": self.k}
+        )
+        # Busca híbrida (vetorial + BM25) quando o índice lexical existe; RECUPERACAO_HIBRIDA=0 desliga
+        self.hibrido: Optional[HybridRetriever] = None
+        bm25_path = diretorio / "bm25.npz"
+        if os.getenv("RECUPERACAO_HIBRIDA", "1") == "1" and bm25_path.exists():
+            self.hibrido = HybridRetriever(vectorstore=self.vectorstore, bm25=BM25Index.carregar(bm25_path),
+                                           score_threshold=self.score_threshold, k=self.k,
+                                           fetch_k=max(20, self.k),
+                                           bm25_threshold=float(os.getenv("BM25_LIMIAR", 0.3)),
+                                           bm25_cobertura=float(os.getenv("BM25_COBERTURA", 0.5)))
+            self.retriever = self.hibrido
+        self.pais: Optional[ParentRetriever] = None
+        if com_pais:
+            self.pais = ParentRetriever(base=self.retriever, pais=MmapDocstore(diretorio, PARENTS_NOME),
+                                        k=PARENT_K)
+            self.retriever = self.pais
+        # Índice (documento, página) -> imagens da mesma versão
+        self.image_index = ImageIndex(diretorio / "image_index.json")
+        self._posicoes: Optional[Dict[str, int]] = None
+
+    def buscar_lote(self, perguntas: List[str], vetores: List[List[float]]) -> List[List]:
+        """Mesmo resultado do retriever para várias perguntas com os embeddings já calculados.
+
+        Uma única chamada ao index.search do FAISS para o lote inteiro; a fusão com o BM25 e
+        a troca pelas seções pai continuam por pergunta (são baratas).
+        """
+        if not perguntas:
+            return []
+        fetch_k = self.hibrido.fetch_k if self.hibrido is not None else self.k
+        matriz = np.asarray(vetores, dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            import faiss
+            faiss.normalize_L2(matriz)
+        distancias, posicoes = self.vectorstore.index.search(matriz, fetch_k)
+        relevancia = self.vectorstore._select_relevance_score_fn()
+        ids = self.vectorstore.index_to_docstore_id
+        docstore = self.vectorstore.docstore
+
+        resultados = []
+        for pergunta, linha_dist, linha_pos in zip(perguntas, distancias, posicoes):
+            vetoriais = []
+            for distancia, posicao in zip(linha_dist, linha_pos):
+                if posicao == -1:
+                    continue
+                doc = docstore.search(ids[int(posicao)])
+                if isinstance(doc, str):
+                    raise ValueError(f"Documento da posição {posicao} não encontrado no docstore: {doc}")
+                vetoriais.append((doc, relevancia(float(distancia))))
+            if self.hibrido is not None:
+                docs = self.hibrido.fundir(pergunta, vetoriais)
+            else:
+                docs = [doc for doc, score in vetoriais if score >= self.score_threshold]
+            if self.pais is not None:
+                docs = self.pais.trocar_por_pais(docs)
+            resultados.append(docs)
+        return resultados
+
+    def _posicao(self, doc_id: str) -> int:
+        docstore = self.vectorstore.docstore
+        if isinstance(docstore, MmapDocstore):
+            return docstore.posicao(doc_id)
+        # Versões antigas (docstore do pickle): mapa id -> posição montado uma vez
+        if self._posicoes is None:
+            self._posicoes = {i: pos for pos, i in self.vectorstore.index_to_docstore_id.items()}
+        return self._posicoes.get(doc_id, -1)
+
+    def vetores_armazenados(self, docs: List) -> List[Optional[np.ndarray]]:
+        """Vetor de cada documento gravado na indexação: o do índice FAISS ou, para as seções pai,
+        o do docstore delas. None se não houver (IVF-PQ, versões gravadas sem os vetores das seções)."""
+        vetores = []
+        for doc in docs:
+            posicao = self._posicao(doc.id) if doc.id else -1
+            if posicao < 0:
+                docstore_pais = self.pais.pais if self.pais is not None else None
+                vetores.append(docstore_pais.vetor(docstore_pais.posicao(doc.id))
+                               if docstore_pais is not None and doc.id else None)
+                continue
+            try:
+                vetores.append(self.vectorstore.index.reconstruct(posicao))
+            except RuntimeError:
+                # IVF-PQ sem mapa direto não reconstrói vetores
+                vetores.append(None)
+        return vetores
+
+
+class IndexManager:
+    """Mantém a versão atual do índice e troca por uma nova sem interromper requisições."""
+
+    def __init__(self, base: Path, embeddings):
+        self.base = Path(base)
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        self._atual: Optional[IndiceCarregado] = None
+
+    @property
+    def carregado(self) -> bool:
+        return self._atual is not None
+
+    @property
+    def atual(self) -> IndiceCarregado:
+        if self._atual is None:
+            self.recarregar()
+        return self._atual
+
+    def _versao_publicada(self) -> tuple:
+        versao = versao_atual(self.base)
+        if versao:
+            return versao, diretorio_versao(self.base, versao)
+        # Vector store do formato antigo (sem versões)
+        return "legado", self.base
+
+    def recarregar(self) -> dict:
+        """Carrega a versão apontada por CURRENT, se for diferente da atual, e faz a troca.
+
+        O carregamento acontece antes da troca; até ela, as requisições seguem na versão antiga.
+        """
+        with self._lock:
+            anterior = self._atual.versao if self._atual else None
+            versao, diretorio = self._versao_publicada()
+            if versao == anterior:
+                return {"versao_anterior": anterior, "versao_atual": versao, "trocou": False}
+            novo = IndiceCarregado(versao, diretorio, self.embeddings)
+            if self._atual is not None:
+                weakref.finalize(self._atual, print, f"🗑️ Versão '{anterior}' do índice descarregada.")
+            # Atribuição atômica: requisições novas já pegam a versão nova
+            self._atual = novo
+            print(f"🔄 Índice versão '{versao}' em uso.")
+            return {"versao_anterior": anterior, "versao_atual": versao, "trocou": True}
+
+    async def vigiar(self, intervalo: float):
+        """Verifica periodicamente o ponteiro CURRENT e troca a versão quando ele muda."""
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                if versao_atual(self.base) not in (None, self._atual.versao if self._atual else None):
+                    await asyncio.to_thread(self.recarregar)
+            except Exception as e:
+                print(f"❌ Erro ao recarregar o índice: {e}")
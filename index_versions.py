@@ -0,0 +1,69 @@
+# index_versions.py
+# Diretórios versionados do índice: vector_store/versions/<versão>/ + ponteiro vector_store/CURRENT
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+VERSIONS_DIRNAME = "versions"
+CURRENT_FILENAME = "CURRENT"
+
+
+def nova_versao() -> str:
+    # Começa pelo timestamp: a ordem alfabética das versões é a ordem em que foram criadas
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+
+
+def diretorio_versao(base: Path, versao: str) -> Path:
+    return base / VERSIONS_DIRNAME / versao
+
+
+def versao_atual(base: Path) -> Optional[str]:
+    try:
+        return (base / CURRENT_FILENAME).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def diretorio_publicado(base: Path) -> Path:
+    """Diretório da versão apontada por CURRENT; no formato antigo (sem versões), a própria base."""
+    versao = versao_atual(base)
+    return diretorio_versao(base, versao) if versao else base
+
+
+def listar_versoes(base: Path) -> List[str]:
+    pasta = base / VERSIONS_DIRNAME
+    if not pasta.exists():
+        return []
+    return sorted(p.name for p in pasta.iterdir() if p.is_dir() and not p.name.startswith("."))
+
+
+def preparar_versao(base: Path, versao: str) -> Path:
+    """Cria o diretório temporário onde a nova versão é escrita antes de ser publicada."""
+    tmp_dir = base / VERSIONS_DIRNAME / f".{versao}.tmp"
+    tmp_dir.mkdir(parents=True)
+    return tmp_dir
+
+
+def publicar_versao(base: Path, versao: str, tmp_dir: Path):
+    """Torna a versão visível: renomeia o diretório e troca o ponteiro CURRENT, ambos atômicos."""
+    os.rename(tmp_dir, diretorio_versao(base, versao))
+    tmp_current = base / f".{CURRENT_FILENAME}.tmp"
+    tmp_current.write_text(versao, encoding="utf-8")
+    os.replace(tmp_current, base / CURRENT_FILENAME)
+
+
+def remover_versoes_antigas(base: Path, manter: int) -> List[str]:
+    """Apaga as versões mais antigas, mantendo as `manter` mais recentes e sempre a atual.
+
+    Processos da API que ainda usam uma versão apagada continuam funcionando: no Linux os
+    arquivos já abertos/mapeados só somem de fato quando o último descritor é fechado.
+    """
+    atual = versao_atual(base)
+    versoes = listar_versoes(base)
+    removidas = [v for v in versoes[:max(0, len(versoes) - manter)] if v != atual]
+    for versao in removidas:
+        shutil.rmtree(diretorio_versao(base, versao), ignore_errors=True)
+    return removidas
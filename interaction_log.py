@@ -0,0 +1,287 @@
+# interaction_log.py
+# Log estruturado (JSONL) de cada interação do /chat e do /analyze_image: triagem, chamado
+# aberto, fontes usadas, cache e latência, para análise de tráfego e conjuntos de avaliação
+#
+# A requisição só coloca o registro num buffer em memória (limitado: cheio, o registro é
+# descartado e contado, nunca espera). Uma thread grava em lotes, faz fsync periodicamente e
+# rotaciona o arquivo por tamanho, comprimindo (gzip) os rotacionados se configurado.
+# Cada processo (worker do uvicorn) grava e rotaciona só os próprios arquivos, com o PID no
+# nome; a leitura junta os de todos.
+#
+# Leitura para replay e análises offline:
+#   python interaction_log.py ler --tipo chat --desde 2026-10-01 > perguntas.jsonl
+#   python benchmark.py carga perguntas.jsonl
+#   python interaction_log.py resumo
+import os
+import sys
+import time
+import gzip
+import json
+import queue
+import shutil
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from metrics import INTERACOES_BUFFER, INTERACOES_LOG
+
+INTERACOES_LOG_DIR = Path(os.getenv("INTERACOES_LOG_DIR", "./logs/interacoes"))
+INTERACOES_MAX_BYTES = int(os.getenv("INTERACOES_MAX_BYTES", 64 * 2**20)) # Tamanho que dispara a rotação
+INTERACOES_MAX_ARQUIVOS = int(os.getenv("INTERACOES_MAX_ARQUIVOS", 0)) # Rotacionados mantidos; 0 = todos
+INTERACOES_COMPRIMIR = os.getenv("INTERACOES_COMPRIMIR", "1") == "1"
+INTERACOES_BUFFER_MAX = int(os.getenv("INTERACOES_BUFFER_MAX", 10000))
+INTERACOES_LOTE = int(os.getenv("INTERACOES_LOTE", 256))
+INTERACOES_FSYNC_INTERVALO = float(os.getenv("INTERACOES_FSYNC_INTERVALO", 1.0)) # s
+
+# Arquivo em gravação: interacoes-atual-<pid>.jsonl; rotacionados: interacoes-<carimbo>-<pid>.jsonl[.gz]
+PREFIXO_ATUAL = "interacoes-atual-"
+_FIM = object() # Sentinela para a thread de gravação encerrar
+
+
+def agora_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class RegistroInteracoes:
+    """Gravação write-behind: `registrar()` não bloqueia; a thread grava, sincroniza e rotaciona.
+
+    Um registro é aceito como está e serializado na thread de gravação, então quem registra
+    não deve alterá-lo depois.
+    """
+
+    def __init__(self, diretorio: Path = INTERACOES_LOG_DIR, max_bytes: int = INTERACOES_MAX_BYTES,
+                 max_arquivos: int = INTERACOES_MAX_ARQUIVOS, comprimir: bool = INTERACOES_COMPRIMIR,
+                 buffer_max: int = INTERACOES_BUFFER_MAX, lote: int = INTERACOES_LOTE,
+                 intervalo_fsync: float = INTERACOES_FSYNC_INTERVALO):
+        self.diretorio = Path(diretorio)
+        self.max_bytes = max_bytes
+        self.max_arquivos = max_arquivos
+        self.comprimir = comprimir
+        self.lote = lote
+        self.intervalo_fsync = intervalo_fsync
+        self._fila: "queue.Queue" = queue.Queue(maxsize=buffer_max)
+        self._arquivo = None
+        self._tamanho = 0
+        self._pendente_fsync = False
+        self._fechado = False
+        self.gravados = self.descartados = self.erros = 0
+        self._thread = threading.Thread(target=self._executar, name="registro-interacoes", daemon=True)
+        self._thread.start()
+
+    # --- Lado da requisição ---
+
+    def registrar(self, registro: Dict) -> bool:
+        """Enfileira o registro; com o buffer cheio (ou já fechado) descarta e retorna False."""
+        if self._fechado:
+            return False
+        try:
+            self._fila.put_nowait(registro)
+            return True
+        except queue.Full:
+            self.descartados += 1
+            INTERACOES_LOG.incrementar(1, "descartado")
+            return False
+
+    def fechar(self, timeout: float = 10.0):
+        """Grava o que ainda está no buffer, faz fsync e encerra a thread."""
+        if self._fechado:
+            return
+        self._fechado = True
+        try:
+            self._fila.put(_FIM, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def estatisticas(self) -> Dict:
+        return {"gravados": self.gravados, "descartados": self.descartados, "erros": self.erros,
+                "no_buffer": self._fila.qsize(), "diretorio": str(self.diretorio)}
+
+    # --- Thread de gravação ---
+
+    def _executar(self):
+        proximo_fsync = time.monotonic() + self.intervalo_fsync
+        fim = False
+        while not fim:
+            lote = []
+            try:
+                lote.append(self._fila.get(timeout=self.intervalo_fsync))
+                while len(lote) < self.lote:
+                    lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                pass
+            if any(r is _FIM for r in lote):
+                fim = True
+                lote = [r for r in lote if r is not _FIM]
+            try:
+                if lote:
+                    self._gravar(lote)
+                if self._pendente_fsync and (fim or time.monotonic() >= proximo_fsync):
+                    self._sincronizar()
+                    proximo_fsync = time.monotonic() + self.intervalo_fsync
+            except Exception as e:
+                # Disco cheio, permissão etc.: o lote se perde, mas a thread continua para os próximos
+                self.erros += len(lote)
+                INTERACOES_LOG.incrementar(len(lote), "erro")
+                print(f"⚠️ Falha ao gravar o log de interações: {e}")
+                self._fechar_arquivo()
+            INTERACOES_BUFFER.definir(self._fila.qsize())
+        self._fechar_arquivo()
+
+    def _abrir(self):
+        if self._arquivo is None:
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            self._arquivo = open(self._caminho_atual(), "a", encoding="utf-8")
+            self._tamanho = self._arquivo.tell()
+        return self._arquivo
+
+    def _caminho_atual(self) -> Path:
+        return self.diretorio / f"{PREFIXO_ATUAL}{os.getpid()}.jsonl"
+
+    def _gravar(self, lote: List[Dict]):
+        linhas = []
+        for registro in lote:
+            try:
+                linhas.append(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+            except (TypeError, ValueError) as e:
+                self.erros += 1
+                INTERACOES_LOG.incrementar(1, "erro")
+                print(f"⚠️ Registro de interação não serializável: {e}")
+        if not linhas:
+            return
+        texto = "".join(linhas)
+        arquivo = self._abrir()
+        arquivo.write(texto)
+        arquivo.flush()
+        self._tamanho += len(texto.encode("utf-8"))
+        self._pendente_fsync = True
+        self.gravados += len(linhas)
+        INTERACOES_LOG.incrementar(len(linhas), "gravado")
+        if self._tamanho >= self.max_bytes:
+            self._rotacionar()
+
+    def _sincronizar(self):
+        if self._arquivo is not None:
+            os.fsync(self._arquivo.fileno())
+        self._pendente_fsync = False
+
+    def _fechar_arquivo(self):
+        if self._arquivo is None:
+            return
+        try:
+            self._arquivo.flush()
+            os.fsync(self._arquivo.fileno())
+            self._arquivo.close()
+        except OSError:
+            pass
+        self._arquivo = None
+        self._pendente_fsync = False
+
+    def _rotacionar(self):
+        self._fechar_arquivo()
+        carimbo = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        rotacionado = self.diretorio / f"interacoes-{carimbo}-{os.getpid()}.jsonl"
+        os.replace(self._caminho_atual(), rotacionado)
+        if self.comprimir:
+            # Nome temporário fora do padrão lido por arquivos_do_log até o .gz ficar completo
+            tmp_path = self.diretorio / f".{rotacionado.name}.gz.tmp"
+            with open(rotacionado, "rb") as origem, gzip.open(tmp_path, "wb") as destino:
+                shutil.copyfileobj(origem, destino)
+            os.replace(tmp_path, f"{rotacionado}.gz")
+            rotacionado.unlink()
+        if self.max_arquivos > 0:
+            for antigo in _rotacionados(self.diretorio)[:-self.max_arquivos]:
+                antigo.unlink(missing_ok=True)
+
+
+# --- Leitura ---
+
+def _rotacionados(diretorio: Path) -> List[Path]:
+    # O carimbo no início do nome ordena os arquivos cronologicamente (de todos os workers)
+    return sorted(p for p in Path(diretorio).glob("interacoes-*.jsonl*") if not p.name.startswith(PREFIXO_ATUAL))
+
+
+def arquivos_do_log(diretorio: Path = INTERACOES_LOG_DIR) -> List[Path]:
+    """Arquivos do log de todos os workers: rotacionados em ordem cronológica e os em gravação por último.
+
+    Entre workers a ordem dos registros é só aproximada; use o campo "ts" quando ela importar.
+    """
+    return _rotacionados(diretorio) + sorted(Path(diretorio).glob(f"{PREFIXO_ATUAL}*.jsonl"))
+
+
+def ler_registros(diretorio: Path = INTERACOES_LOG_DIR, tipo: Optional[str] = None,
+                  desde: Optional[str] = None) -> Iterator[Dict]:
+    """Percorre os registros em ordem, sem carregar os arquivos inteiros em memória.
+
+    `desde` é um prefixo de data/hora ISO em UTC (ex.: "2026-10-01"). Linhas truncadas
+    (queda do processo no meio de uma gravação) são ignoradas.
+    """
+    for caminho in arquivos_do_log(diretorio):
+        abrir = gzip.open if caminho.suffix == ".gz" else open
+        try:
+            with abrir(caminho, "rt", encoding="utf-8") as f:
+                for linha in f:
+                    if not linha.strip():
+                        continue
+                    try:
+                        registro = json.loads(linha)
+                    except json.JSONDecodeError:
+                        continue
+                    if tipo is not None and registro.get("tipo") != tipo:
+                        continue
+                    if desde is not None and registro.get("ts", "") < desde:
+                        continue
+                    yield registro
+        except FileNotFoundError:
+            continue # Rotacionado (ou apagado pela retenção) durante a leitura
+        except EOFError:
+            continue # .gz incompleto
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def resumir(registros: Iterator[Dict]) -> Dict:
+    """Contagens por tipo, ação final e cache, e latências (p50/p95) por tipo."""
+    resumo: Dict = {"total": 0, "por_tipo": {}, "acao_final": {}, "cache": {}, "erros": 0, "latencia_ms": {}}
+    latencias: Dict[str, List[float]] = {}
+    for registro in registros:
+        tipo = registro.get("tipo", "?")
+        resumo["total"] += 1
+        resumo["por_tipo"][tipo] = resumo["por_tipo"].get(tipo, 0) + 1
+        if registro.get("acao_final"):
+            resumo["acao_final"][registro["acao_final"]] = resumo["acao_final"].get(registro["acao_final"], 0) + 1
+        if registro.get("cache"):
+            resumo["cache"][registro["cache"]] = resumo["cache"].get(registro["cache"], 0) + 1
+        resumo["erros"] += "erro" in registro
+        if "latencia_ms" in registro:
+            latencias.setdefault(tipo, []).append(registro["latencia_ms"])
+    for tipo, valores in latencias.items():
+        resumo["latencia_ms"][tipo] = {"p50": _percentil(valores, 0.5), "p95": _percentil(valores, 0.95)}
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leitura do log de interações da API")
+    parser.add_argument("--dir", type=Path, default=INTERACOES_LOG_DIR)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_ler = sub.add_parser("ler", help="Imprime os registros em JSONL (para replay ou outras ferramentas)")
+    p_resumo = sub.add_parser("resumo", help="Contagens e latências do período")
+    for p in (p_ler, p_resumo):
+        p.add_argument("--tipo", choices=["chat", "imagem"])
+        p.add_argument("--desde", help="Data/hora ISO em UTC, ex.: 2026-10-01")
+    args = parser.parse_args()
+
+    registros = ler_registros(args.dir, args.tipo, args.desde)
+    if args.comando == "ler":
+        try:
+            for registro in registros:
+                sys.stdout.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except BrokenPipeError:
+            pass # ex.: | head
+    else:
+        print(json.dumps(resumir(registros), ensure_ascii=False, indent=2))
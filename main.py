@@ -1,70 +1,341 @@
 # main.py
+import time
+_INICIO_IMPORTACAO = time.perf_counter()
+
 import os
 import re
+import json
+import uuid
 import base64
+import asyncio
+import inspect
 import pathlib
-import tempfile
-from typing import List, Dict, Optional, Literal
+import functools
+import contextlib
+import contextvars
+import threading
+from typing import TYPE_CHECKING, Any, List, Dict, Optional, Literal, Annotated
+import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path 
 
 # FastAPI e Pydantic
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Mount
 from pydantic import BaseModel, Field
 
-# LangChain e Google GenAI
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+# LangChain (cliente do Gemini, FAISS e LangGraph são importados só quando usados)
 from langchain_core.prompts import ChatPromptTemplate
-from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.messages import SystemMessage, HumanMessage
-from langgraph.graph import StateGraph, START, END
 
-# --- CONFIGURAÇÃO INICIAL ---
-load_dotenv()
-GOOGLE_API_KEY = os.getenv('GEMINI_KEY')
+from admission_control import LimiteConcorrencia, SingleFlight, Sobrecarga
+from embedding_cache import build_embeddings
+from answer_cache import AnswerCache, normalizar_pergunta
+from context_packing import empacotar
+from interaction_log import RegistroInteracoes, agora_iso
+from metrics import (ContadorTokens, HTTP_SEGUNDOS, exportar, iniciar_debug, medir,
+                     registrar_contexto, registrar_recuperacao, registrar_span)
+from snippets import extrair_trecho, termos_da_consulta
+from triage_classifier import KnnTriageClassifier, TRIAGEM_MODELO_PATH
 
+if TYPE_CHECKING:
+    from index_manager import IndexManager, IndiceCarregado
 
-# Validação da chave de API
-if not GOOGLE_API_KEY:
-    raise ValueError("GEMINI_KEY não encontrada. Por favor, configure no arquivo .env")
+# --- CONFIGURAÇÃO INICIAL ---
+load_dotenv()
+GOOGLE_API_KEY = os.getenv('GEMINI_KEY') # Validada só quando o LLM ou os embeddings são criados
 
 # Definir caminhos usando Path para consistência
-VECTOR_STORE_PATH = Path("./vector_store/")
+VECTOR_STORE_PATH = Path("./vector_store/") # Versões em versions/<versão>/, a atual apontada por CURRENT
 IMAGE_SAVE_DIR = Path("imagens_documentos") # Definido corretamente como objeto Path
 
+# Intervalo (s) para verificar se create_vector_store.py publicou uma versão nova; 0 desliga
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", 30))
+# Token exigido no header X-Admin-Token dos endpoints /admin (vazio = sem verificação)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Com STARTUP_WARMUP=1 (padrão) os recursos são carregados em segundo plano assim que a API
+# sobe; com 0, na primeira requisição que precisar de cada um (útil com uvicorn --reload)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+# Retry-After (s) do 503 para requisições que chegam enquanto o aquecimento carrega o índice
+AQUECIMENTO_RETRY_AFTER = int(os.getenv("AQUECIMENTO_RETRY_AFTER", 5))
+# Log de interações do /chat e do /analyze_image (ver interaction_log.py); 0 desliga
+INTERACOES_LOG = os.getenv("INTERACOES_LOG", "1") == "1"
+
+
+# --- RECURSOS PESADOS (criados sob demanda) ---
+# Importar este módulo não cria clientes nem carrega o índice: cada recurso tem um acessor
+# obter_*() que o cria na primeira chamada. O tempo de cada um fica em tempos_inicializacao.
+_recursos: Dict[str, Any] = {}
+tempos_inicializacao: Dict[str, float] = {} # ms por etapa
+
+def _registrar_tempo(nome: str, inicio: float):
+    tempos_inicializacao[nome] = (time.perf_counter() - inicio) * 1000
+    print(f"⏱️ {nome}: {tempos_inicializacao[nome]:.0f} ms")
+
+def recurso(fabrica):
+    """Decorador: a fábrica roda uma única vez, na primeira chamada do acessor."""
+    nome = fabrica.__name__.removeprefix("obter_")
+    lock = threading.Lock()
+
+    @functools.wraps(fabrica)
+    def acessor():
+        if nome not in _recursos:
+            with lock:
+                if nome not in _recursos:
+                    inicio = time.perf_counter()
+                    _recursos[nome] = fabrica()
+                    _registrar_tempo(nome, inicio)
+        return _recursos[nome]
+    return acessor
+
+def _aquecer():
+    """Cria todos os recursos e carrega o índice, para a primeira requisição não pagar por isso."""
+    inicio = time.perf_counter()
+    obter_embeddings()
+    obter_index_manager()
+    inicio_indice = time.perf_counter()
+    obter_index_manager().atual
+    _registrar_tempo("indice", inicio_indice)
+    obter_llm()
+    obter_document_chain()
+    obter_triagem_chain()
+    obter_grafo()
+    obter_triagem_local()
+    obter_cache_imagens()
+    obter_registro_interacoes()
+    _registrar_tempo("aquecimento", inicio)
+    print("🚀 Inicialização: " + ", ".join(f"{nome} {ms:.0f} ms" for nome, ms in tempos_inicializacao.items()))
+
+# Aquecimento (numa thread) em andamento ou concluído; None enquanto ninguém o iniciou
+_aquecimento: Optional[asyncio.Future] = None
+
+def _falhou(tarefa: asyncio.Future) -> bool:
+    return tarefa.done() and (tarefa.cancelled() or tarefa.exception() is not None)
+
+def _aquecido() -> bool:
+    return _aquecimento is not None and _aquecimento.done() and not _falhou(_aquecimento)
+
+def _iniciar_aquecimento() -> asyncio.Future:
+    global _aquecimento
+    # Um aquecimento que falhou (ex.: índice corrompido) é tentado de novo pela próxima requisição
+    if _aquecimento is None or _falhou(_aquecimento):
+        _aquecimento = asyncio.ensure_future(asyncio.to_thread(_aquecer))
+    return _aquecimento
+
+async def garantir_recursos():
+    """Recursos e índice prontos antes de atender; o carregamento nunca roda no event loop.
+
+    Com STARTUP_WARMUP=1, enquanto o aquecimento não termina a requisição recebe 503 com
+    Retry-After (como o /ready). Com STARTUP_WARMUP=0, a primeira requisição dispara o
+    carregamento numa thread e as que chegam junto esperam por ele.
+    """
+    if _aquecido():
+        return
+    aquecimento = _iniciar_aquecimento()
+    if STARTUP_WARMUP:
+        raise HTTPException(status_code=503, detail="API iniciando: índice ainda carregando.",
+                            headers={"Retry-After": str(AQUECIMENTO_RETRY_AFTER)})
+    await asyncio.shield(aquecimento)
+
+async def _vigiar_indice(intervalo: float):
+    # O IndexManager (e o cliente de embeddings) é criado fora do event loop
+    index_manager = await asyncio.to_thread(obter_index_manager)
+    await index_manager.vigiar(intervalo)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    tarefas = []
+    if STARTUP_WARMUP:
+        # Em segundo plano: a API já responde (e /ready diz 503) enquanto o índice carrega
+        tarefas.append(_iniciar_aquecimento())
+    if INDEX_WATCH_INTERVAL > 0:
+        tarefas.append(asyncio.create_task(_vigiar_indice(INDEX_WATCH_INTERVAL)))
+        tarefas.append(asyncio.create_task(vigiar_triagem_local(INDEX_WATCH_INTERVAL)))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+    # O que ainda está no buffer do log de interações vai para o disco antes de sair
+    registro_interacoes = _recursos.get("registro_interacoes")
+    if registro_interacoes is not None:
+        await asyncio.to_thread(registro_interacoes.fechar)
+
 #CRIAR a instância do FastAPI 
 app = FastAPI(
     title="Help Desk Chatbot API - Multimodal",
     description="API para interação com o chatbot de suporte, com capacidade de análise e resposta visual.",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
 )
 
 
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles com cache longo: os nomes das imagens são o hash do conteúdo, então nunca mudam.
+
+    ETag e Last-Modified continuam vindo do StaticFiles (respostas 304 para o navegador).
+    """
+    async def check_config(self):
+        # Pasta ainda não criada (nada indexado): cada imagem dá 404, não erro 500
+        if os.path.isdir(self.directory):
+            await super().check_config()
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+def _rotulo_rota(request: Request) -> str:
+    rota = request.scope.get("route")
+    if rota is not None:
+        return rota.path
+    # Montagens (StaticFiles) não preenchem scope["route"]: rótulo pelo prefixo montado
+    for montagem in app.routes:
+        if isinstance(montagem, Mount) and request.url.path.startswith(montagem.path + "/"):
+            return montagem.path + "/{path}"
+    return "outra"
+
+@app.middleware("http")
+async def medir_requisicao(request: Request, call_next):
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    # Rótulo pelo molde da rota (/chat, /static/images/{path}), não pela URL, para não explodir as séries
+    rota = _rotulo_rota(request)
+    HTTP_SEGUNDOS.observar(time.perf_counter() - inicio, rota, response.status_code)
+    return response
+
+@app.exception_handler(Sobrecarga)
+async def sobrecarga_handler(request: Request, exc: Sobrecarga):
+    # 503 (API lotada) ou 429 (fila do LLM/embeddings); o cliente sabe quando tentar de novo
+    return JSONResponse(status_code=exc.status_http, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 # Isso cria um endpoint /static/images/... que o frontend pode acessar
-app.mount("/static/images", StaticFiles(directory=str(IMAGE_SAVE_DIR)), name="static_images")
+# (as miniaturas ficam em /static/images/thumbs/...)
+# check_dir=False: importar o módulo não exige a pasta de imagens (ela surge na primeira indexação)
+app.mount("/static/images", ImmutableStaticFiles(directory=str(IMAGE_SAVE_DIR), check_dir=False), name="static_images")
 
 # --- LÓGICA DO CHATBOT ---
 
 # 1. Modelos LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0,
-    api_key=GOOGLE_API_KEY
-)
+# CHAT_BACKEND=fake troca o Gemini pelo FakeChatModel (fake_models.py), com FAKE_CHAT_LATENCY_MS
+# de latência por chamada: testes de carga e benchmarks sem chave e sem custo (ver benchmark.py)
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "google")
 
-# 2. Carregar Vector Store e Retriever
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-001",
-    google_api_key=GOOGLE_API_KEY
-)
-vectorstore = FAISS.load_local(str(VECTOR_STORE_PATH), embeddings, allow_dangerous_deserialization=True)
-retriever = vectorstore.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"score_threshold": 0.4, "k": 4}
+@recurso
+def obter_llm():
+    if CHAT_BACKEND == "fake":
+        from fake_models import FakeChatModel
+        return FakeChatModel(latencia=float(os.getenv("FAKE_CHAT_LATENCY_MS", 0)) / 1000,
+                             variacao=float(os.getenv("FAKE_CHAT_JITTER", 0)),
+                             callbacks=[ContadorTokens()])
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # Validação da chave de API
+    if not GOOGLE_API_KEY:
+        raise ValueError("GEMINI_KEY não encontrada. Por favor, configure no arquivo .env")
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        temperature=0,
+        api_key=GOOGLE_API_KEY,
+        callbacks=[ContadorTokens()], # Tokens de cada chamada vão para o /metrics
+    )
+
+# Limite de chamadas simultâneas por modelo upstream; o resto espera numa fila limitada e,
+# com ela cheia ou esperando mais que *_MAX_WAIT segundos, a requisição recebe 429 com Retry-After
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 64))
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", 20))
+EMBEDDINGS_MAX_CONCURRENCY = int(os.getenv("EMBEDDINGS_MAX_CONCURRENCY", 16))
+EMBEDDINGS_MAX_QUEUE = int(os.getenv("EMBEDDINGS_MAX_QUEUE", 64))
+EMBEDDINGS_MAX_WAIT = float(os.getenv("EMBEDDINGS_MAX_WAIT", 20))
+llm_semaforo = LimiteConcorrencia("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_WAIT, status_http=429)
+embeddings_semaforo = LimiteConcorrencia("embeddings", EMBEDDINGS_MAX_CONCURRENCY, EMBEDDINGS_MAX_QUEUE,
+                                         EMBEDDINGS_MAX_WAIT, status_http=429)
+
+# Admissão na API (/chat, /chat/stream, /chat/batch, /analyze_image): requisições em processamento
+# e fila de espera limitadas; acima disso, 503 com Retry-After na hora em vez de timeout
+ADMISSAO_MAX_REQUISICOES = int(os.getenv("ADMISSAO_MAX_REQUISICOES", 64))
+ADMISSAO_MAX_FILA = int(os.getenv("ADMISSAO_MAX_FILA", 256))
+ADMISSAO_MAX_ESPERA = float(os.getenv("ADMISSAO_MAX_ESPERA", 30))
+admissao = LimiteConcorrencia("requisicoes", ADMISSAO_MAX_REQUISICOES, ADMISSAO_MAX_FILA, ADMISSAO_MAX_ESPERA)
+
+# Single-flight: perguntas iguais (após normalização) em voo ao mesmo tempo dividem uma só
+# triagem, busca e geração (ver admission_control.py)
+coalescer_triagem = SingleFlight("triagem")
+coalescer_recuperacao = SingleFlight("recuperacao")
+coalescer_geracao = SingleFlight("geracao")
+
+# Com RECUPERACAO_ESPECULATIVA=1 a busca no FAISS começa junto com a triagem (ver node_triagem)
+RECUPERACAO_ESPECULATIVA = os.getenv("RECUPERACAO_ESPECULATIVA", "0") == "1"
+# Dedup + MMR + orçamento de tokens entre a busca e o LLM (ver context_packing.py); 0 desliga
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "1") == "1"
+
+# 2. Carregar Vector Store, Retriever e índice de imagens (versão atual, trocada a quente)
+@recurso
+def obter_embeddings():
+    return build_embeddings(GOOGLE_API_KEY)
+
+@recurso
+def obter_index_manager() -> "IndexManager":
+    # O índice em si só é lido no primeiro acesso a .atual (ou no aquecimento)
+    from index_manager import IndexManager
+    return IndexManager(VECTOR_STORE_PATH, obter_embeddings())
+
+# Versão do índice fixada no início de cada requisição: uma troca no meio do caminho
+# não mistura documentos de uma versão com imagens ou cache de outra
+_indice_requisicao: "contextvars.ContextVar[Optional[IndiceCarregado]]" = \
+    contextvars.ContextVar("indice_requisicao", default=None)
+
+def fixar_indice() -> "IndiceCarregado":
+    indice_atual = obter_index_manager().atual
+    _indice_requisicao.set(indice_atual)
+    return indice_atual
+
+def indice() -> "IndiceCarregado":
+    return _indice_requisicao.get() or obter_index_manager().atual
+
+# Cache de respostas na frente do grafo (perguntas repetidas ou parecidas)
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000)),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95)),
 )
 
+# Triagem local opcional: existe depois de rodar 'python triage_classifier.py treinar'
+@recurso
+def obter_triagem_local() -> Optional[KnnTriageClassifier]:
+    if not TRIAGEM_MODELO_PATH.exists():
+        return None
+    return KnnTriageClassifier.carregar(
+        TRIAGEM_MODELO_PATH, limiar=float(os.getenv("TRIAGEM_LOCAL_LIMIAR", 0.9))
+    )
+
+def recarregar_triagem_local() -> dict:
+    """Relê o modelo de triagem se o arquivo mudou (novo treino) desde o carregamento."""
+    atual = obter_triagem_local()
+    mtime_anterior = atual.mtime if atual is not None else None
+    mtime = TRIAGEM_MODELO_PATH.stat().st_mtime if TRIAGEM_MODELO_PATH.exists() else None
+    if mtime == mtime_anterior:
+        return {"trocou": False, "exemplos": int(len(atual.vetores)) if atual is not None else 0}
+    # Carrega fora do lock do recurso; até a atribuição, as requisições usam o modelo anterior
+    novo = obter_triagem_local.__wrapped__()
+    _recursos["triagem_local"] = novo
+    print(f"🔄 Modelo de triagem local {'recarregado' if novo is not None else 'removido'}.")
+    return {"trocou": True, "exemplos": int(len(novo.vetores)) if novo is not None else 0}
+
+async def vigiar_triagem_local(intervalo: float):
+    # Mesmo intervalo do índice: um 'triage_classifier.py treinar' entra em uso sem reiniciar a API
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            await asyncio.to_thread(recarregar_triagem_local)
+        except Exception as e:
+            print(f"❌ Erro ao recarregar o modelo de triagem: {e}")
+
 
 # 3. Definição de Prompts e Chains
 TRIAGEM_PROMPT = (
@@ -90,7 +361,10 @@ prompt_rag = ChatPromptTemplate.from_messages([
     ("human", "Pergunta: {input}\n\nContexto:\n{context}")
 ])
 
-document_chain = create_stuff_documents_chain(llm, prompt_rag)
+@recurso
+def obter_document_chain():
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    return create_stuff_documents_chain(obter_llm(), prompt_rag)
 
 # 4. Funções e Classes de Suporte (Pydantic, Formatadores)
 class TriagemOut(BaseModel):
@@ -98,40 +372,48 @@ class TriagemOut(BaseModel):
     urgencia: Literal["BAIXA", "MEDIA", "ALTA"]
     campos_faltantes: List[str] = Field(default_factory=list)
 
-triagem_chain = llm.with_structured_output(TriagemOut)
-
-def triagem(mensagem: str) -> Dict:
-    saida: TriagemOut = triagem_chain.invoke([
-        SystemMessage(content=TRIAGEM_PROMPT),
-        HumanMessage(content=mensagem)
-    ])
-    return saida.model_dump()
-
-def _clean_text(s: str) -> str:
-    return re.sub(r"\s+", " ", s or "").strip()
-
-def extrair_trecho(texto: str, query: str, janela: int = 240) -> str:
-    txt = _clean_text(texto)
-    termos = [t.lower() for t in re.findall(r"\w+", query or "") if len(t) >= 4]
-    pos = -1
-    for t in termos:
-        pos = txt.lower().find(t)
-        if pos != -1: break
-    if pos == -1: pos = 0
-    ini, fim = max(0, pos - janela//2), min(len(txt), pos + janela//2)
-    return "..." + txt[ini:fim] + "..."
-
-def encode_image(image_path):
-    """Converte um arquivo de imagem para string base64."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def analisar_mensagem_com_imagem(mensagem: str, image_path: str):
-    if not Path(image_path).exists():
-        return "Erro: O caminho da imagem não foi encontrado."
-
-    base64_image = encode_image(image_path)
-    image_mime_type = f"image/{pathlib.Path(image_path).suffix[1:]}"
+@recurso
+def obter_triagem_chain():
+    return obter_llm().with_structured_output(TriagemOut)
+
+async def triagem(mensagem: str, embedding: Optional[List[float]] = None) -> Dict:
+    # Caminho rápido: casos parecidos com triagens anteriores não precisam do LLM
+    triagem_local = obter_triagem_local()
+    if triagem_local is not None:
+        if embedding is None:
+            async with embeddings_semaforo:
+                with medir("embeddings", "triagem_local"):
+                    embedding = await obter_embeddings().aembed_query(mensagem)
+        saida_local = triagem_local.prever(embedding)
+        if saida_local is not None:
+            return {**TriagemOut(**saida_local).model_dump(), "origem": "local"}
+
+    async def classificar() -> Dict:
+        async with llm_semaforo:
+            with medir("llm", "triagem"):
+                saida: TriagemOut = await obter_triagem_chain().ainvoke([
+                    SystemMessage(content=TRIAGEM_PROMPT),
+                    HumanMessage(content=mensagem)
+                ])
+        # "origem" separa no log de interações as decisões do LLM, que treinam o classificador local
+        return {**saida.model_dump(), "origem": "llm"}
+
+    # Mensagens iguais em voo compartilham a mesma chamada; cada uma recebe sua cópia
+    return dict(await coalescer_triagem.executar(normalizar_pergunta(mensagem), classificar))
+
+# Cache das análises de imagem: o mesmo print (ou quase) com a mesma pergunta não vai de novo ao LLM
+@recurso
+def obter_cache_imagens():
+    from image_analysis import ImageAnalysisCache
+    return ImageAnalysisCache(
+        max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", 500)),
+        ttl=float(os.getenv("IMAGE_CACHE_TTL", 3600)),
+        distancia_maxima=int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", 4)),
+    )
+
+async def analisar_mensagem_com_imagem(mensagem: str, imagem: bytes, image_mime_type: str):
+    """Envia a imagem (já reduzida e recomprimida em memória) e a mensagem ao modelo multimodal."""
+    base64_image = base64.b64encode(imagem).decode('utf-8')
 
     human_message = HumanMessage(
         content=[
@@ -153,11 +435,15 @@ def analisar_mensagem_com_imagem(mensagem: str, image_path: str):
             }
         ]
     )
-    response = llm.invoke([human_message])
+    async with llm_semaforo:
+        with medir("llm", "analise_imagem"):
+            response = await obter_llm().ainvoke([human_message])
     return response.content
 
 def formatar_citacoes_e_imagens(docs_rel: List, query: str) -> Dict:
     cites, seen, imagens_relacionadas = [], set(), []
+    image_index = indice().image_index
+    termos = termos_da_consulta(query)
     for d in docs_rel:
         src = pathlib.Path(d.metadata.get("source","")).stem
         page = int(d.metadata.get("page", 0)) + 1
@@ -169,31 +455,93 @@ def formatar_citacoes_e_imagens(docs_rel: List, query: str) -> Dict:
             cites.append({
                 "documento": f"{src}.pdf",
                 "pagina": page,
-                "trecho": extrair_trecho(d.page_content, query)
+                # Texto limpo e posições das palavras vêm prontos da indexação (metadata do chunk)
+                "trecho": extrair_trecho(d.page_content, janela=240, dados=d.metadata, termos=termos)
             })
 
-            # Procura por imagens correspondentes a este documento e página
-            for img_path in IMAGE_SAVE_DIR.glob(f"{src}_page{page}_*.png"):
-                imagens_relacionadas.append(str(img_path))
+            # Busca as imagens deste documento e página no índice pré-calculado
+            for img_name in image_index.get(src, page):
+                imagens_relacionadas.append(str(IMAGE_SAVE_DIR / img_name))
 
     return {
         "citacoes": cites[:3],
-        "imagens": list(set(imagens_relacionadas)) # Remove duplicatas
+        "imagens": list(dict.fromkeys(imagens_relacionadas)) # Remove duplicatas (imagens compartilhadas entre páginas)
     }
 
-def perguntar_politica_RAG(pergunta: str) -> Dict:
-    docs_relacionados = retriever.invoke(pergunta)
+async def recuperar_documentos(pergunta: str, vetor_pergunta: Optional[List[float]] = None) -> tuple:
+    """Embedding da pergunta + busca no FAISS. Retorna (documentos, tempo em ms).
+
+    Mesmo resultado de indice().retriever.invoke(pergunta), em duas etapas medidas separadamente.
+    """
+    inicio = time.perf_counter()
+    indice_atual = indice()
+
+    async def buscar() -> List:
+        vetor = vetor_pergunta
+        if vetor is None:
+            async with embeddings_semaforo:
+                with medir("embeddings", "consulta"):
+                    vetor = await obter_embeddings().aembed_query(pergunta)
+        with medir("faiss", "busca"):
+            return (await asyncio.to_thread(indice_atual.buscar_lote, [pergunta], [vetor]))[0]
+
+    chave = (indice_atual.versao, normalizar_pergunta(pergunta))
+    docs = list(await coalescer_recuperacao.executar(chave, buscar))
+    registrar_recuperacao(len(docs))
+    return docs, (time.perf_counter() - inicio) * 1000
+
+async def montar_contexto(pergunta: str, docs: List, vetor_consulta: Optional[List[float]] = None) -> tuple:
+    """Escolhe, entre os documentos recuperados, os que vão para o prompt. Retorna (docs, relatório, ms)."""
+    inicio = time.perf_counter()
+    if not CONTEXT_PACKING or not docs:
+        return docs, None, 0.0
+    indice_atual = indice()
+    # Vetores gravados na indexação (chunks no FAISS, seções pai no docstore delas); nada é embutido aqui
+    vetores = await asyncio.to_thread(indice_atual.vetores_armazenados, docs)
+    if any(v is None for v in vetores):
+        # IVF-PQ sem reconstrução ou versão indexada antes dos vetores das seções: vai sem empacotar
+        return docs, None, (time.perf_counter() - inicio) * 1000
+    if vetor_consulta is None:
+        async with embeddings_semaforo:
+            with medir("embeddings", "contexto"):
+                vetor_consulta = await obter_embeddings().aembed_query(pergunta)
+    docs_contexto, relatorio = empacotar(docs, [np.asarray(v, dtype=np.float32) for v in vetores],
+                                         np.asarray(vetor_consulta, dtype=np.float32))
+    registrar_contexto(relatorio)
+    return docs_contexto, relatorio, (time.perf_counter() - inicio) * 1000
+
+async def perguntar_politica_RAG(pergunta: str, docs_relacionados: Optional[List] = None,
+                                 vetor_pergunta: Optional[List[float]] = None) -> Dict:
+    tempos = {}
+    # Os documentos podem já ter sido buscados em paralelo com a triagem
+    if docs_relacionados is None:
+        docs_relacionados, tempos["recuperacao"] = await recuperar_documentos(pergunta, vetor_pergunta)
 
     if not docs_relacionados:
         return {"answer": "Não sei, melhor abrir um chamado.",
                 "citacoes": [],
                 "imagens": [],
-                "contexto_encontrado": False}
+                "contexto_encontrado": False,
+                "contexto": None,
+                "tempos": tempos}
 
-    answer = document_chain.invoke({
-        "input": pergunta,
-        "context": docs_relacionados
-    })
+    docs_relacionados, contexto, tempos["montagem_contexto"] = await montar_contexto(
+        pergunta, docs_relacionados, vetor_pergunta)
+
+    async def gerar() -> str:
+        async with llm_semaforo:
+            with medir("llm", "geracao"):
+                return await obter_document_chain().ainvoke({
+                    "input": pergunta,
+                    "context": docs_relacionados
+                })
+
+    # Mesma pergunta com o mesmo contexto, na mesma versão do índice: uma geração só
+    inicio = time.perf_counter()
+    chave = (indice().versao, normalizar_pergunta(pergunta),
+             tuple(d.id or d.page_content for d in docs_relacionados))
+    answer = await coalescer_geracao.executar(chave, gerar)
+    tempos["geracao"] = (time.perf_counter() - inicio) * 1000
 
     txt = (answer or "").strip()
 
@@ -201,19 +549,28 @@ def perguntar_politica_RAG(pergunta: str) -> Dict:
         return {"answer": "Não sei, melhor abrir um chamado.",
                 "citacoes": [],
                 "imagens": [],
-                "contexto_encontrado": False}
+                "contexto_encontrado": False,
+                "contexto": contexto,
+                "tempos": tempos}
 
     # Formata as citações e busca as imagens relacionadas
-    info_adicional = formatar_citacoes_e_imagens(docs_relacionados, pergunta)
+    with medir("etapa", "citacoes"):
+        info_adicional = formatar_citacoes_e_imagens(docs_relacionados, pergunta)
 
     return {"answer": txt,
             "citacoes": info_adicional["citacoes"],
             "imagens": info_adicional["imagens"],
-            "contexto_encontrado": True}
+            "contexto_encontrado": True,
+            "contexto": contexto,
+            "tempos": tempos}
 
 
 # 5. Lógica do Grafo (LangGraph)
 
+def _juntar_tempos(atual: Dict[str, float], novo: Dict[str, float]) -> Dict[str, float]:
+    # Reducer do LangGraph: cada nó acrescenta os seus tempos aos já registrados
+    return {**(atual or {}), **(novo or {})}
+
 # --- MODELO DE ESTADO ---
 # Renomeei 'triagem_result' para 'triagem' para ficar mais limpo e consistente
 class AgenteState(BaseModel):
@@ -222,45 +579,105 @@ class AgenteState(BaseModel):
     resposta: Optional[str] = None
     citacoes: Optional[List[Dict]] = []
     imagens: Optional[List[str]] = [] # NOVO: para guardar as URLs das imagens
+    miniaturas: Optional[List[str]] = [] # URLs das miniaturas, na mesma ordem de 'imagens'
     rag_sucesso: bool = False
     acao_final: Optional[str] = None
+    tempos: Annotated[Dict[str, float], _juntar_tempos] = {} # ms por nó/etapa
+    contexto: Optional[Dict] = None # Documentos e tokens recuperados x enviados ao LLM
+    chamado: Optional[Dict] = None # Chamado aberto: protocolo, urgência e descrição
+    # Documentos já recuperados (busca especulativa ou em lote); uso interno, fora da resposta da API
+    documentos: Optional[List[Any]] = Field(default=None, exclude=True)
+    # Embedding da pergunta já calculado (lote do /chat/batch); uso interno
+    vetor_pergunta: Optional[List[float]] = Field(default=None, exclude=True)
 
 # --- NÓS DO GRAFO ---
 
-def node_triagem(state: AgenteState) -> dict: # ALTERADO: type hint para AgenteState
+def cronometrar(nome: str):
+    """Registra em state.tempos[nome] a duração do nó, em milissegundos."""
+    def decorador(fn):
+        @functools.wraps(fn)
+        async def wrapper(state: AgenteState) -> dict:
+            inicio = time.perf_counter()
+            update = fn(state)
+            if inspect.isawaitable(update):
+                update = await update
+            segundos = time.perf_counter() - inicio
+            registrar_span("no", nome, segundos)
+            tempos = {**update.get("tempos", {}), nome: segundos * 1000}
+            return {**update, "tempos": tempos}
+        return wrapper
+    return decorador
+
+@cronometrar("triagem")
+async def node_triagem(state: AgenteState) -> dict: # ALTERADO: type hint para AgenteState
     # ALTERADO: state["pergunta"] para state.pergunta
-    return {"triagem": triagem(state.pergunta)} 
+    # Sem busca especulativa quando os documentos já vieram prontos (/chat/batch)
+    if not RECUPERACAO_ESPECULATIVA or state.documentos is not None:
+        return {"triagem": await triagem(state.pergunta, state.vetor_pergunta)}
+
+    # Modo especulativo: a maior parte do tráfego termina em AUTO_RESOLVER, então a
+    # recuperação corre junto com a triagem e é descartada se a decisão for outra
+    busca = asyncio.create_task(recuperar_documentos(state.pergunta, state.vetor_pergunta))
+    try:
+        resultado = await triagem(state.pergunta, state.vetor_pergunta)
+    except BaseException:
+        busca.cancel()
+        raise
+    if resultado["decisao"] != "AUTO_RESOLVER":
+        busca.cancel()
+        return {"triagem": resultado}
+    docs, tempo_busca = await busca
+    return {"triagem": resultado, "documentos": docs, "tempos": {"recuperacao_especulativa": tempo_busca}}
+
+def urls_imagens(imagens: List[str]) -> tuple:
+    """Converte os caminhos locais em URLs (originais e miniaturas) acessíveis pelo frontend."""
+    imagens_urls = [f"/static/images/{pathlib.Path(p).name}" for p in imagens]
+    miniaturas_urls = [f"/static/images/thumbs/{pathlib.Path(p).stem}.jpg" for p in imagens]
+    return imagens_urls, miniaturas_urls
 
 # MODIFICADO: Nó de auto_resolver para capturar e formatar os caminhos das imagens
-def node_auto_resolver(state: AgenteState) -> dict:
-    resposta_rag = perguntar_politica_RAG(state.pergunta)
+@cronometrar("auto_resolver")
+async def node_auto_resolver(state: AgenteState) -> dict:
+    resposta_rag = await perguntar_politica_RAG(state.pergunta, state.documentos, state.vetor_pergunta)
     
     # NOVO: Converte os caminhos locais em URLs acessíveis pelo frontend
-    imagens_urls = [f"/static/images/{pathlib.Path(p).name}" for p in resposta_rag.get("imagens", [])]
+    imagens_urls, miniaturas_urls = urls_imagens(resposta_rag.get("imagens", []))
     
     update = {
         "resposta": resposta_rag["answer"],
         "citacoes": resposta_rag.get("citacoes", []),
         "imagens": imagens_urls, # Adiciona as URLs ao estado
+        "miniaturas": miniaturas_urls,
         "rag_sucesso": resposta_rag["contexto_encontrado"],
+        "contexto": resposta_rag["contexto"],
+        "tempos": resposta_rag["tempos"],
     }
     if resposta_rag["contexto_encontrado"]:
         update["acao_final"] = "AUTO_RESOLVER"
     return update
 
+@cronometrar("pedir_info")
 def node_pedir_info(state: AgenteState) -> dict: # ALTERADO: type hint para AgenteState
     # ALTERADO: state["triagem"] para state.triagem
     faltantes = state.triagem.get("campos_faltantes", [])
     detalhe = ", ".join(faltantes) if faltantes else "mais detalhes sobre sua dúvida"
     return {"resposta": f'Para que eu possa ajudar melhor, por favor, forneça {detalhe}.', "citacoes": [], "acao_final": "PEDIR_INFO"}
 
+@cronometrar("abrir_chamado")
 def node_abrir_chamado(state: AgenteState) -> dict: # ALTERADO: type hint para AgenteState
     # ALTERADO: state["triagem"] para state.triagem e state['pergunta'] para state.pergunta
     triagem_data = state.triagem
+    chamado = {
+        "protocolo": uuid.uuid4().hex[:10].upper(),
+        "urgencia": triagem_data["urgencia"],
+        "descricao": state.pergunta[:140],
+        "aberto_em": agora_iso(),
+    }
     return {
-        "resposta": f"Entendido. Estou abrindo um chamado para você com urgência '{triagem_data['urgencia']}'. Em breve um analista entrará em contato. Descrição: {state.pergunta[:140]}",
+        "resposta": f"Entendido. Estou abrindo o chamado {chamado['protocolo']} para você com urgência '{triagem_data['urgencia']}'. Em breve um analista entrará em contato. Descrição: {chamado['descricao']}",
         "citacoes": [],
-        "acao_final": "ABRIR_CHAMADO"
+        "acao_final": "ABRIR_CHAMADO",
+        "chamado": chamado,
     }
 
 # --- ARESTAS CONDICIONAIS ---
@@ -273,52 +690,381 @@ def decidir_pos_auto_resolver(state: AgenteState) -> str: # ALTERADO: type hint
     # ALTERADO: state.get("rag_sucesso") para state.rag_sucesso
     return 'end' if state.rag_sucesso else 'abrir_chamado'
 
-workflow = StateGraph(AgenteState)
-workflow.add_node('triagem', node_triagem)
-workflow.add_node('auto_resolver', node_auto_resolver)
-workflow.add_node('pedir_info', node_pedir_info)
-workflow.add_node('abrir_chamado', node_abrir_chamado)
+@recurso
+def obter_grafo():
+    from langgraph.graph import StateGraph, START, END
 
-workflow.add_edge(START, 'triagem')
-workflow.add_conditional_edges('triagem', decidir_pos_triagem, {
-    'auto_resolver': 'auto_resolver',
-    'pedir_info': 'pedir_info',
-    'abrir_chamado': 'abrir_chamado'
-})
-workflow.add_conditional_edges('auto_resolver', decidir_pos_auto_resolver, {
-    'end': END,
-    'abrir_chamado': 'abrir_chamado'
-})
-workflow.add_edge('pedir_info', END)
-workflow.add_edge('abrir_chamado', END)
+    workflow = StateGraph(AgenteState)
+    workflow.add_node('triagem', node_triagem)
+    workflow.add_node('auto_resolver', node_auto_resolver)
+    workflow.add_node('pedir_info', node_pedir_info)
+    workflow.add_node('abrir_chamado', node_abrir_chamado)
 
-grafo = workflow.compile()
+    workflow.add_edge(START, 'triagem')
+    workflow.add_conditional_edges('triagem', decidir_pos_triagem, {
+        'auto_resolver': 'auto_resolver',
+        'pedir_info': 'pedir_info',
+        'abrir_chamado': 'abrir_chamado'
+    })
+    workflow.add_conditional_edges('auto_resolver', decidir_pos_auto_resolver, {
+        'end': END,
+        'abrir_chamado': 'abrir_chamado'
+    })
+    workflow.add_edge('pedir_info', END)
+    workflow.add_edge('abrir_chamado', END)
+
+    return workflow.compile()
 
 
 # --- API Endpoints ---
 class ChatRequest(BaseModel):
     pergunta: str
 
-@app.post("/chat", response_model=AgenteState)
-def chat_endpoint(request: ChatRequest):
-    inputs = {"pergunta": request.pergunta}
-    resposta_final = grafo.invoke(inputs)
-    return resposta_final
+class ChatResponse(AgenteState):
+    cache: Literal["HIT_EXATO", "HIT_SEMANTICO", "MISS"] = "MISS"
+    debug: Optional[Dict] = None # Spans e contagens da requisição (só com o header X-Debug-Tempos: 1)
+
+async def buscar_no_cache(pergunta: str, versao: str) -> tuple:
+    """Retorna (resposta em cache ou None, tipo de hit, embedding da pergunta ou None)."""
+    # 1. Mesma pergunta (normalizada): não precisa nem do embedding
+    cached = answer_cache.get_exato(pergunta, versao)
+    if cached is not None:
+        answer_cache.contar("HIT_EXATO")
+        return {**cached, "pergunta": pergunta, "tempos": {}}, "HIT_EXATO", None
+
+    # 2. Pergunta parecida: vizinho mais próximo no espaço de embeddings
+    # (o embedding é repassado ao grafo, que não precisa calculá-lo de novo)
+    async with embeddings_semaforo:
+        with medir("embeddings", "consulta"):
+            embedding_pergunta = await obter_embeddings().aembed_query(pergunta)
+    cached = answer_cache.get_semantico(embedding_pergunta, versao)
+    if cached is not None:
+        answer_cache.contar("HIT_SEMANTICO")
+        return {**cached, "pergunta": pergunta, "tempos": {}}, "HIT_SEMANTICO", embedding_pergunta
+    answer_cache.contar("MISS")
+    return None, "MISS", embedding_pergunta
+
+def guardar_no_cache(resposta_final: Dict, embedding_pergunta, versao: str):
+    # Só respostas da documentação são reaproveitáveis; chamados e pedidos de
+    # informação dependem do texto exato de cada usuário
+    if resposta_final.get("acao_final") == "AUTO_RESOLVER":
+        answer_cache.put(resposta_final["pergunta"], embedding_pergunta, versao, dict(resposta_final))
+
+@recurso
+def obter_registro_interacoes() -> Optional[RegistroInteracoes]:
+    return RegistroInteracoes() if INTERACOES_LOG else None
+
+def registrar_interacao(tipo: str, rota: str, inicio: float, dados: Dict, erro: Optional[str] = None):
+    """Entrega a interação ao log em segundo plano; não espera por disco (ver interaction_log.py)."""
+    registro_interacoes = obter_registro_interacoes()
+    if registro_interacoes is None:
+        return
+    registro = {"ts": agora_iso(), "tipo": tipo, "rota": rota,
+                "latencia_ms": round((time.perf_counter() - inicio) * 1000, 2), **dados}
+    if erro is not None:
+        registro["erro"] = erro
+    registro_interacoes.registrar(registro)
+
+def dados_chat(resposta: Dict, versao: str) -> Dict:
+    # Campos da resposta que interessam para análise e avaliação (sem spans de debug)
+    return {
+        "pergunta": resposta.get("pergunta"),
+        "versao_indice": versao,
+        "cache": resposta.get("cache"),
+        "triagem": resposta.get("triagem"),
+        "acao_final": resposta.get("acao_final"),
+        "rag_sucesso": resposta.get("rag_sucesso"),
+        "resposta": resposta.get("resposta"),
+        "chamado": resposta.get("chamado"),
+        "fontes": resposta.get("citacoes"),
+        "imagens": resposta.get("imagens"),
+        "contexto": resposta.get("contexto"),
+        "tempos": resposta.get("tempos"),
+    }
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest, x_debug_tempos: str = Header(default="")):
+    inicio = time.perf_counter()
+    debug = iniciar_debug() if x_debug_tempos == "1" else None
+    await garantir_recursos()
+    versao = fixar_indice().versao
+    cached, tipo_cache, embedding_pergunta = await buscar_no_cache(request.pergunta, versao)
+    if cached is not None:
+        resposta = {**cached, "cache": tipo_cache, "debug": debug}
+        registrar_interacao("chat", "/chat", inicio, dados_chat(resposta, versao))
+        return resposta
+
+    # Respostas em cache saem mesmo com a API lotada; só o caminho até o LLM passa pela admissão
+    inputs = {"pergunta": request.pergunta, "vetor_pergunta": embedding_pergunta}
+    try:
+        async with admissao:
+            resposta_final = await obter_grafo().ainvoke(inputs)
+    except Exception as e:
+        registrar_interacao("chat", "/chat", inicio, {"pergunta": request.pergunta, "versao_indice": versao}, str(e))
+        raise
+    resposta_final.pop("documentos", None)
+    resposta_final.pop("vetor_pergunta", None)
+
+    guardar_no_cache(resposta_final, embedding_pergunta, versao)
+    resposta = {**resposta_final, "cache": "MISS", "debug": debug}
+    registrar_interacao("chat", "/chat", inicio, dados_chat(resposta, versao))
+    return resposta
+
+def _evento(**dados) -> str:
+    # Uma linha de NDJSON por evento
+    return json.dumps(dados, ensure_ascii=False) + "\n"
+
+async def eventos_chat(pergunta: str, com_debug: bool = False):
+    """O grafo do /chat, emitindo a triagem, os tokens da resposta e, por fim, o estado com citações e imagens."""
+    inicio = time.perf_counter()
+    debug = iniciar_debug() if com_debug else None
+    versao = fixar_indice().versao
+    cached, tipo_cache, embedding_pergunta = await buscar_no_cache(pergunta, versao)
+    if cached is not None:
+        resposta = {**AgenteState(**cached).model_dump(), "cache": tipo_cache}
+        registrar_interacao("chat", "/chat/stream", inicio, dados_chat(resposta, versao))
+        yield _evento(tipo="triagem", triagem=cached.get("triagem"))
+        yield _evento(tipo="token", texto=cached["resposta"])
+        yield _evento(tipo="fim", **resposta, debug=debug)
+        return
+
+    try:
+        async with admissao:
+            async for evento in _eventos_sem_cache(pergunta, embedding_pergunta, versao, debug, inicio):
+                yield evento
+    except Sobrecarga as e:
+        registrar_interacao("chat", "/chat/stream", inicio, {"pergunta": pergunta, "versao_indice": versao}, str(e))
+        # O status 200 já foi enviado: a recusa vai como evento, com o mesmo Retry-After
+        yield _evento(tipo="erro", status=e.status_http, retry_after=e.retry_after, detalhe=str(e))
+
+async def _eventos_sem_cache(pergunta: str, embedding_pergunta: List[float], versao: str,
+                             debug: Optional[Dict], inicio: float):
+    # O mesmo grafo do /chat (single-flight, busca especulativa, tempos por nó), acompanhado por
+    # stream_mode: "updates" traz a triagem quando o nó termina, "messages" os tokens da geração
+    # e "values" o estado final. Quem pegou carona na geração de outra requisição (single-flight)
+    # não recebe tokens, só o evento "fim".
+    inputs = {"pergunta": pergunta, "vetor_pergunta": embedding_pergunta}
+    resposta_final = None
+    async for modo, dados in obter_grafo().astream(inputs, stream_mode=["updates", "messages", "values"]):
+        if modo == "updates" and "triagem" in dados:
+            yield _evento(tipo="triagem", triagem=dados["triagem"]["triagem"])
+        elif modo == "messages":
+            mensagem, metadados = dados
+            if metadados.get("langgraph_node") == "auto_resolver" and mensagem.content:
+                yield _evento(tipo="token", texto=mensagem.content)
+        elif modo == "values":
+            resposta_final = dados
+    resposta_final.pop("documentos", None)
+    resposta_final.pop("vetor_pergunta", None)
+
+    guardar_no_cache(resposta_final, embedding_pergunta, versao)
+    registrar_interacao("chat", "/chat/stream", inicio, dados_chat({**resposta_final, "cache": "MISS"}, versao))
+    yield _evento(tipo="fim", **AgenteState(**resposta_final).model_dump(), cache="MISS", debug=debug)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, x_debug_tempos: str = Header(default="")):
+    # NDJSON: {"tipo": "triagem"}, vários {"tipo": "token"} e um {"tipo": "fim"} com o estado final
+    # (ou {"tipo": "erro"} se a fila encher depois do início do stream)
+    admissao.verificar() # Fila já cheia: 503 antes de abrir o stream
+    await garantir_recursos()
+    return StreamingResponse(eventos_chat(request.pergunta, x_debug_tempos == "1"), media_type="application/x-ndjson")
+
+# Lote: uma chamada de embeddings e uma busca no FAISS para todas as perguntas, e o grafo
+# de cada uma rodando em paralelo até CHAT_BATCH_CONCURRENCY (além dos semáforos por modelo)
+CHAT_BATCH_MAX_PERGUNTAS = int(os.getenv("CHAT_BATCH_MAX_PERGUNTAS", 1000))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", 16))
+
+class ChatBatchRequest(BaseModel):
+    perguntas: List[str] = Field(min_length=1)
+    stream: bool = False # NDJSON, um item por linha na ordem em que ficam prontos
+
+class ChatBatchItem(ChatResponse):
+    indice: int # Posição da pergunta na lista enviada
+    erro: Optional[str] = None # Falha só deste item (os demais seguem)
+
+class ChatBatchResponse(BaseModel):
+    resultados: List[ChatBatchItem]
+
+async def responder_lote(perguntas: List[str]):
+    """Gera (índice, resultado) de cada pergunta do lote, na ordem em que terminam."""
+    versao = fixar_indice().versao
+    pendentes = []
+    for i, pergunta in enumerate(perguntas):
+        cached = answer_cache.get_exato(pergunta, versao)
+        if cached is not None:
+            answer_cache.contar("HIT_EXATO")
+            yield i, {**cached, "pergunta": pergunta, "tempos": {}, "cache": "HIT_EXATO"}
+        else:
+            pendentes.append(i)
+    if not pendentes:
+        return
+
+    # 1. Embeddings de todas as perguntas restantes numa chamada em lote (cache em disco na frente)
+    inicio = time.perf_counter()
+    async with embeddings_semaforo:
+        with medir("embeddings", "lote"):
+            vetores = await asyncio.to_thread(obter_embeddings().embed_queries, [perguntas[i] for i in pendentes])
+    tempo_embeddings = (time.perf_counter() - inicio) * 1000
+
+    restantes, vetores_restantes = [], []
+    for i, vetor in zip(pendentes, vetores):
+        cached = answer_cache.get_semantico(vetor, versao)
+        if cached is not None:
+            answer_cache.contar("HIT_SEMANTICO")
+            yield i, {**cached, "pergunta": perguntas[i], "tempos": {}, "cache": "HIT_SEMANTICO"}
+        else:
+            answer_cache.contar("MISS")
+            restantes.append(i)
+            vetores_restantes.append(vetor)
+    if not restantes:
+        return
+
+    # 2. Uma busca no FAISS para o lote (a triagem decide depois quem usa os documentos)
+    inicio = time.perf_counter()
+    with medir("faiss", "busca_lote"):
+        docs_por_pergunta = await asyncio.to_thread(
+            indice().buscar_lote, [perguntas[i] for i in restantes], vetores_restantes)
+    tempo_busca = (time.perf_counter() - inicio) * 1000
+    for docs in docs_por_pergunta:
+        registrar_recuperacao(len(docs))
+
+    # 3. Grafo de cada pergunta, com documentos e embedding prontos
+    limite = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+    async def responder(i: int, vetor: List[float], docs: List) -> tuple:
+        async with limite:
+            try:
+                resposta_final = await obter_grafo().ainvoke(
+                    {"pergunta": perguntas[i], "documentos": docs, "vetor_pergunta": vetor})
+            except Exception as e:
+                print(f"❌ Erro no item {i} do lote: {e}")
+                return i, {"pergunta": perguntas[i], "erro": str(e)}
+        resposta_final.pop("documentos", None)
+        resposta_final.pop("vetor_pergunta", None)
+        # Tempos das etapas feitas em lote, divididos entre os itens
+        resposta_final["tempos"] = {**resposta_final.get("tempos", {}),
+                                    "embeddings_lote": tempo_embeddings / len(pendentes),
+                                    "recuperacao_lote": tempo_busca / len(restantes)}
+        guardar_no_cache(resposta_final, vetor, versao)
+        return i, {**resposta_final, "cache": "MISS"}
+
+    tarefas = [asyncio.create_task(responder(i, vetor, docs))
+               for i, vetor, docs in zip(restantes, vetores_restantes, docs_por_pergunta)]
+    try:
+        for tarefa in asyncio.as_completed(tarefas):
+            yield await tarefa
+    finally:
+        # Cliente desconectou no meio do stream: não deixa o resto do lote rodando
+        for tarefa in tarefas:
+            tarefa.cancel()
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_endpoint(request: ChatBatchRequest):
+    if len(request.perguntas) > CHAT_BATCH_MAX_PERGUNTAS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {CHAT_BATCH_MAX_PERGUNTAS} perguntas por lote.")
+    inicio = time.perf_counter()
+    await garantir_recursos()
+
+    def registrar_item(resultado: Dict):
+        # Cada pergunta do lote é uma interação; a latência conta desde o início do lote
+        registrar_interacao("chat", "/chat/batch", inicio, dados_chat(resultado, indice().versao),
+                            resultado.get("erro"))
+
+    if request.stream:
+        admissao.verificar()
+        async def eventos():
+            try:
+                async with admissao:
+                    async for i, resultado in responder_lote(request.perguntas):
+                        registrar_item(resultado)
+                        yield _evento(**ChatBatchItem(**resultado, indice=i).model_dump())
+            except Sobrecarga as e:
+                yield _evento(tipo="erro", status=e.status_http, retry_after=e.retry_after, detalhe=str(e))
+        return StreamingResponse(eventos(), media_type="application/x-ndjson")
+
+    # O lote inteiro ocupa uma vaga; dentro dele, CHAT_BATCH_CONCURRENCY e os limites por modelo
+    resultados: List[Optional[Dict]] = [None] * len(request.perguntas)
+    async with admissao:
+        async for i, resultado in responder_lote(request.perguntas):
+            registrar_item(resultado)
+            resultados[i] = {**resultado, "indice": i}
+    return {"resultados": resultados}
+
+@app.get("/triagem/estatisticas")
+def triagem_estatisticas():
+    # Fração das triagens resolvidas localmente e métricas do último treino
+    triagem_local = obter_triagem_local()
+    if triagem_local is None:
+        return {"ativo": False}
+    return {"ativo": True, **triagem_local.estatisticas()}
+
+@app.post("/admin/recarregar_indice")
+async def recarregar_indice(x_admin_token: str = Header(default="")):
+    """Carrega a versão publicada mais recente do índice (e do modelo de triagem local) sem reiniciar a API."""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de administração inválido.")
+    resultado = await asyncio.to_thread(lambda: obter_index_manager().recarregar())
+    return {**resultado, "triagem_local": await asyncio.to_thread(recarregar_triagem_local)}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Histogramas e contadores no formato do Prometheus (deste worker)."""
+    return PlainTextResponse(exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 só depois que o índice e os recursos estiverem carregados (o processo pode estar vivo antes disso)."""
+    if not _aquecido():
+        return JSONResponse(status_code=503, content={"pronto": False, "tempos_inicializacao": tempos_inicializacao})
+    return {"pronto": True, "versao_indice": obter_index_manager().atual.versao,
+            "tempos_inicializacao": tempos_inicializacao}
 
 class AnaliseResponse(BaseModel):
     analise: str
+    cache: Literal["HIT_EXATO", "HIT_SEMANTICO", "MISS"] = "MISS"
+    debug: Optional[Dict] = None # Spans da requisição (só com o header X-Debug-Tempos: 1)
 
 @app.post("/analyze_image", response_model=AnaliseResponse)
-async def analyze_image_endpoint(pergunta: str = Form(...), image_file: UploadFile = File(...)):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=pathlib.Path(image_file.filename).suffix) as tmp:
-        tmp.write(await image_file.read())
-        tmp_path = tmp.name
-    
+async def analyze_image_endpoint(pergunta: str = Form(...), image_file: UploadFile = File(...),
+                                 x_debug_tempos: str = Header(default="")):
+    from image_analysis import preparar_imagem, ImagemInvalida, IMAGE_MAX_UPLOAD_BYTES
+
+    inicio = time.perf_counter()
+    debug = iniciar_debug() if x_debug_tempos == "1" else None
+    await garantir_recursos()
+
+    # Tudo em memória: sem arquivo temporário e sem decodificar a imagem mais de uma vez
+    dados = await image_file.read(IMAGE_MAX_UPLOAD_BYTES + 1)
+    if len(dados) > IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Imagem muito grande.")
     try:
-        analise_texto = analisar_mensagem_com_imagem(pergunta, tmp_path)
-        return {"analise": analise_texto}
-    finally:
-        os.remove(tmp_path)
+        with medir("etapa", "preparo_imagem"):
+            imagem, mime, hash_perceptual = await asyncio.to_thread(preparar_imagem, dados)
+    except ImagemInvalida as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    dados_imagem = {"pergunta": pergunta, "imagem": {
+        "mime": mime, "bytes_enviados": len(dados), "bytes_modelo": len(imagem),
+        "hash_perceptual": None if hash_perceptual is None else f"{hash_perceptual:016x}"}}
+
+    cache_imagens = obter_cache_imagens()
+    if hash_perceptual is not None:
+        cached, tipo_cache = cache_imagens.get(hash_perceptual, pergunta)
+        if cached is not None:
+            registrar_interacao("imagem", "/analyze_image", inicio, {**dados_imagem, "analise": cached, "cache": tipo_cache})
+            return {"analise": cached, "cache": tipo_cache, "debug": debug}
+
+    try:
+        async with admissao:
+            analise_texto = await analisar_mensagem_com_imagem(pergunta, imagem, mime)
+    except Exception as e:
+        registrar_interacao("imagem", "/analyze_image", inicio, dados_imagem, str(e))
+        raise
+    if hash_perceptual is not None:
+        cache_imagens.put(hash_perceptual, pergunta, analise_texto)
+    registrar_interacao("imagem", "/analyze_image", inicio, {**dados_imagem, "analise": analise_texto, "cache": "MISS"})
+    return {"analise": analise_texto, "cache": "MISS", "debug": debug}
+
+_registrar_tempo("importacao", _INICIO_IMPORTACAO)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,219 @@
+# metrics.py
+# Tempos por etapa (nós do grafo, chamadas ao LLM, embeddings e FAISS), tokens e acertos da
+# recuperação, expostos no formato texto do Prometheus em /metrics
+#
+# Sem dependência do prometheus_client: cada observação é um bisect e três somas sob um lock,
+# barato o bastante para ficar ligado em produção. Cada worker do uvicorn tem os seus
+# contadores; o Prometheus soma as séries dos workers (raspando cada um ou via agregador).
+#
+# Com o header X-Debug-Tempos: 1 a resposta traz também os spans da própria requisição.
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_TOKENS = (50, 100, 250, 500, 1000, 2000, 4000, 8000)
+BUCKETS_DOCUMENTOS = (0, 1, 2, 3, 4, 6, 8, 12, 20)
+
+_metricas: List["_Metrica"] = []
+
+
+def _rotulos(nomes: Sequence[str], valores: Tuple, extra: str = "") -> str:
+    pares = [f'{n}="{str(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def _linhas(self) -> List[str]:
+        raise NotImplementedError
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}", *self._linhas()]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        super().__init__(nome, ajuda, rotulos)
+        self._valores: Dict[Tuple, float] = {}
+
+    def incrementar(self, valor: float = 1, *rotulos):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def _linhas(self) -> List[str]:
+        with self._lock:
+            itens = list(self._valores.items())
+        return [f"{self.nome}{_rotulos(self.rotulos, r)} {v}" for r, v in itens]
+
+
+class Medidor(_Metrica):
+    """Gauge: valor atual (ex.: requisições na fila), definido por quem observa."""
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        super().__init__(nome, ajuda, rotulos)
+        self._valores: Dict[Tuple, float] = {}
+
+    def definir(self, valor: float, *rotulos):
+        with self._lock:
+            self._valores[rotulos] = valor
+
+    def _linhas(self) -> List[str]:
+        with self._lock:
+            itens = list(self._valores.items())
+        return [f"{self.nome}{_rotulos(self.rotulos, r)} {v}" for r, v in itens]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, buckets: Sequence[float], rotulos: Sequence[str] = ()):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(buckets)
+        # rótulos -> [contagem de cada bucket (não acumulada)..., +Inf, soma]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observar(self, valor: float, *rotulos):
+        i = bisect.bisect_left(self.buckets, valor)  # primeiro bucket com limite >= valor
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [0] * (len(self.buckets) + 2)
+            serie[i] += 1
+            serie[-1] += valor
+
+    def _linhas(self) -> List[str]:
+        with self._lock:
+            itens = [(r, list(s)) for r, s in self._series.items()]
+        linhas = []
+        for rotulos, serie in itens:
+            acumulado = 0
+            for limite, contagem in zip((*self.buckets, "+Inf"), serie):
+                acumulado += contagem
+                le = f'le="{limite}"'
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {serie[-1]}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {acumulado}")
+        return linhas
+
+
+def exportar() -> str:
+    """Todas as métricas no formato de exposição em texto do Prometheus."""
+    return "\n".join(linha for metrica in _metricas for linha in metrica.exportar()) + "\n"
+
+
+# --- Métricas da API ---
+HTTP_SEGUNDOS = Histograma("helpdesk_http_requisicao_segundos", "Duração das requisições HTTP (até o início da resposta).",
+                           BUCKETS_SEGUNDOS, ("rota", "status"))
+ETAPA_SEGUNDOS = Histograma("helpdesk_etapa_segundos", "Duração de cada etapa: nós do grafo, LLM, embeddings, FAISS e espera em fila (tipo 'fila').",
+                            BUCKETS_SEGUNDOS, ("tipo", "nome"))
+LLM_TOKENS = Contador("helpdesk_llm_tokens_total", "Tokens de entrada e saída informados pelo LLM.", ("etapa", "direcao"))
+CONTEXTO_TOKENS = Histograma("helpdesk_contexto_tokens", "Tokens (estimados) de documentos enviados no prompt.",
+                             BUCKETS_TOKENS)
+DOCUMENTOS_RECUPERADOS = Histograma("helpdesk_documentos_recuperados", "Documentos devolvidos pela recuperação.",
+                                    BUCKETS_DOCUMENTOS)
+RECUPERACOES_VAZIAS = Contador("helpdesk_recuperacoes_vazias_total", "Recuperações sem nenhum documento acima do limiar.")
+CACHE_RESPOSTAS = Contador("helpdesk_cache_respostas_total", "Consultas ao cache de respostas, por resultado.", ("resultado",))
+SINGLE_FLIGHT = Contador("helpdesk_single_flight_total",
+                         "Chamadas por etapa: líder (fez a chamada) ou seguidor (reaproveitou a do líder).",
+                         ("etapa", "papel"))
+ADMISSAO_EM_USO = Medidor("helpdesk_admissao_em_uso", "Vagas ocupadas em cada limite de concorrência.", ("limite",))
+ADMISSAO_FILA = Medidor("helpdesk_admissao_fila", "Chamadas esperando vaga em cada limite de concorrência.", ("limite",))
+ADMISSAO_REJEICOES = Contador("helpdesk_admissao_rejeicoes_total", "Chamadas recusadas por fila cheia ou espera longa.",
+                              ("limite", "motivo"))
+INTERACOES_LOG = Contador("helpdesk_interacoes_log_total",
+                          "Registros do log de interações: gravados, descartados (buffer cheio) ou com erro.",
+                          ("resultado",))
+INTERACOES_BUFFER = Medidor("helpdesk_interacoes_buffer", "Registros aguardando gravação no log de interações.")
+
+
+# --- Spans da requisição atual ---
+# Lista de spans só existe com o header de debug; sem ele, registrar um span é só a observação no histograma
+_debug_requisicao: "contextvars.ContextVar[Optional[Dict]]" = contextvars.ContextVar("debug_requisicao", default=None)
+# Nome da etapa em andamento (o callback de tokens usa para rotular a chamada ao LLM)
+_etapa_atual: "contextvars.ContextVar[str]" = contextvars.ContextVar("etapa_atual", default="")
+
+
+def iniciar_debug() -> Dict:
+    """Liga o detalhamento para a requisição atual; o dict retornado é preenchido até o fim dela."""
+    debug = {"spans": [], "contagens": {}}
+    _debug_requisicao.set(debug)
+    return debug
+
+
+def _somar_debug(chave: str, valor: float):
+    debug = _debug_requisicao.get()
+    if debug is not None:
+        debug["contagens"][chave] = debug["contagens"].get(chave, 0) + valor
+
+
+def registrar_span(tipo: str, nome: str, segundos: float):
+    ETAPA_SEGUNDOS.observar(segundos, tipo, nome)
+    debug = _debug_requisicao.get()
+    if debug is not None:
+        debug["spans"].append({"tipo": tipo, "nome": nome, "ms": round(segundos * 1000, 2)})
+
+
+@contextlib.contextmanager
+def medir(tipo: str, nome: str):
+    """Span em torno de um trecho: `with medir("llm", "geracao"): ...`"""
+    inicio = time.perf_counter()
+    token = _etapa_atual.set(nome)
+    try:
+        yield
+    finally:
+        _etapa_atual.reset(token)
+        registrar_span(tipo, nome, time.perf_counter() - inicio)
+
+
+def registrar_recuperacao(documentos: int):
+    DOCUMENTOS_RECUPERADOS.observar(documentos)
+    if not documentos:
+        RECUPERACOES_VAZIAS.incrementar()
+    _somar_debug("documentos_recuperados", documentos)
+
+
+def registrar_contexto(relatorio: Optional[Dict]):
+    if relatorio:
+        CONTEXTO_TOKENS.observar(relatorio["tokens_enviados"])
+        _somar_debug("tokens_contexto", relatorio["tokens_enviados"])
+
+
+def registrar_cache(resultado: str):
+    CACHE_RESPOSTAS.incrementar(1, resultado)
+
+
+class ContadorTokens(BaseCallbackHandler):
+    """Callback do LLM: soma os tokens de uso (usage_metadata) de cada chamada, rotulados pela etapa."""
+
+    run_inline = True  # Sem ida ao executor: é só somar números
+
+    def on_llm_end(self, response, **kwargs):
+        etapa = _etapa_atual.get() or "outra"
+        for geracoes in response.generations:
+            for geracao in geracoes:
+                uso = getattr(getattr(geracao, "message", None), "usage_metadata", None)
+                if not uso:
+                    continue
+                LLM_TOKENS.incrementar(uso.get("input_tokens", 0), etapa, "entrada")
+                LLM_TOKENS.incrementar(uso.get("output_tokens", 0), etapa, "saida")
+                _somar_debug("tokens_entrada", uso.get("input_tokens", 0))
+                _somar_debug("tokens_saida", uso.get("output_tokens", 0))
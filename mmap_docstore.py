@@ -0,0 +1,155 @@
+# mmap_docstore.py
+# Docstore somente leitura em disco (textos + metadados dos chunks), mapeado via mmap
+#
+# Substitui, na API, o InMemoryDocstore do index.pkl: cada worker do uvicorn desserializava
+# a própria cópia de todos os chunks; com mmap as páginas do arquivo ficam no page cache do
+# sistema operacional, compartilhadas entre processos, e só os registros lidos são decodificados.
+#
+# Arquivos, na pasta da versão do índice:
+#   docstore.bin              registros JSON {"id", "page_content", "metadata"} concatenados,
+#                             na ordem das posições do índice FAISS
+#   docstore_offsets.npy      int64[n + 1]: registro i = docstore.bin[offsets[i]:offsets[i + 1]]
+#   docstore_ids.npy          id do chunk em cada posição (index_to_docstore_id)
+#   docstore_ids_ordem.npy    posições ordenadas pelo id, para a busca binária de id -> posição
+#   docstore_vetores.npy      opcional: float32[n, dim], embedding de cada registro (usado pelas
+#                             seções "pai", que não estão no índice FAISS)
+# Outros conjuntos de documentos (ex.: as seções "pai" do parent_chunks.py) usam o mesmo
+# formato com outro prefixo no lugar de "docstore".
+import os
+import json
+import mmap
+from pathlib import Path
+from typing import Iterator, List, Mapping, Optional, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_NOME = "docstore"
+
+
+def _arquivos(nome: str) -> tuple:
+    # (dados, offsets, ids, ids_ordem)
+    return f"{nome}.bin", f"{nome}_offsets.npy", f"{nome}_ids.npy", f"{nome}_ids_ordem.npy"
+
+
+def _arquivo_vetores(nome: str) -> str:
+    return f"{nome}_vetores.npy"
+
+
+def _salvar_npy(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(f".{path.name}.tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def escrever_documentos(documentos: List[Document], destino: Path, nome: str = DOCSTORE_NOME,
+                        vetores: Optional[np.ndarray] = None):
+    """Grava os documentos (com doc.id preenchido) no formato mapeável, na ordem recebida.
+
+    `vetores`, se informado, tem uma linha por documento, na mesma ordem.
+    """
+    arq_dados, arq_offsets, arq_ids, arq_ordem = _arquivos(nome)
+    offsets = np.zeros(len(documentos) + 1, dtype=np.int64)
+    tmp_path = destino / f".{arq_dados}.tmp"
+    with open(tmp_path, "wb") as f:
+        for i, doc in enumerate(documentos):
+            registro = json.dumps({"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                  ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(registro)
+            offsets[i + 1] = offsets[i] + len(registro)
+    os.replace(tmp_path, destino / arq_dados)
+
+    ids_array = np.asarray([doc.id for doc in documentos], dtype=str)
+    _salvar_npy(destino / arq_offsets, offsets)
+    _salvar_npy(destino / arq_ids, ids_array)
+    _salvar_npy(destino / arq_ordem, np.argsort(ids_array, kind="stable").astype(np.int64))
+    if vetores is not None:
+        if len(vetores) != len(documentos):
+            raise ValueError(f"{len(vetores)} vetores para {len(documentos)} documentos em '{nome}'")
+        _salvar_npy(destino / _arquivo_vetores(nome), np.asarray(vetores, dtype=np.float32))
+
+
+def escrever_docstore(docstore, index_to_docstore_id: dict, destino: Path):
+    """Grava os chunks do docstore do LangChain no formato mapeável, na ordem do índice FAISS."""
+    documentos = []
+    for i in range(len(index_to_docstore_id)):
+        doc = docstore.search(index_to_docstore_id[i])
+        documentos.append(Document(id=index_to_docstore_id[i], page_content=doc.page_content, metadata=doc.metadata))
+    escrever_documentos(documentos, destino)
+
+
+def existe_docstore(path: Path, nome: str = DOCSTORE_NOME) -> bool:
+    return all((path / arquivo).exists() for arquivo in _arquivos(nome))
+
+
+class IdsPorPosicao(Mapping):
+    """index_to_docstore_id do FAISS (posição -> id) lido do array mapeado, sem dict por worker."""
+
+    def __init__(self, ids: np.ndarray):
+        self._ids = ids
+
+    def __getitem__(self, posicao: int) -> str:
+        if not 0 <= posicao < len(self._ids):
+            raise KeyError(posicao)
+        return str(self._ids[posicao])
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self._ids)))
+
+
+class MmapDocstore(Docstore):
+    """Docstore somente leitura sobre os arquivos de escrever_docstore()."""
+
+    def __init__(self, path: Path, nome: str = DOCSTORE_NOME):
+        arq_dados, arq_offsets, arq_ids, arq_ordem = _arquivos(nome)
+        self.offsets = np.load(path / arq_offsets, mmap_mode="r")
+        self.ids = np.load(path / arq_ids, mmap_mode="r")
+        self.ids_ordem = np.load(path / arq_ordem, mmap_mode="r")
+        self._dados = b""
+        if self.offsets[-1] > 0: # mmap não aceita arquivo vazio
+            with open(path / arq_dados, "rb") as f:
+                self._dados = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Versões gravadas antes dos vetores junto do docstore não têm o arquivo
+        arq_vetores = path / _arquivo_vetores(nome)
+        self.vetores: Optional[np.ndarray] = np.load(arq_vetores, mmap_mode="r") if arq_vetores.exists() else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def documento(self, posicao: int) -> Document:
+        registro = json.loads(self._dados[self.offsets[posicao]:self.offsets[posicao + 1]])
+        return Document(**registro)
+
+    def vetor(self, posicao: int) -> Optional[np.ndarray]:
+        if self.vetores is None or posicao < 0:
+            return None
+        return np.asarray(self.vetores[posicao])
+
+    def documentos(self) -> Iterator[Document]:
+        for posicao in range(len(self.ids)):
+            yield self.documento(posicao)
+
+    def posicao(self, doc_id: str) -> int:
+        # Busca binária nos ids ordenados (via ids_ordem); -1 se o id não existe
+        lo, hi = 0, len(self.ids_ordem)
+        while lo < hi:
+            meio = (lo + hi) // 2
+            atual = str(self.ids[self.ids_ordem[meio]])
+            if atual < doc_id:
+                lo = meio + 1
+            elif atual > doc_id:
+                hi = meio
+            else:
+                return int(self.ids_ordem[meio])
+        return -1
+
+    def search(self, search: str) -> Union[str, Document]:
+        posicao = self.posicao(search)
+        if posicao < 0:
+            # Mesmo retorno do InMemoryDocstore para ids ausentes
+            return f"ID {search} not found."
+        return self.documento(posicao)
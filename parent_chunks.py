@@ -0,0 +1,235 @@
+# parent_chunks.py
+# Chunking "pai/filho": chunks pequenos para o embedding, seção (ou página) inteira para o LLM
+#
+# Com CHUNKING=pai no create_vector_store.py cada página é dividida nas seções marcadas
+# pelos títulos do PDF (nunca atravessando a página); as seções são os "pais", gravados no
+# docstore mapeado "parents", e os "filhos" (trechos das seções) vão para o FAISS/BM25.
+# Na API, os filhos encontrados são trocados pelos pais, sem repetição.
+#
+# Comparação com o splitter simples (vetores, tamanho do índice, acerto e taxa de resposta):
+#   python parent_chunks.py comparar perguntas_rotuladas.jsonl [--com-llm]
+import os
+import re
+import json
+import argparse
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNKING_MODOS = ("simples", "pai")
+PARENTS_NOME = "parents" # Prefixo dos arquivos do docstore das seções (ver mmap_docstore.py)
+
+PARENT_MAX_CHARS = int(os.getenv("PARENT_MAX_CHARS", 2000)) # Seções maiores são divididas
+PARENT_MIN_CHARS = int(os.getenv("PARENT_MIN_CHARS", 300)) # Seções menores se juntam à seguinte
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", 400))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", 40))
+CHILD_MIN_CHARS = 40 # Cabeçalhos/rodapés soltos não viram vetores
+TITULO_ESCALA = 1.15 # Fonte pelo menos 15% maior que a do corpo da página = título
+
+
+def titulos_da_pagina(page) -> List[str]:
+    """Linhas de título de uma página do PyMuPDF: fonte maior que a do corpo, ou negrito e curtas."""
+    linhas = []
+    for bloco in page.get_text("dict")["blocks"]:
+        for linha in bloco.get("lines", []):
+            spans = [s for s in linha["spans"] if s["text"].strip()]
+            if spans:
+                linhas.append(spans)
+    if not linhas:
+        return []
+    # Tamanho de fonte do corpo: mediana ponderada pelo número de caracteres
+    tamanhos = [round(s["size"], 1) for spans in linhas for s in spans for _ in range(len(s["text"]))]
+    corpo = statistics.median(tamanhos)
+
+    titulos = []
+    for spans in linhas:
+        texto = " ".join(s["text"].strip() for s in spans)
+        maior = max(s["size"] for s in spans) >= corpo * TITULO_ESCALA
+        negrito = all(s["flags"] & 16 for s in spans) and len(texto) <= 80 and (texto[:1].isupper() or texto[:1].isdigit())
+        if (maior or negrito) and re.search(r"[^\W\d_]", texto):
+            titulos.append(texto)
+    return titulos
+
+
+def dividir_secoes(texto: str, titulos: List[str]) -> List[Tuple[str, str]]:
+    """Divide o texto da página em seções (título, texto), começando uma nova a cada título."""
+    marcados = {re.sub(r"\s+", " ", t).strip() for t in titulos}
+    secoes, titulo, linhas = [], "", []
+    for linha in texto.splitlines():
+        normalizada = re.sub(r"\s+", " ", linha).strip()
+        if normalizada in marcados:
+            if "".join(linhas).strip():
+                secoes.append((titulo, "\n".join(linhas)))
+                linhas = []
+            titulo = normalizada
+        linhas.append(linha)
+    if "".join(linhas).strip():
+        secoes.append((titulo, "\n".join(linhas)))
+
+    # Seções muito curtas (título seguido de uma linha) se juntam à próxima da mesma página
+    juntas: List[Tuple[str, str]] = []
+    pendente = None
+    for titulo, corpo in secoes:
+        if pendente is not None:
+            titulo, corpo = pendente[0] or titulo, pendente[1] + "\n" + corpo
+            pendente = None
+        if len(corpo.strip()) < PARENT_MIN_CHARS:
+            pendente = (titulo, corpo)
+        else:
+            juntas.append((titulo, corpo))
+    if pendente is not None:
+        if juntas:
+            juntas[-1] = (juntas[-1][0], juntas[-1][1] + "\n" + pendente[1])
+        else:
+            juntas.append(pendente)
+    return juntas
+
+
+def gerar_pais_e_filhos(paginas: List[Dict], prefixo_id: str) -> Tuple[List[Document], List[Document]]:
+    """Gera as seções (pais, com id) e os trechos indexados (filhos, com metadata['parent_id']).
+
+    `paginas` é a saída do _process_pdf: [{"texto", "metadata", "titulos"}].
+    """
+    divisor_pai = RecursiveCharacterTextSplitter(chunk_size=PARENT_MAX_CHARS, chunk_overlap=0)
+    divisor_filho = RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=CHILD_CHUNK_OVERLAP)
+    pais, filhos = [], []
+    for pagina in paginas:
+        for titulo, corpo in dividir_secoes(pagina["texto"], pagina.get("titulos", [])):
+            for parte in divisor_pai.split_text(corpo):
+                parent_id = f"{prefixo_id}#p{len(pais)}"
+                pais.append(Document(id=parent_id, page_content=parte,
+                                     metadata={**pagina["metadata"], "secao": titulo}))
+                for trecho in divisor_filho.split_text(parte):
+                    if len(trecho.strip()) < CHILD_MIN_CHARS:
+                        continue
+                    # O título da seção vai junto no texto embutido: ajuda a achar trechos genéricos
+                    if titulo and not trecho.lstrip().startswith(titulo):
+                        trecho = f"{titulo}\n{trecho}"
+                    filhos.append(Document(page_content=trecho,
+                                           metadata={**pagina["metadata"], "parent_id": parent_id}))
+    return pais, filhos
+
+
+class ParentRetriever(BaseRetriever):
+    """Troca os trechos devolvidos pelo retriever base pelas seções (pais), sem repetição.
+
+    O retriever base deve buscar mais trechos (fetch) do que `k`, já que vários trechos
+    costumam cair na mesma seção.
+    """
+
+    base: Any
+    pais: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.trocar_por_pais(self.base.invoke(query))
+
+    def trocar_por_pais(self, filhos: List[Document]) -> List[Document]:
+        resultado, vistos = [], set()
+        for filho in filhos:
+            parent_id = filho.metadata.get("parent_id")
+            if parent_id is None:
+                resultado.append(filho)
+            elif parent_id not in vistos:
+                vistos.add(parent_id)
+                pai = self.pais.search(parent_id)
+                resultado.append(pai if isinstance(pai, Document) else filho)
+            if len(resultado) == self.k:
+                break
+        return resultado
+
+
+def _extrair_paginas(pdf_path: Path) -> List[Dict]:
+    import fitz  # PyMuPDF
+
+    paginas = []
+    with fitz.open(pdf_path) as doc_fitz:
+        for page_num, page in enumerate(doc_fitz):
+            paginas.append({
+                "texto": page.get_text(),
+                "metadata": {"source": str(pdf_path), "file_path": str(pdf_path),
+                             "page": page_num, "total_pages": doc_fitz.page_count},
+                "titulos": titulos_da_pagina(page),
+            })
+    return paginas
+
+
+def comparar(data_path: Path, perguntas_path: Path, embeddings, com_llm: bool = False) -> Dict[str, Dict]:
+    """Indexa os PDFs em memória nos dois modos e mede vetores, tamanho, acerto@k e contexto enviado."""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from hybrid_retriever import _acertou
+
+    with open(perguntas_path, encoding="utf-8") as f:
+        rotuladas = [json.loads(linha) for linha in f if linha.strip()]
+    paginas_por_pdf = {pdf.name: _extrair_paginas(pdf) for pdf in sorted(data_path.glob("*.pdf"))}
+
+    document_chain = None
+    if com_llm:
+        from main import obter_document_chain
+        document_chain = obter_document_chain()
+
+    resultados = {}
+    for modo in CHUNKING_MODOS:
+        if modo == "simples":
+            splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=30)
+            chunks = splitter.split_documents([Document(page_content=p["texto"], metadata=p["metadata"])
+                                               for paginas in paginas_por_pdf.values() for p in paginas])
+            pais = []
+        else:
+            pais, chunks = [], []
+            for nome, paginas in paginas_por_pdf.items():
+                p, c = gerar_pais_e_filhos(paginas, nome)
+                pais += p
+                chunks += c
+        vectorstore = FAISS.from_documents(chunks, embeddings)
+        retriever = vectorstore.as_retriever(search_type="similarity_score_threshold",
+                                             search_kwargs={"score_threshold": 0.4, "k": 4})
+        if modo == "pai":
+            base = vectorstore.as_retriever(search_type="similarity_score_threshold",
+                                            search_kwargs={"score_threshold": 0.4, "k": 12})
+            retriever = ParentRetriever(base=base, pais=InMemoryDocstore({d.id: d for d in pais}))
+
+        acertos, contexto, respondidas = 0, [], 0
+        for q in rotuladas:
+            docs = retriever.invoke(q["pergunta"])
+            acertos += _acertou(docs, q)
+            contexto.append(sum(len(d.page_content) for d in docs))
+            if document_chain is not None and docs:
+                resposta = document_chain.invoke({"input": q["pergunta"], "context": docs})
+                respondidas += resposta.strip().rstrip(".!?") != "Não sei, melhor abrir um chamado"
+        n = max(len(rotuladas), 1)
+        resultados[modo] = {
+            "vetores": vectorstore.index.ntotal,
+            "indice_mb": vectorstore.index.ntotal * vectorstore.index.d * 4 / 2**20,
+            "acerto": acertos / n,
+            "contexto_medio_chars": sum(contexto) / n,
+            "taxa_resposta": respondidas / n if com_llm else None,
+        }
+    return resultados
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from embedding_cache import build_embeddings
+
+    parser = argparse.ArgumentParser(description="Chunking pai/filho (seções e páginas)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_comp = sub.add_parser("comparar", help="Compara o splitter simples com o pai/filho")
+    p_comp.add_argument("perguntas", type=Path)
+    p_comp.add_argument("--data", type=Path, default=Path("./data/"))
+    p_comp.add_argument("--com-llm", action="store_true", help="Mede também a taxa de resposta do LLM (chamadas pagas)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    resultados = comparar(args.data, args.perguntas, build_embeddings(os.getenv("GEMINI_KEY")), args.com_llm)
+    print(f"{'modo':<8} {'vetores':>8} {'índice MB':>10} {'acerto@k':>9} {'contexto':>9} {'respostas':>10}")
+    for modo, r in resultados.items():
+        taxa = "-" if r["taxa_resposta"] is None else f"{r['taxa_resposta']:.1%}"
+        print(f"{modo:<8} {r['vetores']:>8} {r['indice_mb']:>10.2f} {r['acerto']:>9.1%} "
+              f"{r['contexto_medio_chars']:>9.0f} {taxa:>10}")
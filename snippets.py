@@ -0,0 +1,108 @@
+# snippets.py
+# Trechos das citações: dados pré-calculados na indexação + escolha da melhor janela em uma passada
+import re
+import bisect
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+# Campos gravados na metadata de cada chunk pelo create_vector_store.py
+CAMPO_TEXTO = "trecho_texto" # Texto com espaços normalizados (o que aparece na citação)
+CAMPO_BUSCA = "trecho_busca" # Mesmo texto em minúsculas e sem acentos, com o mesmo tamanho
+CAMPO_TOKENS = "trecho_tokens" # [início, fim, início, fim, ...] de cada palavra em trecho_busca
+CAMPOS_TRECHO = (CAMPO_TEXTO, CAMPO_BUSCA, CAMPO_TOKENS)
+
+TAMANHO_MINIMO_TERMO = 4 # Palavras curtas da pergunta ("nota", sim; "de", "a", não)
+
+
+def _clean_text(s: str) -> str:
+    return re.sub(r"\s+", " ", s or "").strip()
+
+
+def _para_busca(texto: str) -> str:
+    # Caractere a caractere, para manter as posições: "Importação" -> "importacao"
+    return "".join(unicodedata.normalize("NFKD", c.lower())[0] for c in texto)
+
+
+def preparar_trecho(texto: str) -> Dict:
+    """Campos de CAMPOS_TRECHO para um chunk; calculados uma vez, na indexação."""
+    limpo = _clean_text(texto)
+    busca = _para_busca(limpo)
+    tokens = [pos for m in re.finditer(r"\w+", busca) for pos in m.span()]
+    return {CAMPO_TEXTO: limpo, CAMPO_BUSCA: busca, CAMPO_TOKENS: tokens}
+
+
+def termos_da_consulta(query: str) -> Set[str]:
+    """Termos da pergunta no mesmo formato de trecho_busca; calculados uma vez por requisição."""
+    return {t for t in re.findall(r"\w+", _para_busca(query or "")) if len(t) >= TAMANHO_MINIMO_TERMO}
+
+
+def melhor_janela(dados: Dict, termos: Set[str], janela: int = 240) -> str:
+    """Janela de até `janela` caracteres com mais termos distintos da pergunta (e, no empate, mais ocorrências).
+
+    As ocorrências de cada termo são achadas com str.find e confirmadas como palavra inteira
+    pelas posições pré-calculadas; depois, uma passada com dois ponteiros sobre elas. A janela
+    escolhida é centralizada nas ocorrências e ajustada para não cortar palavras no início.
+    """
+    texto, busca, tokens = dados[CAMPO_TEXTO], dados[CAMPO_BUSCA], dados[CAMPO_TOKENS]
+    inicios = tokens[0::2]
+    ocorrencias = []  # (início, fim, termo) das palavras que são termos da pergunta
+    for termo in termos:
+        pos = busca.find(termo)
+        while pos != -1:
+            j = bisect.bisect_left(inicios, pos)
+            if j < len(inicios) and inicios[j] == pos and tokens[2 * j + 1] == pos + len(termo):
+                ocorrencias.append((pos, pos + len(termo), termo))
+            pos = busca.find(termo, pos + 1)
+    ocorrencias.sort()
+
+    melhor, melhor_score = None, (0, 0)
+    contagem: Counter = Counter()
+    esquerda = 0
+    for direita, (_, fim, termo) in enumerate(ocorrencias):
+        contagem[termo] += 1
+        while fim - ocorrencias[esquerda][0] > janela:
+            termo_saindo = ocorrencias[esquerda][2]
+            contagem[termo_saindo] -= 1
+            if not contagem[termo_saindo]:
+                del contagem[termo_saindo]
+            esquerda += 1
+        score = (len(contagem), direita - esquerda + 1)
+        if score > melhor_score:
+            melhor, melhor_score = (ocorrencias[esquerda][0], fim), score
+
+    if melhor is None:
+        ini = 0
+    else:
+        centro = (melhor[0] + melhor[1]) // 2
+        ini = max(0, min(centro - janela // 2, len(texto) - janela))
+        # Começa no início da palavra seguinte, em vez de no meio de uma
+        j = bisect.bisect_left(inicios, ini)
+        if ini > 0 and j < len(inicios) and inicios[j] - ini < 20 and inicios[j] <= melhor[0]:
+            ini = inicios[j]
+    return "..." + texto[ini:ini + janela] + "..."
+
+
+def extrair_trecho(texto: str, query: str = "", janela: int = 240, dados: Optional[Dict] = None,
+                   termos: Optional[Set[str]] = None) -> str:
+    """Trecho do chunk mais relevante para a pergunta, para as citações.
+
+    `dados` é a metadata do chunk (com os campos pré-calculados, se existirem) e `termos`, a
+    saída de termos_da_consulta(); sem eles o cálculo é feito aqui mesmo.
+    """
+    if not dados or CAMPO_TOKENS not in dados:
+        dados = preparar_trecho(texto)
+    if termos is None:
+        termos = termos_da_consulta(query)
+    return melhor_janela(dados, termos, janela)
+
+
+def remover_campos_trecho(metadata: Dict) -> Dict:
+    """Cópia da metadata sem os campos pré-calculados (para textos que deixaram de ser o chunk original)."""
+    return {k: v for k, v in metadata.items() if k not in CAMPOS_TRECHO}
+
+
+def preparar_documentos(docs: List) -> None:
+    """Acrescenta os campos de trecho à metadata de cada Document, no lugar."""
+    for doc in docs:
+        doc.metadata.update(preparar_trecho(doc.page_content))
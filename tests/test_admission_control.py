@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from admission_control import LimiteConcorrencia, SingleFlight, Sobrecarga
+
+
+def test_single_flight_chamadas_iguais_executam_uma_vez():
+    chamadas = []
+
+    async def fabrica():
+        chamadas.append(1)
+        await asyncio.sleep(0.01)
+        return "resposta"
+
+    async def cenario():
+        coalescer = SingleFlight("teste")
+        resultados = await asyncio.gather(*(coalescer.executar("mesma", fabrica) for _ in range(10)))
+        # Terminada a chamada, nada fica guardado: a próxima executa de novo
+        return resultados, await coalescer.executar("mesma", fabrica)
+
+    resultados, depois = asyncio.run(cenario())
+    assert resultados == ["resposta"] * 10
+    assert depois == "resposta"
+    assert len(chamadas) == 2
+
+
+def test_single_flight_cancelar_o_lider_nao_derruba_os_seguidores():
+    async def fabrica():
+        await asyncio.sleep(0.02)
+        return 42
+
+    async def cenario():
+        coalescer = SingleFlight("teste")
+        lider = asyncio.create_task(coalescer.executar("k", fabrica))
+        await asyncio.sleep(0)
+        seguidor = asyncio.create_task(coalescer.executar("k", fabrica))
+        await asyncio.sleep(0)
+        lider.cancel()
+        return await seguidor
+
+    assert asyncio.run(cenario()) == 42
+
+
+def test_limite_recusa_com_a_fila_cheia():
+    async def cenario():
+        limite = LimiteConcorrencia("teste", concorrencia=1, fila_max=1, espera_max=5)
+        liberar = asyncio.Event()
+
+        async def ocupar():
+            async with limite:
+                await liberar.wait()
+
+        tarefas = [asyncio.create_task(ocupar()) for _ in range(2)] # uma em uso, uma na fila
+        await asyncio.sleep(0.01)
+        assert (limite.em_uso, limite.na_fila) == (1, 1)
+        with pytest.raises(Sobrecarga) as erro:
+            async with limite:
+                pass
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return erro.value, limite
+
+    erro, limite = asyncio.run(cenario())
+    assert erro.status_http == 503 and erro.motivo == "fila_cheia" and erro.retry_after >= 1
+    assert (limite.em_uso, limite.na_fila) == (0, 0)
+
+
+def test_limite_recusa_quem_espera_demais():
+    async def cenario():
+        limite = LimiteConcorrencia("teste", concorrencia=1, fila_max=10, espera_max=0.01, status_http=429)
+        async with limite:
+            with pytest.raises(Sobrecarga) as erro:
+                async with limite:
+                    pass
+        return erro.value, limite
+
+    erro, limite = asyncio.run(cenario())
+    assert erro.status_http == 429 and erro.motivo == "espera_longa"
+    assert limite.na_fila == 0
+
+
+def test_limite_nao_perde_vagas_com_timeouts_e_cancelamentos():
+    async def cenario():
+        limite = LimiteConcorrencia("teste", concorrencia=2, fila_max=100, espera_max=0.005)
+
+        async def chamar(i):
+            try:
+                async with limite:
+                    await asyncio.sleep(0.001 * (i % 4))
+            except Sobrecarga:
+                pass
+
+        tarefas = [asyncio.create_task(chamar(i)) for i in range(60)]
+        await asyncio.sleep(0.003)
+        for tarefa in tarefas[::7]:
+            tarefa.cancel() # Cliente que desconecta enquanto espera na fila
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        # Com as vagas intactas, duas chamadas entram ao mesmo tempo sem esperar
+        async with limite, limite:
+            pass
+        return limite
+
+    limite = asyncio.run(cenario())
+    assert (limite.em_uso, limite.na_fila, limite._semaforo._value) == (0, 0, 2)
+
+
+def test_espera_na_fila_vira_span_proprio():
+    from metrics import iniciar_debug
+
+    async def cenario():
+        debug = iniciar_debug()
+        limite = LimiteConcorrencia("llm", concorrencia=1, fila_max=10, espera_max=5)
+
+        async def chamar():
+            async with limite:
+                await asyncio.sleep(0.02)
+
+        await asyncio.gather(chamar(), chamar())
+        return debug
+
+    spans = [s for s in asyncio.run(cenario())["spans"] if s["tipo"] == "fila"]
+    assert [s["nome"] for s in spans] == ["llm", "llm"]
+    assert max(s["ms"] for s in spans) >= 15 # A segunda chamada esperou a primeira terminar
@@ -0,0 +1,75 @@
+import answer_cache
+from answer_cache import AnswerCache, normalizar_pergunta
+from fake_models import FakeEmbeddings
+
+EMBEDDINGS = FakeEmbeddings()
+
+
+def _put(cache: AnswerCache, pergunta: str, versao: str = "v1"):
+    cache.put(pergunta, EMBEDDINGS.embed_query(pergunta), versao, {"resposta": pergunta})
+
+
+def test_hit_exato_e_semantico():
+    cache = AnswerCache(similarity_threshold=0.8)
+    _put(cache, "Como importo a NF-e?")
+    assert normalizar_pergunta("como importo a nf e") == normalizar_pergunta("Como importo a NF-e?")
+    assert cache.get_exato("como importo a nf e", "v1") == {"resposta": "Como importo a NF-e?"}
+    assert cache.get_semantico(EMBEDDINGS.embed_query("como importo a NF-e no sistema"), "v1") is not None
+    assert cache.get_semantico(EMBEDDINGS.embed_query("fechamento do caixa"), "v1") is None
+
+
+def test_entrada_expira_com_o_ttl(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: agora[0])
+    cache = AnswerCache(ttl=60, similarity_threshold=0.8)
+    _put(cache, "como cadastrar empresa")
+    agora[0] += 59
+    assert cache.get_exato("como cadastrar empresa", "v1") is not None
+    agora[0] += 2
+    assert cache.get_exato("como cadastrar empresa", "v1") is None
+    assert cache.get_semantico(EMBEDDINGS.embed_query("como cadastrar empresa"), "v1") is None
+
+
+def test_versao_nova_do_indice_invalida_o_cache():
+    cache = AnswerCache()
+    _put(cache, "como cadastrar empresa", "v1")
+    assert cache.get_exato("como cadastrar empresa", "v2") is None
+    _put(cache, "como cadastrar empresa", "v2")
+    # Requisições ainda na versão anterior (troca a quente) não leem, não gravam e não apagam
+    assert cache.get_exato("como cadastrar empresa", "v1") is None
+    _put(cache, "outra pergunta", "v1")
+    assert cache.get_exato("outra pergunta", "v2") is None
+    assert cache.get_exato("como cadastrar empresa", "v2") is not None
+
+
+def test_lru_respeita_o_maximo_de_entradas():
+    cache = AnswerCache(max_entries=2)
+    for pergunta in ("a", "b"):
+        _put(cache, pergunta)
+    cache.get_exato("a", "v1") # "b" passa a ser a menos usada
+    _put(cache, "c")
+    assert cache.get_exato("b", "v1") is None
+    assert cache.get_exato("a", "v1") is not None and cache.get_exato("c", "v1") is not None
+
+
+def test_versoes_antigas_lembradas_sao_limitadas():
+    cache = AnswerCache()
+    for i in range(answer_cache.VERSOES_ANTIGAS_MAX * 3):
+        _put(cache, "como cadastrar empresa", f"v{i}")
+    assert len(cache._versoes_antigas) == answer_cache.VERSOES_ANTIGAS_MAX
+    ultima = f"v{answer_cache.VERSOES_ANTIGAS_MAX * 3 - 1}"
+    assert cache.get_exato("como cadastrar empresa", f"v{answer_cache.VERSOES_ANTIGAS_MAX * 3 - 2}") is None
+    assert cache.get_exato("como cadastrar empresa", ultima) is not None
+
+
+def test_cada_consulta_conta_uma_vez():
+    cache = AnswerCache(similarity_threshold=0.8)
+    _put(cache, "como cadastrar empresa")
+    for pergunta in ("como cadastrar empresa", "como cadastrar a empresa", "fechamento do caixa"):
+        if cache.get_exato(pergunta, "v1") is not None:
+            cache.contar("HIT_EXATO")
+        elif cache.get_semantico(EMBEDDINGS.embed_query(pergunta), "v1") is not None:
+            cache.contar("HIT_SEMANTICO")
+        else:
+            cache.contar("MISS")
+    assert (cache.hits_exatos, cache.hits_semanticos, cache.misses) == (1, 1, 1)
@@ -0,0 +1,58 @@
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+
+TEXTOS = {
+    "c1": "Para cadastrar a empresa acesse o menu Cadastros > Empresas e preencha o CNPJ.",
+    "c2": "A nota fiscal de saída com CFOP 5102 é emitida pelo menu Fiscal > Notas.",
+    "c3": "Para configurar a impressora fiscal acesse Configurações > Periféricos.",
+    "c4": "O fechamento do caixa é feito ao fim do dia pelo menu Financeiro > Caixa.",
+}
+
+
+class _VectorstoreFalso:
+    def __init__(self):
+        self.docstore = InMemoryDocstore({i: Document(page_content=t, id=i) for i, t in TEXTOS.items()})
+
+
+def _retriever(**kwargs) -> HybridRetriever:
+    bm25 = BM25Index.construir(list(TEXTOS), list(TEXTOS.values()))
+    return HybridRetriever(vectorstore=_VectorstoreFalso(), bm25=bm25, k=2, **kwargs)
+
+
+def test_rrf_soma_as_posicoes_das_listas():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"]], rrf_k=1) == ["b", "a", "c"]
+    assert reciprocal_rank_fusion([["a"], []]) == ["a"]
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_hit_so_lexical_entra_na_fusao():
+    # Código exato (CFOP) que a busca vetorial não achou acima do limiar
+    docs = _retriever().fundir("nota com CFOP 5102", [])
+    assert [d.id for d in docs][:1] == ["c2"]
+
+
+def test_pergunta_fora_do_assunto_nao_traz_documentos():
+    # Compartilha "empresa" e "menu" com os manuais, mas não é sobre eles
+    docs = _retriever().fundir("qual o menu do restaurante da empresa hoje no almoço", [])
+    assert docs == []
+
+
+def test_vetoriais_abaixo_do_limiar_sao_descartados():
+    vetoriais = [(Document(page_content=TEXTOS["c4"], id="c4"), 0.1)]
+    assert _retriever().fundir("previsão do tempo amanhã", vetoriais) == []
+    vetoriais = [(Document(page_content=TEXTOS["c4"], id="c4"), 0.9)]
+    assert [d.id for d in _retriever().fundir("previsão do tempo amanhã", vetoriais)] == ["c4"]
+
+
+def test_termos_fora_do_vocabulario_nao_derrubam_o_hit_lexical():
+    # Termos conhecidos comuns no corpus; "XML" e "Importação" não existem nele e não podem
+    # servir de referência para o score que os trechos alcançam
+    textos = {f"f{i}": f"Rotina {i}: para importar o arquivo {i} acesse o menu Fiscal > Rotinas." for i in range(30)}
+    bm25 = BM25Index.construir(list(textos), list(textos.values()))
+    vectorstore = _VectorstoreFalso()
+    vectorstore.docstore = InMemoryDocstore({i: Document(page_content=t, id=i) for i, t in textos.items()})
+    retriever = HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=2)
+    assert len(retriever.fundir("Como importar XML no menu Fiscal Importação?", [])) == 2
@@ -0,0 +1,51 @@
+import io
+import random
+
+import fitz
+from PIL import Image
+
+from image_analysis import IMAGE_MAX_SIDE, ImageAnalysisCache, preparar_imagem
+
+
+def _webp(largura: int, altura: int) -> bytes:
+    imagem = Image.new("RGB", (largura, altura))
+    imagem.putdata([((x * 7) % 256, (y * 3) % 256, (x + y) % 256) for y in range(altura) for x in range(largura)])
+    saida = io.BytesIO()
+    imagem.save(saida, format="WEBP", quality=90)
+    return saida.getvalue()
+
+
+def test_webp_grande_e_reduzido_e_recebe_hash():
+    dados, mime, hash_perceptual = preparar_imagem(_webp(IMAGE_MAX_SIDE + 400, 300))
+    assert mime in ("image/jpeg", "image/png")
+    assert max(fitz.Pixmap(dados).width, fitz.Pixmap(dados).height) == IMAGE_MAX_SIDE
+    assert hash_perceptual is not None
+
+
+def test_webp_pequeno_segue_como_veio_com_hash():
+    original = _webp(120, 80)
+    dados, mime, hash_perceptual = preparar_imagem(original)
+    assert (dados, mime) == (original, "image/webp")
+    assert hash_perceptual is not None
+
+
+def test_quase_duplicata_achada_entre_muitas_entradas():
+    cache = ImageAnalysisCache(max_entries=1000, distancia_maxima=4)
+    aleatorio = random.Random(0)
+    for i in range(999):
+        cache.put(aleatorio.getrandbits(64), "o que é este erro?", f"outra {i}")
+    cache.put(0xF0F0_1234_ABCD_0F0F, "o que é este erro?", "análise")
+
+    # 4 bits trocados, cada um numa faixa diferente
+    assert cache.get(0xF0F0_1234_ABCD_0F0F ^ 0x8000_0100_0020_0001, "O que é este erro") == ("análise", "HIT_SEMANTICO")
+    assert cache.get(0xF0F0_1234_ABCD_0F0F ^ 0x1F, "o que é este erro?") == (None, "MISS")
+    assert cache.get(0xF0F0_1234_ABCD_0F0F ^ 0x1, "outra pergunta") == (None, "MISS")
+
+
+def test_entradas_removidas_saem_das_faixas():
+    cache = ImageAnalysisCache(max_entries=2)
+    cache.put(1, "p", "a")
+    cache.put(0xFFFF << 40, "p", "b")
+    cache.put(0xFF << 16, "p", "c")  # Remove o hash 1, o mais antigo
+    assert cache.get(1 ^ 0b10, "p") == (None, "MISS")
+    assert sum(map(len, cache._faixas.values())) == 2 * len(cache._chaves_faixas(0, "p"))
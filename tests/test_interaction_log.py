@@ -0,0 +1,47 @@
+import os
+
+from interaction_log import PREFIXO_ATUAL, RegistroInteracoes, arquivos_do_log, ler_registros
+
+
+def _registrar(log: RegistroInteracoes, n: int, **extra):
+    for i in range(n):
+        assert log.registrar({"tipo": "chat", "ts": f"2026-10-01T00:00:{i % 60:02d}", "i": i, **extra})
+
+
+def test_rotacao_comprime_e_a_leitura_junta_tudo(tmp_path):
+    log = RegistroInteracoes(tmp_path, max_bytes=500, comprimir=True, lote=8, intervalo_fsync=0.01)
+    _registrar(log, 100, pergunta="como cadastrar a empresa")
+    log.fechar()
+
+    arquivos = arquivos_do_log(tmp_path)
+    rotacionados = [p for p in arquivos if p.name.endswith(".jsonl.gz")]
+    assert len(rotacionados) > 1
+    assert arquivos[-1].name == f"{PREFIXO_ATUAL}{os.getpid()}.jsonl"
+    assert not list(tmp_path.glob(".*.tmp")) # Nenhum .gz pela metade
+    assert [r["i"] for r in ler_registros(tmp_path)] == list(range(100))
+    assert log.estatisticas()["gravados"] == 100
+
+
+def test_retencao_mantem_os_rotacionados_mais_recentes(tmp_path):
+    log = RegistroInteracoes(tmp_path, max_bytes=200, max_arquivos=2, comprimir=False, lote=4, intervalo_fsync=0.01)
+    _registrar(log, 60)
+    log.fechar()
+    assert len([p for p in arquivos_do_log(tmp_path) if not p.name.startswith(PREFIXO_ATUAL)]) == 2
+    indices = [r["i"] for r in ler_registros(tmp_path)]
+    assert indices == sorted(indices) and indices[-1] == 59
+
+
+def test_filtros_de_leitura_e_linhas_truncadas(tmp_path):
+    (tmp_path / f"{PREFIXO_ATUAL}1.jsonl").write_text(
+        '{"tipo": "chat", "ts": "2026-09-30T23:59:59"}\n'
+        '{"tipo": "imagem", "ts": "2026-10-01T10:00:00"}\n'
+        '{"tipo": "chat", "ts": "2026-10-02T08:00:00"}\n'
+        '{"tipo": "chat", "ts": "2026-10-0', encoding="utf-8")
+    assert [r["ts"] for r in ler_registros(tmp_path, tipo="chat", desde="2026-10-01")] == ["2026-10-02T08:00:00"]
+    assert len(list(ler_registros(tmp_path))) == 3
+
+
+def test_registro_depois_de_fechar_e_descartado(tmp_path):
+    log = RegistroInteracoes(tmp_path, intervalo_fsync=0.01)
+    log.fechar()
+    assert log.registrar({"tipo": "chat"}) is False
@@ -0,0 +1,51 @@
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from mmap_docstore import IdsPorPosicao, MmapDocstore, escrever_docstore, escrever_documentos, existe_docstore
+
+
+def test_ida_e_volta_do_docstore(tmp_path):
+    ids = ["c3", "c1", "c2"] # Ordem do índice FAISS, diferente da ordem dos ids
+    docs = {i: Document(page_content=f"Conteúdo de {i} com acentuação: ção", metadata={"page": n, "source": "manual.pdf"})
+            for n, i in enumerate(ids)}
+    escrever_docstore(InMemoryDocstore(docs), dict(enumerate(ids)), tmp_path)
+    assert existe_docstore(tmp_path)
+
+    docstore = MmapDocstore(tmp_path)
+    assert len(docstore) == 3
+    assert dict(IdsPorPosicao(docstore.ids)) == {0: "c3", 1: "c1", 2: "c2"}
+    for posicao, doc_id in enumerate(ids):
+        assert docstore.posicao(doc_id) == posicao
+        doc = docstore.search(doc_id)
+        assert doc.id == doc_id
+        assert doc.page_content == docs[doc_id].page_content
+        assert doc.metadata == docs[doc_id].metadata
+    assert [d.id for d in docstore.documentos()] == ids
+
+
+def test_id_ausente_e_docstore_vazio(tmp_path):
+    escrever_documentos([Document(id="a", page_content="x")], tmp_path, nome="pais")
+    docstore = MmapDocstore(tmp_path, nome="pais")
+    assert docstore.posicao("b") == -1
+    assert docstore.search("b") == "ID b not found."
+
+    vazio = tmp_path / "vazio"
+    vazio.mkdir()
+    escrever_documentos([], vazio)
+    assert len(MmapDocstore(vazio)) == 0
+
+
+def test_vetores_gravados_junto_dos_documentos(tmp_path):
+    docs = [Document(id="s2", page_content="b"), Document(id="s1", page_content="a")]
+    escrever_documentos(docs, tmp_path, nome="pais", vetores=np.array([[0.0, 1.0], [1.0, 0.0]]))
+    docstore = MmapDocstore(tmp_path, nome="pais")
+    assert docstore.vetor(docstore.posicao("s1")).tolist() == [1.0, 0.0]
+    assert docstore.vetor(docstore.posicao("s2")).tolist() == [0.0, 1.0]
+    assert docstore.vetor(docstore.posicao("ausente")) is None
+
+    # Versões gravadas sem os vetores continuam abrindo
+    sem_vetores = tmp_path / "antiga"
+    sem_vetores.mkdir()
+    escrever_documentos(docs, sem_vetores, nome="pais")
+    assert MmapDocstore(sem_vetores, nome="pais").vetor(0) is None
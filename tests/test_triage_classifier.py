@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+
+from fake_models import FakeEmbeddings
+from triage_classifier import KnnTriageClassifier, treinar
+
+VETORES = np.eye(3, dtype=np.float32)
+
+
+def _modelo(campos):
+    return KnnTriageClassifier(VETORES, ["PEDIR_INFO", "PEDIR_INFO", "ABRIR_CHAMADO"], ["BAIXA", "BAIXA", "ALTA"],
+                               campos, k=1)
+
+
+def test_pedir_info_local_devolve_os_campos_do_vizinho(tmp_path):
+    modelo = _modelo([["módulo"], ["mensagem de erro"], []])
+    assert modelo.prever([0, 1, 0])["campos_faltantes"] == ["mensagem de erro"]
+    modelo.salvar(tmp_path / "m.npz")
+    assert KnnTriageClassifier.carregar(tmp_path / "m.npz", k=1).prever([1, 0, 0])["campos_faltantes"] == ["módulo"]
+
+
+def test_modelo_sem_campos_continua_sem_campos_depois_de_salvo(tmp_path):
+    modelo = _modelo(None)
+    assert modelo.prever([1, 0, 0]) is None # PEDIR_INFO fica para o LLM
+    assert modelo.prever([0, 0, 1])["decisao"] == "ABRIR_CHAMADO"
+    modelo.salvar(tmp_path / "m.npz")
+    recarregado = KnnTriageClassifier.carregar(tmp_path / "m.npz", k=1)
+    assert recarregado.campos_faltantes is None
+    assert recarregado.prever([1, 0, 0]) is None
+    assert _modelo([["módulo"]]).prever([0, 1, 0]) is None # Lista menor que os exemplos
+
+
+def test_treino_usa_so_as_triagens_do_llm_sem_cache(tmp_path):
+    registros = [
+        {"tipo": "chat", "ts": "2026-10-01T00:00:01", "cache": "MISS", "pergunta": "preciso de ajuda",
+         "triagem": {"decisao": "PEDIR_INFO", "urgencia": "BAIXA", "campos_faltantes": ["módulo"], "origem": "llm"}},
+        {"tipo": "chat", "ts": "2026-10-01T00:00:02", "cache": "MISS", "pergunta": "abra um chamado",
+         "triagem": {"decisao": "ABRIR_CHAMADO", "urgencia": "ALTA", "campos_faltantes": [], "origem": "local"}},
+        {"tipo": "chat", "ts": "2026-10-01T00:00:03", "cache": "HIT_EXATO", "pergunta": "como importar",
+         "triagem": {"decisao": "AUTO_RESOLVER", "urgencia": "BAIXA", "campos_faltantes": [], "origem": "llm"}},
+    ]
+    (tmp_path / "interacoes-atual-1.jsonl").write_text("".join(json.dumps(r) + "\n" for r in registros))
+    metricas = treinar(FakeEmbeddings(), tmp_path, tmp_path / "m.npz", holdout=0)
+    assert metricas["exemplos"] == 1
+    modelo = KnnTriageClassifier.carregar(tmp_path / "m.npz")
+    assert modelo.campos_faltantes == [["módulo"]]
@@ -0,0 +1,197 @@
+# triage_classifier.py
+# Triagem local (kNN sobre embeddings de mensagens já triadas) na frente da triagem por LLM
+#
+# Treino/atualização a partir das triagens feitas pelo LLM, lidas do log de interações da API
+# (interaction_log.py):
+#   python triage_classifier.py treinar [--holdout 0.2]
+import os
+import json
+import random
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from interaction_log import INTERACOES_LOG_DIR, ler_registros
+
+TRIAGEM_MODELO_PATH = Path(os.getenv("TRIAGEM_MODELO_PATH", "./modelos/triagem_knn.npz"))
+
+
+class KnnTriageClassifier:
+    """Vizinhos mais próximos (cosseno) com voto ponderado pela similaridade.
+
+    Só responde quando a votação é folgada (confiança >= limiar) e o vizinho mais
+    próximo é realmente parecido (similaridade >= similaridade_minima); caso contrário
+    retorna None e a triagem segue para o LLM.
+
+    Em PEDIR_INFO, os campos faltantes são os do vizinho mais próximo com essa decisão;
+    modelos treinados sem os campos (versões antigas) deixam PEDIR_INFO para o LLM.
+    """
+
+    def __init__(self, vetores: np.ndarray, decisoes: List[str], urgencias: List[str],
+                 campos_faltantes: Optional[List[List[str]]] = None,
+                 k: int = 7, limiar: float = 0.9, similaridade_minima: float = 0.8,
+                 metricas: Optional[Dict] = None):
+        normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+        self.vetores = (vetores / np.maximum(normas, 1e-12)).astype(np.float32)
+        self.decisoes = np.asarray(decisoes)
+        self.urgencias = np.asarray(urgencias)
+        self.campos_faltantes = campos_faltantes
+        self.k = k
+        self.limiar = limiar
+        self.similaridade_minima = similaridade_minima
+        self.metricas = metricas or {}
+        self.total = 0
+        self.atendidas = 0
+        self.mtime: Optional[float] = None # Do arquivo carregado, para detectar um novo treino
+
+    @classmethod
+    def carregar(cls, path: Path = TRIAGEM_MODELO_PATH, **kwargs) -> "KnnTriageClassifier":
+        mtime = path.stat().st_mtime
+        dados = np.load(path, allow_pickle=False)
+        # null (ou chave ausente) = modelo sem os campos faltantes, diferente de lista vazia
+        campos = json.loads(str(dados["campos_faltantes"])) if "campos_faltantes" in dados.files else None
+        modelo = cls(dados["vetores"], dados["decisoes"].tolist(), dados["urgencias"].tolist(), campos,
+                     metricas=json.loads(str(dados["metricas"])), **kwargs)
+        modelo.mtime = mtime
+        return modelo
+
+    def salvar(self, path: Path = TRIAGEM_MODELO_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp.npz")
+        np.savez_compressed(tmp_path, vetores=self.vetores, decisoes=self.decisoes,
+                            urgencias=self.urgencias, campos_faltantes=json.dumps(self.campos_faltantes),
+                            metricas=json.dumps(self.metricas))
+        os.replace(tmp_path, path)
+
+    def _votar(self, embedding) -> tuple:
+        vetor = np.asarray(embedding, dtype=np.float32)
+        vetor /= max(float(np.linalg.norm(vetor)), 1e-12)
+        similaridades = self.vetores @ vetor
+        k = min(self.k, len(similaridades))
+        vizinhos = np.argpartition(-similaridades, k - 1)[:k]
+        pesos = np.maximum(similaridades[vizinhos], 0)
+
+        votos: Dict[str, float] = {}
+        for i, peso in zip(vizinhos, pesos):
+            votos[self.decisoes[i]] = votos.get(self.decisoes[i], 0.0) + float(peso)
+        decisao = max(votos, key=votos.get)
+        confianca = votos[decisao] / max(sum(votos.values()), 1e-12)
+
+        votos_urgencia: Dict[str, float] = {}
+        for i, peso in zip(vizinhos, pesos):
+            if self.decisoes[i] == decisao:
+                votos_urgencia[self.urgencias[i]] = votos_urgencia.get(self.urgencias[i], 0.0) + float(peso)
+        urgencia = max(votos_urgencia, key=votos_urgencia.get)
+        mais_proximo = max((i for i in vizinhos if self.decisoes[i] == decisao), key=lambda i: similaridades[i])
+        return decisao, urgencia, confianca, float(similaridades[vizinhos].max()), int(mais_proximo)
+
+    def prever(self, embedding) -> Optional[Dict]:
+        """Retorna a triagem no formato do TriagemOut, ou None se não houver confiança suficiente."""
+        self.total += 1
+        if len(self.vetores) == 0:
+            return None
+        decisao, urgencia, confianca, similaridade, mais_proximo = self._votar(embedding)
+        if confianca < self.limiar or similaridade < self.similaridade_minima:
+            return None
+        campos = []
+        if decisao == "PEDIR_INFO":
+            if self.campos_faltantes is None or mais_proximo >= len(self.campos_faltantes):
+                return None
+            campos = list(self.campos_faltantes[mais_proximo])
+        self.atendidas += 1
+        return {"decisao": str(decisao), "urgencia": str(urgencia), "campos_faltantes": campos}
+
+    def estatisticas(self) -> Dict:
+        return {
+            "total": self.total,
+            "atendidas_localmente": self.atendidas,
+            "fracao_local": self.atendidas / self.total if self.total else 0.0,
+            "limiar": self.limiar,
+            "exemplos": int(len(self.vetores)),
+            "treino": self.metricas,
+        }
+
+
+def _decisoes_do_llm(interacoes_dir: Path):
+    # Só triagens feitas agora pelo LLM: as do classificador local realimentariam o próprio modelo
+    # e as de respostas em cache pertencem a outra pergunta (hit semântico)
+    for registro in ler_registros(interacoes_dir, tipo="chat"):
+        triagem = registro.get("triagem") or {}
+        if registro.get("cache") == "MISS" and triagem.get("origem") == "llm":
+            yield {"ts": registro.get("ts", ""), "pergunta": registro["pergunta"],
+                   "decisao": triagem["decisao"], "urgencia": triagem["urgencia"],
+                   "campos_faltantes": triagem.get("campos_faltantes") or []}
+
+
+def _carregar_exemplos(interacoes_dir: Path) -> List[Dict]:
+    # Uma pergunta repetida vale uma vez só (fica a decisão mais recente, pelo "ts": os
+    # arquivos dos vários workers não vêm em ordem estrita)
+    exemplos = {}
+    for registro in _decisoes_do_llm(interacoes_dir):
+        chave = registro["pergunta"].strip().lower()
+        anterior = exemplos.get(chave)
+        if anterior is None or registro["ts"] >= anterior["ts"]:
+            exemplos[chave] = registro
+    return list(exemplos.values())
+
+
+def treinar(embeddings, interacoes_dir: Path = INTERACOES_LOG_DIR, modelo_path: Path = TRIAGEM_MODELO_PATH,
+            holdout: float = 0.2, limiar: float = 0.9, seed: int = 42) -> Dict:
+    """Avalia o kNN num conjunto separado e salva o modelo treinado com todos os exemplos."""
+    exemplos = _carregar_exemplos(interacoes_dir)
+    if not exemplos:
+        raise ValueError(f"Nenhuma decisão de triagem do LLM registrada em {interacoes_dir}")
+    random.Random(seed).shuffle(exemplos)
+
+    # Mesma função de embedding usada em produção (consulta), com cache em disco
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        vetores = np.asarray(list(pool.map(embeddings.embed_query, [e["pergunta"] for e in exemplos])),
+                             dtype=np.float32)
+    decisoes = [e["decisao"] for e in exemplos]
+    urgencias = [e["urgencia"] for e in exemplos]
+    campos = [e["campos_faltantes"] for e in exemplos]
+
+    corte = int(len(exemplos) * (1 - holdout))
+    metricas = {"exemplos": len(exemplos), "treino": corte, "avaliacao": len(exemplos) - corte}
+    if 0 < corte < len(exemplos):
+        modelo = KnnTriageClassifier(vetores[:corte], decisoes[:corte], urgencias[:corte], campos[:corte],
+                                     limiar=limiar)
+        respondidas = concordantes = 0
+        for vetor, decisao in zip(vetores[corte:], decisoes[corte:]):
+            previsao = modelo.prever(vetor)
+            if previsao is not None:
+                respondidas += 1
+                concordantes += previsao["decisao"] == decisao
+        metricas["cobertura"] = respondidas / (len(exemplos) - corte)
+        metricas["concordancia_com_llm"] = concordantes / respondidas if respondidas else None
+
+    modelo = KnnTriageClassifier(vetores, decisoes, urgencias, campos, limiar=limiar, metricas=metricas)
+    modelo.salvar(modelo_path)
+    return metricas
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from embedding_cache import build_embeddings
+
+    parser = argparse.ArgumentParser(description="Classificador local de triagem")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_treinar = sub.add_parser("treinar", help="Treina/atualiza o modelo a partir das triagens do LLM")
+    p_treinar.add_argument("--interacoes", type=Path, default=INTERACOES_LOG_DIR, help="Diretório do log de interações")
+    p_treinar.add_argument("--modelo", type=Path, default=TRIAGEM_MODELO_PATH)
+    p_treinar.add_argument("--holdout", type=float, default=0.2, help="Fração reservada para avaliação")
+    p_treinar.add_argument("--limiar", type=float, default=0.9, help="Confiança mínima para dispensar o LLM")
+    args = parser.parse_args()
+
+    load_dotenv()
+    metricas = treinar(build_embeddings(os.getenv("GEMINI_KEY")), args.interacoes, args.modelo, args.holdout,
+                       args.limiar)
+    print(f"✅ Modelo salvo em '{args.modelo}' com {metricas['exemplos']} exemplos.")
+    if "cobertura" in metricas:
+        concordancia = metricas["concordancia_com_llm"]
+        print(f"  Avaliação ({metricas['avaliacao']} exemplos separados):")
+        print(f"  🎯 Respondidas localmente: {metricas['cobertura']:.1%}")
+        print(f"  🤝 Concordância com o LLM: {'-' if concordancia is None else f'{concordancia:.1%}'}")
@@ -0,0 +1,215 @@
+# vector_index.py
+# Tipos de índice FAISS para a busca (flat, HNSW, IVF-PQ) e carregamento via mmap
+#
+# Relatório de recall x latência de cada tipo contra o flat (busca exata):
+#   python vector_index.py relatorio [-k 10] [--consultas 200] [--max-vetores 50000]
+# Conferência de que o carregamento via mmap devolve o mesmo que o FAISS.load_local:
+#   python vector_index.py verificar [-k 10] [--consultas 200]
+import os
+import json
+import math
+import time
+import pickle
+import argparse
+from pathlib import Path
+from typing import Dict, List
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from mmap_docstore import MmapDocstore, IdsPorPosicao, existe_docstore
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+SEARCH_INDEX_META = "search_index.json" # Qual arquivo/tipo de índice a API deve usar
+
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", 100_000))
+IVF_MIN_VECTORS = 10_000 # Abaixo disso não há pontos suficientes para treinar IVF + PQ
+IVF_PONTOS_POR_LISTA = 39 # Mínimo de pontos de treino por centróide que o k-means do FAISS aceita sem aviso
+RELATORIO_MAX_VETORES = int(os.getenv("RELATORIO_MAX_VETORES", 50_000)) # Amostra do corpus no relatório
+
+
+def _pq_subquantizers(d: int) -> int:
+    # Maior divisor de d que não passa de 64 (códigos de 64 bytes por vetor)
+    return max(m for m in range(1, min(d, 64) + 1) if d % m == 0)
+
+
+def construir_indice(tipo: str, vetores: np.ndarray) -> faiss.Index:
+    """Cria um índice do tipo pedido com os vetores, na mesma ordem (posição i = vetor i)."""
+    n, d = vetores.shape
+    if tipo == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif tipo == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif tipo == "ivfpq":
+        # Treina com uma amostra; o k-means do IVF e do PQ não precisa do corpus inteiro
+        amostra = vetores
+        if n > IVF_TRAIN_SAMPLE:
+            amostra = vetores[np.random.default_rng(0).choice(n, IVF_TRAIN_SAMPLE, replace=False)]
+        # 4 * sqrt(n) listas, limitado pelo que a amostra de treino consegue treinar bem
+        nlist = max(1, min(int(4 * math.sqrt(n)), len(amostra) // IVF_PONTOS_POR_LISTA))
+        index = faiss.index_factory(d, f"IVF{nlist},PQ{_pq_subquantizers(d)}")
+        # Treino polissêmico só serve à busca por distância de Hamming, que não usamos, e é a parte mais lenta
+        faiss.downcast_index(faiss.extract_index_ivf(index)).do_polysemous_training = False
+        index.train(amostra)
+    else:
+        raise ValueError(f"Tipo de índice inválido: {tipo}. Use um de {INDEX_TYPES}")
+    index.add(vetores)
+    return index
+
+
+def configurar_busca(index: faiss.Index, tipo: str, ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE):
+    if tipo == "hnsw":
+        index.hnsw.efSearch = ef_search
+    elif tipo == "ivfpq":
+        faiss.extract_index_ivf(index).nprobe = nprobe
+
+
+def escrever_indice_busca(flat_index: faiss.Index, tipo: str, destino: Path) -> str:
+    """Gera, a partir do índice flat (mestre das atualizações incrementais), o índice de busca.
+
+    O flat continua em index.faiss; HNSW e IVF-PQ vão para index.<tipo>.faiss. O tipo efetivo
+    fica em search_index.json para a API.
+    """
+    if tipo == "ivfpq" and flat_index.ntotal < IVF_MIN_VECTORS:
+        print(f"⚠️ Só {flat_index.ntotal} vetores: poucos para treinar IVF-PQ, usando índice flat.")
+        tipo = "flat"
+
+    arquivo = "index.faiss"
+    if tipo != "flat":
+        arquivo = f"index.{tipo}.faiss"
+        vetores = flat_index.reconstruct_n(0, flat_index.ntotal)
+        faiss.write_index(construir_indice(tipo, vetores), str(destino / f".{arquivo}.tmp"))
+        os.replace(destino / f".{arquivo}.tmp", destino / arquivo)
+
+    # Remove índices de busca de tipos usados antes
+    for outro in INDEX_TYPES:
+        if outro not in ("flat", tipo):
+            (destino / f"index.{outro}.faiss").unlink(missing_ok=True)
+    (destino / SEARCH_INDEX_META).write_text(json.dumps({"tipo": tipo, "arquivo": arquivo}), encoding="utf-8")
+    return tipo
+
+
+def _ler_indice_mmap(path: Path, tipo: str) -> faiss.Index:
+    # Flat/HNSW: vetores mapeados direto do arquivo; IVF: listas invertidas em disco (OnDisk)
+    if tipo == "ivfpq":
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(path), flags)
+    except RuntimeError as e:
+        print(f"⚠️ Não foi possível mapear '{path}' em memória ({e}); carregando o arquivo inteiro.")
+        return faiss.read_index(str(path))
+
+
+def load_vectorstore(path: Path, embeddings) -> FAISS:
+    """Equivalente ao FAISS.load_local, mas com o índice do tipo configurado e mapeado via mmap.
+
+    Vetores e chunks ficam em arquivos mapeados (page cache compartilhado entre os workers
+    do uvicorn). O índice carregado é somente leitura: a API nunca adiciona vetores.
+    """
+    meta = {"tipo": "flat", "arquivo": "index.faiss"}
+    if (path / SEARCH_INDEX_META).exists():
+        meta = json.loads((path / SEARCH_INDEX_META).read_text(encoding="utf-8"))
+    index = _ler_indice_mmap(path / meta["arquivo"], meta["tipo"])
+    configurar_busca(index, meta["tipo"])
+    if existe_docstore(path):
+        docstore = MmapDocstore(path)
+        return FAISS(embeddings, index, docstore, IdsPorPosicao(docstore.ids))
+    # Versões gravadas antes do docstore mapeado: mesmo formato do FAISS.save_local
+    with open(path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def verificar(path: Path, k: int = 10, n_consultas: int = 200, seed: int = 0) -> Dict:
+    """Compara, para as mesmas consultas, os resultados do load_vectorstore com os do FAISS.load_local."""
+    from fake_models import FakeEmbeddings
+    # A busca é feita direto por vetor; os embeddings só são exigidos pelo construtor
+    original = FAISS.load_local(str(path), FakeEmbeddings(), allow_dangerous_deserialization=True)
+    mapeado = load_vectorstore(path, FakeEmbeddings())
+    vetores = original.index.reconstruct_n(0, original.index.ntotal)
+    rng = np.random.default_rng(seed)
+    consultas = vetores[rng.choice(len(vetores), min(n_consultas, len(vetores)), replace=False)]
+    iguais = 0
+    for q in consultas:
+        a = original.similarity_search_with_score_by_vector(q, k=k)
+        b = mapeado.similarity_search_with_score_by_vector(q, k=k)
+        iguais += [(d.id, d.page_content, d.metadata) for d, _ in a] == [(d.id, d.page_content, d.metadata) for d, _ in b]
+    return {"consultas": len(consultas), "iguais": iguais}
+
+
+def relatorio(path: Path, k: int = 10, n_consultas: int = 200, seed: int = 0,
+              max_vetores: int = RELATORIO_MAX_VETORES) -> List[Dict]:
+    """Recall@k e latência por consulta de cada tipo/parâmetro, tendo o flat como referência.
+
+    Corpus maiores que `max_vetores` são comparados numa amostra desse tamanho (o flat de
+    referência é refeito sobre ela), para o relatório não levar o tempo de uma reindexação.
+    """
+    flat = faiss.read_index(str(path / "index.faiss"))
+    vetores = flat.reconstruct_n(0, flat.ntotal)
+    rng = np.random.default_rng(seed)
+    if len(vetores) > max_vetores:
+        vetores = vetores[np.sort(rng.choice(len(vetores), max_vetores, replace=False))]
+        flat = construir_indice("flat", vetores)
+    # Consultas: vetores do corpus com ruído, para não reduzir o teste a achar o próprio vetor
+    consultas = vetores[rng.choice(len(vetores), min(n_consultas, len(vetores)), replace=False)]
+    consultas = consultas + rng.normal(0, 0.1 * float(np.linalg.norm(consultas, axis=1).mean()) / math.sqrt(consultas.shape[1]),
+                                       consultas.shape).astype(np.float32)
+    _, verdade = flat.search(consultas, k)
+
+    def medir(nome, parametro, index):
+        latencias, acertos = [], 0
+        for i, q in enumerate(consultas):
+            inicio = time.perf_counter()
+            _, ids = index.search(q[None, :], k)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            acertos += len(set(ids[0]) & set(verdade[i]))
+        return {"tipo": nome, "parametro": parametro, f"recall@{k}": acertos / (k * len(consultas)),
+                "p50_ms": float(np.percentile(latencias, 50)), "p95_ms": float(np.percentile(latencias, 95)),
+                "tamanho_mb": len(faiss.serialize_index(index)) / 2**20}
+
+    linhas = [medir("flat", "-", flat)]
+    hnsw = construir_indice("hnsw", vetores)
+    for ef in (16, 32, 64, 128, 256):
+        configurar_busca(hnsw, "hnsw", ef_search=ef)
+        linhas.append(medir("hnsw", f"efSearch={ef}", hnsw))
+    if len(vetores) >= IVF_MIN_VECTORS:
+        ivfpq = construir_indice("ivfpq", vetores)
+        for nprobe in (1, 4, 16, 64):
+            configurar_busca(ivfpq, "ivfpq", nprobe=nprobe)
+            linhas.append(medir("ivfpq", f"nprobe={nprobe}", ivfpq))
+    return linhas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índices FAISS para a busca vetorial")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_rel = sub.add_parser("relatorio", help="Recall x latência de HNSW e IVF-PQ contra o flat")
+    p_rel.add_argument("--vector-store", type=Path, default=Path("./vector_store/"))
+    p_rel.add_argument("-k", type=int, default=10)
+    p_rel.add_argument("--consultas", type=int, default=200)
+    p_rel.add_argument("--max-vetores", type=int, default=RELATORIO_MAX_VETORES, help="Amostra máxima do corpus")
+    p_ver = sub.add_parser("verificar", help="Confere se o índice mapeado devolve o mesmo que o FAISS.load_local")
+    p_ver.add_argument("--vector-store", type=Path, default=Path("./vector_store/"))
+    p_ver.add_argument("-k", type=int, default=10)
+    p_ver.add_argument("--consultas", type=int, default=200)
+    args = parser.parse_args()
+
+    from index_versions import diretorio_publicado
+    if args.comando == "verificar":
+        resultado = verificar(diretorio_publicado(args.vector_store), args.k, args.consultas)
+        print(f"Resultados idênticos em {resultado['iguais']}/{resultado['consultas']} consultas (top-{args.k}).")
+        raise SystemExit(0 if resultado["iguais"] == resultado["consultas"] else 1)
+
+    linhas = relatorio(diretorio_publicado(args.vector_store), args.k, args.consultas, max_vetores=args.max_vetores)
+    print(f"{'tipo':<7} {'parâmetro':<14} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'MB':>8}")
+    for l in linhas:
+        print(f"{l['tipo']:<7} {l['parametro']:<14} {l[f'recall@{args.k}']:>10.3f} "
+              f"{l['p50_ms']:>8.3f} {l['p95_ms']:>8.3f} {l['tamanho_mb']:>8.1f}")